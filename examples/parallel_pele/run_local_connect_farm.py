@@ -0,0 +1,21 @@
+"""run connect jobs on all cores of this machine, without Pyro"""
+from __future__ import print_function
+from pele.systems import LJCluster
+from pele.concurrent import LocalConnectFarm
+
+
+def main():
+    natoms = 38
+    system = LJCluster(natoms)
+    db = system.create_database("lj38.sqlite")
+    if db.number_of_minima() < 2:
+        print("there are not enough minima in the database.  Start a basinhopping run to generate minima")
+        return
+
+    farm = LocalConnectFarm(system, db, strategy="combine")
+    farm.run(100)
+    print(db.number_of_minima(), "minima and", db.number_of_transition_states(), "transition states")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,38 @@
 # -*- coding: iso-8859-1 -*-
 import sys
+import os
+import time
+import pickle
+from collections import deque
+
+import numpy as np
+
 from pele.mc import MonteCarlo
-from pele.optimize import mylbfgs
+from pele.optimize import mylbfgs, Result
+from pele.utils.fork_pool import ForkedFunctionPool
+
+_checkpoint_version = 1
+
+
+class _CheckpointEvent(object):
+    """event_after_step which writes a checkpoint every `interval` steps
+    or every `time_interval` seconds"""
+    def __init__(self, bh, path, interval=None, time_interval=None):
+        self.bh = bh
+        self.path = path
+        self.interval = interval
+        self.time_interval = time_interval
+        self.last_time = time.time()
+
+    def __call__(self, energy, coords, acceptstep):
+        write = False
+        if self.interval is not None and self.bh.stepnum % self.interval == 0:
+            write = True
+        if self.time_interval is not None and time.time() - self.last_time >= self.time_interval:
+            write = True
+        if write:
+            self.bh.checkpoint(self.path)
+            self.last_time = time.time()
 
 class BasinHopping(MonteCarlo):
     """
@@ -14,6 +45,13 @@ class BasinHopping(MonteCarlo):
         Use this quencher as default
     insert_rejected : bool
         insert the rejected structure into the storage class
+    nspeculative : int, optional
+        if greater than 1, use speculative batched quenching.  nspeculative
+        trial steps are taken from the current coordinates and quenched
+        concurrently in a pool of worker processes.  The trials are then
+        replayed through the acceptance test one by one, exactly as in the serial
+        algorithm.  As soon as one trial is accepted the remaining ones are
+        discarded, because they were generated from the old coordinates.
     
     Notes
     -----
@@ -33,6 +71,18 @@ class BasinHopping(MonteCarlo):
     The acceptance test used here is the Metropolis criterion of standard Monte
     Carlo algorithms, although there are many other possibilities [3]_.
 
+    In speculative mode (nspeculative > 1) every trial is still a perturbation
+    of the current Markov chain coordinates and every decision is made in
+    order with the current Markov energy, so the chain is statistically
+    identical to the serial one.  The work spent on discarded trials is
+    recorded in the attributes `nspeculative_quenched`,
+    `nspeculative_wasted` and `nfev_wasted`.  Note that changes made by an
+    adaptive step taking routine only take effect with the next batch of
+    trials.  Call `close()` to stop the worker processes.
+
+    A long run can be saved with `checkpoint()` (or periodically with
+    `enable_checkpointing()`) and continued with `BasinHopping.resume()`.
+
     This global minimization method has been shown to be extremely efficient
     for a wide variety of problems in physics and chemistry.  It is
     particularly useful when the function has many minima separated by large
@@ -50,7 +100,8 @@ class BasinHopping(MonteCarlo):
     """
 
     def __init__(self, coords, potential, takeStep, storage=None, event_after_step=None, acceptTest=None,
-                 temperature=1.0, quench=None, confCheck=None, outstream=sys.stdout, insert_rejected=False):
+                 temperature=1.0, quench=None, confCheck=None, outstream=sys.stdout, insert_rejected=False,
+                 nspeculative=1):
         #########################################################################
         # initialize MonteCarlo base class
         #########################################################################
@@ -63,6 +114,13 @@ class BasinHopping(MonteCarlo):
         if quench is None:
             quench = lambda coords : mylbfgs(coords, self.potential)
         self.quench = quench
+
+        self.nspeculative = nspeculative
+        self._speculative_pool = None
+        self._speculative_trials = deque()
+        self.nspeculative_quenched = 0
+        self.nspeculative_wasted = 0
+        self.nfev_wasted = 0
                 
         #########################################################################
         # do initial quench
@@ -96,17 +154,26 @@ class BasinHopping(MonteCarlo):
 
         overload the MonteCarlo base class step
         """
-        self.coords_after_step = self.coords.copy() # make  a working copy
-        #########################################################################
-        # take step
-        #########################################################################
-        self.takeStep.takeStep(self.coords_after_step, driver=self)
+        profiler = self.profiler
+        if profiler is not None: t = profiler.timer()
+        if self.nspeculative > 1:
+            self.coords_after_step, res = self._next_speculative_trial()
+        else:
+            self.coords_after_step = self.coords.copy() # make  a working copy
+            #########################################################################
+            # take step
+            #########################################################################
+            self.takeStep.takeStep(self.coords_after_step, driver=self)
+            if profiler is not None: t = profiler.lap("takestep", t)
 
-        #########################################################################
-        # quench
-        #########################################################################
-        res = self.quench(self.coords_after_step)
+            #########################################################################
+            # quench
+            #########################################################################
+            res = self.quench(self.coords_after_step)
         self.result.nfev += res.nfev
+        if profiler is not None:
+            t = profiler.lap("quench", t)
+            profiler.add_nfev(res.nfev)
 #        if isinstance(res, tuple): # for compatability with old and new quenchers
 #            res = res[4]
         self.trial_coords = res.coords
@@ -123,6 +190,7 @@ class BasinHopping(MonteCarlo):
             if not check(self.trial_energy, self.trial_coords, driver=self):
                 self.acceptstep=False
                 self.config_ok = False
+        if profiler is not None: t = profiler.lap("confcheck", t)
         
         #########################################################################
         # check whether step is accepted with user defined tests.  If any returns
@@ -131,26 +199,206 @@ class BasinHopping(MonteCarlo):
         if self.acceptstep:
             self.acceptstep = self.acceptTest(self.markovE, self.trial_energy,
                                               self.coords, self.trial_coords)
+        if profiler is not None: profiler.lap("accept", t)
+
+        # the remaining speculative trials were generated from the old coordinates
+        if self.acceptstep:
+            self._discard_speculative_trials()
 
         #########################################################################
         # return new coords and energy and whether or not they were accepted
         #########################################################################
         return self.acceptstep, self.trial_coords, self.trial_energy
 
+    def _next_speculative_trial(self):
+        """return the next (coords_after_step, quench_result) pair
+
+        if no trials are left, take nspeculative steps from the current
+        coordinates and quench them all in parallel
+        """
+        if len(self._speculative_trials) == 0:
+            if self._speculative_pool is None:
+                self._speculative_pool = ForkedFunctionPool(self.quench, self.nspeculative)
+            trial_coords = []
+            for i in range(self.nspeculative):
+                coords = self.coords.copy()
+                self.takeStep.takeStep(coords, driver=self)
+                trial_coords.append(coords)
+            results = self._speculative_pool.map([(coords,) for coords in trial_coords])
+            self.nspeculative_quenched += len(results)
+            self._speculative_trials.extend(zip(trial_coords, results))
+        return self._speculative_trials.popleft()
+
+    def _discard_speculative_trials(self):
+        for coords, res in self._speculative_trials:
+            self.nspeculative_wasted += 1
+            self.nfev_wasted += res.nfev
+        self._speculative_trials.clear()
+
+    def close(self):
+        """stop the worker processes used for speculative quenching"""
+        self._discard_speculative_trials()
+        if self._speculative_pool is not None:
+            self._speculative_pool.close()
+            self._speculative_pool = None
+
+
+    def checkpoint(self, path):
+        """save the state of the run so it can be continued with `resume()`
+
+        The snapshot contains the markov chain, the results, the step taking
+        and accept test objects (including any adaptive state such as the step
+        size and the temperature) and the state of the numpy random number
+        generator.  The potential, the quench routine, the storage, the events
+        and confCheck are not saved, they are passed again to `resume()`.
+
+        The snapshot is written to a temporary file which is then renamed, so
+        an existing checkpoint is never left half written.
+
+        See Also
+        --------
+        resume, enable_checkpointing
+        """
+        acceptTest = self.acceptTest
+        global_random = getattr(acceptTest, "random", None) == np.random.rand
+        if global_random:
+            # a pickled np.random.rand would be detached from the global generator
+            acceptTest.random = None
+        try:
+            state = dict(version=_checkpoint_version,
+                         coords=self.coords,
+                         markovE=self.markovE,
+                         stepnum=self.stepnum,
+                         naccepted=self.naccepted,
+                         temperature=self.temperature,
+                         rms=self.rms,
+                         funcalls=self.funcalls,
+                         insert_rejected=self.insert_rejected,
+                         printfrq=self.printfrq,
+                         result=dict(self.result),
+                         takeStep=self.takeStep,
+                         acceptTest=acceptTest,
+                         global_random=global_random,
+                         random_state=np.random.get_state(),
+                         nspeculative=self.nspeculative,
+                         speculative_trials=list(self._speculative_trials),
+                         nspeculative_quenched=self.nspeculative_quenched,
+                         nspeculative_wasted=self.nspeculative_wasted,
+                         nfev_wasted=self.nfev_wasted,
+                         )
+            tmppath = path + ".tmp"
+            with open(tmppath, "wb") as fout:
+                pickle.dump(state, fout, pickle.HIGHEST_PROTOCOL)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.rename(tmppath, path)
+        finally:
+            if global_random:
+                acceptTest.random = np.random.rand
+
+    def enable_checkpointing(self, path, interval=None, time_interval=None):
+        """write a checkpoint every `interval` steps or `time_interval` seconds
+
+        The checkpoints are written by an event added to `event_after_step`.
+        Events are not part of the checkpoint, so call this again after
+        `resume()` to continue writing checkpoints.
+        """
+        if interval is None and time_interval is None:
+            raise ValueError("either interval or time_interval must be given")
+        event = _CheckpointEvent(self, path, interval=interval, time_interval=time_interval)
+        self.addEventAfterStep(event)
+        return event
+
+    @classmethod
+    def resume(cls, path, system=None, potential=None, quench=None, storage=None,
+               database=None, event_after_step=None, confCheck=None, outstream=sys.stdout,
+               restore_random_state=True):
+        """continue a run from a file written by `checkpoint()`
+
+        The object is built with the constructor and then the saved state is
+        restored.  By default the state of the global numpy random number
+        generator is restored as well, so with a deterministic quench the
+        resumed run follows exactly the same trajectory as a run which was
+        never interrupted.  Note that this replaces the state of
+        `np.random` for the whole program.
+
+        Parameters
+        ----------
+        path : str
+            the checkpoint file
+        system : BaseSystem, optional
+            used to create the potential and the quench routine if they are
+            not passed explicitly
+        potential, quench : optional
+        storage : callable, optional
+            the storage of the new run.  If None and `database` is given,
+            use `database.minimum_adder()`
+        database : Database, optional
+        event_after_step, confCheck, outstream : optional
+            as for the constructor
+        restore_random_state : bool, optional
+            if False, leave the global numpy random number generator alone
+
+        Returns
+        -------
+        bh : BasinHopping
+        """
+        with open(path, "rb") as fin:
+            state = pickle.load(fin)
+        if state.get("version") != _checkpoint_version:
+            raise IOError("unsupported checkpoint version in %s" % path)
+        if potential is None:
+            if system is None:
+                raise ValueError("either system or potential must be given")
+            potential = system.get_potential()
+        if quench is None and system is not None:
+            quench = system.get_minimizer()
+        if storage is None and database is not None:
+            storage = database.minimum_adder()
+
+        acceptTest = state["acceptTest"]
+        if state["global_random"]:
+            acceptTest.random = np.random.rand
+        # the storage is set afterwards, so the initial quench is not stored again
+        self = cls(state["coords"], potential, state["takeStep"], storage=None,
+                   event_after_step=event_after_step, acceptTest=acceptTest,
+                   temperature=state["temperature"], quench=quench, confCheck=confCheck,
+                   outstream=outstream, insert_rejected=state["insert_rejected"],
+                   nspeculative=state["nspeculative"])
+        self.storage = storage
+
+        self.coords = state["coords"]
+        self.markovE = state["markovE"]
+        self.markovE_old = self.markovE
+        self.stepnum = state["stepnum"]
+        self.naccepted = state["naccepted"]
+        self.rms = state["rms"]
+        self.funcalls = state["funcalls"]
+        self.printfrq = state["printfrq"]
+        self.result = Result()
+        self.result.update(state["result"])
+        self._speculative_trials = deque(state["speculative_trials"])
+        self.nspeculative_quenched = state["nspeculative_quenched"]
+        self.nspeculative_wasted = state["nspeculative_wasted"]
+        self.nfev_wasted = state["nfev_wasted"]
+        if restore_random_state:
+            np.random.set_state(state["random_state"])
+        return self
 
     def printStep(self):
         if self.stepnum % self.printfrq == 0:
             if self.outstream != None:
-                self.outstream.write("Qu   " + str(self.stepnum) + " E= " +
-                                     str(self.trial_energy) + " quench_steps= " +
-                                     str(self.funcalls) + " RMS= " + str(self.rms) + 
-                                     " Markov E= " + str(self.markovE_old) + 
-                                     " accepted= " + str(self.acceptstep) + "\n" )
+                self.outstream.write("Qu   %s E= %s quench_steps= %s RMS= %s Markov E= %s accepted= %s\n"
+                                     % (self.stepnum, self.trial_energy, self.funcalls, self.rms,
+                                        self.markovE_old, self.acceptstep))
     
     def __getstate__(self):
         ddict = self.__dict__.copy()
         del ddict["outstream"]
         del ddict["potential"]
+        ddict["_speculative_pool"] = None
+        # the profiler holds an output stream
+        ddict["profiler"] = None
         return ddict
     
     def __setstate__(self, dct):
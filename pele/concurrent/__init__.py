@@ -21,6 +21,19 @@ An arbitrary number of workers can connect to the server and process the connect
     ConnectWorker
 
 
+On a single machine the connect jobs can be run in a process pool instead,
+without Pyro4, a server or separately started workers.
+
+.. autosummary::
+   :toctree: generated/
+
+    LocalConnectFarm
+
+::
+
+    >>> farm = LocalConnectFarm(system, database, nproc=4)
+    >>> farm.run(100) #  run 100 connect jobs, 4 at a time
+
 Usage
 -----
 see the example in the examples/connecting_in_parallel/ folder for more details.
@@ -45,4 +58,5 @@ specify the hostname to connect to in worker.py and submit as many jobs a needed
 from __future__ import absolute_import
 
 from ._connect_server import *
+from ._local_farm import *
 
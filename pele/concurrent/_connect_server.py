@@ -1,16 +1,68 @@
 from __future__ import print_function
-from . import Pyro4
+import threading
+import time
+import itertools
+from collections import deque
+from io import BytesIO
+
+import numpy as np
+
+try:
+    import Pyro4
+except ImportError:
+    Pyro4 = None
 
 from pele.landscape import ConnectManager
 
 
 __all__ = ["ConnectServer", "ConnectWorker", "BasinhoppingWorker"]
 
-# we need to run pyros in multiplex mode, otherwise we run into problems with 
-# SQLAlchemy. This is due to the fact that a session can only be used from one
-# thread. We really should fix this issue and allow for multiple sessions!
-Pyro4.config.SERVERTYPE = "multiplex"
-        
+
+def _check_pyro():
+    if Pyro4 is None:
+        raise ImportError("Pyro4 is needed to run connect jobs on a server, "
+                          "use LocalConnectFarm to run them on this machine")
+
+
+def _pack_job_results(minima, transition_states, gids):
+    """pack the minima and transition states found in a connect job into bytes
+
+    The arrays are stored in a compressed numpy npz archive.  The transition
+    states refer to the minima by their index in `minima`, which must
+    contain the minima of all transition states.  gids maps the minima whose
+    server-side id is known to that id.
+    """
+    index = dict((m, i) for i, m in enumerate(minima))
+    ndof = np.size(minima[0].coords) if minima else 0
+    nts = len(transition_states)
+    ts_eigenvec = np.empty((nts, ndof))
+    ts_eigenvec.fill(np.nan)
+    for i, ts in enumerate(transition_states):
+        if ts.eigenvec is not None:
+            ts_eigenvec[i] = np.ravel(ts.eigenvec)
+    arrays = dict(
+        min_energy=np.array([m.energy for m in minima], dtype=float),
+        min_coords=np.array([np.ravel(m.coords) for m in minima], dtype=float).reshape(-1, ndof),
+        min_gid=np.array([gids.get(m, -1) for m in minima], dtype=np.int64),
+        ts_energy=np.array([ts.energy for ts in transition_states], dtype=float),
+        ts_coords=np.array([np.ravel(ts.coords) for ts in transition_states],
+                           dtype=float).reshape(-1, ndof),
+        ts_min=np.array([(index[ts.minimum1], index[ts.minimum2]) for ts in transition_states],
+                        dtype=np.int64).reshape(-1, 2),
+        ts_eigenval=np.array([np.nan if ts.eigenval is None else ts.eigenval
+                              for ts in transition_states], dtype=float),
+        ts_eigenvec=ts_eigenvec,
+    )
+    buf = BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+
+def _unpack_job_results(data):
+    """return the arrays packed by `_pack_job_results` as a dict"""
+    with np.load(BytesIO(data)) as arrays:
+        return dict((name, arrays[name]) for name in arrays.files)
+
 
 class ConnectServer(object):
     """
@@ -33,6 +85,25 @@ class ConnectServer(object):
         from remote machines
     port : integer, optional
         port to listen for connections
+    lease_timeout : float, optional
+        the number of seconds a worker has to return the results of a connect
+        job leased with `lease_connect_jobs`.  Jobs which are not finished in
+        time, e.g. because the worker crashed, are handed out again.
+
+    Notes
+    -----
+    A session of a Database can only be used from one thread, so the Pyro
+    server runs in multiplex mode and handles one request at a time.  If the
+    database was created with `concurrent=True` every thread has its own
+    session, and a threaded Pyro server is used which serves many workers
+    at once.
+
+    The workers lease several jobs at once with `lease_connect_jobs` and send
+    everything found in a job back in one compressed message with
+    `submit_connect_results`, which is added to the database in a single
+    transaction.  The older one request per job, minimum and transition
+    state methods (`get_connect_job`, `add_minimum`, `add_ts`) are still
+    available.
 
     See Also
     --------
@@ -40,14 +111,24 @@ class ConnectServer(object):
     pele.landscape.ConnectManager
     """
     
-    def __init__(self, system, database, server_name=None, host=None, port=0):
+    def __init__(self, system, database, server_name=None, host=None, port=0,
+                 lease_timeout=3600.):
         self.system = system
         self.db = database
         self.server_name = server_name
         self.host=host
         self.port=port
+        self.lease_timeout = lease_timeout
         
         self.connect_manager = ConnectManager(self.db)
+        # the connect manager is not thread safe
+        self._lock = threading.Lock()
+
+        # job id -> (expiry time, id1, id2) of the jobs handed out to workers
+        self._leases = dict()
+        # the minima ids of the jobs whose lease expired
+        self._requeued = deque()
+        self._job_ids = itertools.count()
 
     def set_connect_manager(self, connect_manager):
         """add a custom connect manager
@@ -62,8 +143,102 @@ class ConnectServer(object):
 
     def get_connect_job(self, strategy="random"):
         """ get a new connect job """
-        min1, min2 = self.connect_manager.get_connect_job(strategy)
-        return min1.id(), min1.coords, min2.id(), min2.coords
+        with self._lock:
+            min1, min2 = self.connect_manager.get_connect_job(strategy)
+            return min1.id(), min1.coords, min2.id(), min2.coords
+
+    def _requeue_expired(self):
+        now = time.time()
+        for job_id, (expiry, id1, id2) in list(self._leases.items()):
+            if expiry < now:
+                print("connect job", job_id, "was not finished in time, handing it out again")
+                del self._leases[job_id]
+                self._requeued.append((id1, id2))
+
+    def lease_connect_jobs(self, njobs, strategy="random"):
+        """lease up to njobs connect jobs
+
+        The results of each job must be returned with
+        `submit_connect_results` within `lease_timeout` seconds, else the
+        job is given to another worker.
+
+        Returns
+        -------
+        jobs : list
+            a tuple `(job_id, id1, E1, coords1, id2, E2, coords2)` for each
+            job.  The list is shorter than njobs, or empty, if the connect
+            manager ran out of minima to connect.
+        """
+        jobs = []
+        with self._lock:
+            self._requeue_expired()
+            while len(jobs) < njobs:
+                if self._requeued:
+                    id1, id2 = self._requeued.popleft()
+                    min1, min2 = self.db.getMinimum(id1), self.db.getMinimum(id2)
+                    if min1 is None or min2 is None:
+                        continue
+                else:
+                    try:
+                        min1, min2 = self.connect_manager.get_connect_job(strategy)
+                    except ConnectManager.NoMoreConnectionsError:
+                        break
+                    if min1 is None or min2 is None:
+                        break
+                job_id = next(self._job_ids)
+                self._leases[job_id] = (time.time() + self.lease_timeout, min1.id(), min2.id())
+                jobs.append((job_id, min1.id(), min1.energy, np.asarray(min1.coords),
+                             min2.id(), min2.energy, np.asarray(min2.coords)))
+        return jobs
+
+    def submit_connect_results(self, job_id, data):
+        """add everything a worker found in a connect job to the database
+
+        Parameters
+        ----------
+        job_id : int
+            the id of the leased job
+        data : bytes
+            the minima and transition states packed by the worker
+
+        Returns
+        -------
+        ids : list
+            the global ids of the packed minima
+        """
+        results = _unpack_job_results(data)
+        with self._lock:
+            self._leases.pop(job_id, None)
+            db = self.db
+            minima = [None] * len(results["min_energy"])
+            new = []
+            for i, (E, coords, gid) in enumerate(zip(results["min_energy"],
+                                                     results["min_coords"],
+                                                     results["min_gid"])):
+                if gid >= 0:
+                    minima[i] = db.getMinimum(int(gid))
+                if minima[i] is None:
+                    new.append(i)
+            added = db.add_minima([(results["min_energy"][i], results["min_coords"][i])
+                                   for i in new], commit=False)
+            for i, m in zip(new, added):
+                minima[i] = m
+            ts_rows = []
+            for E, coords, (i1, i2), eigenval, eigenvec in zip(
+                    results["ts_energy"], results["ts_coords"], results["ts_min"],
+                    results["ts_eigenval"], results["ts_eigenvec"]):
+                row = dict(energy=E, coords=coords, min1=minima[i1], min2=minima[i2])
+                if not np.isnan(eigenval):
+                    row["eigenval"] = eigenval
+                if not np.isnan(eigenvec).all():
+                    row["eigenvec"] = eigenvec
+                ts_rows.append(row)
+            db.add_transition_states(ts_rows, commit=False)
+            db.session.commit()
+            ids = [m.id() for m in minima]
+        print("a client finished connect job", job_id, "with", len(new), "minima and",
+              len(ts_rows), "transition states")
+        return ids
 
     def get_system(self):
         """ provide system class to worker """
@@ -107,7 +282,12 @@ class ConnectServer(object):
 
     def run(self):
         """ start the server and listen for incoming connections """
+        _check_pyro()
         print("Starting Pyros daemon")
+        if self.db.concurrent:
+            Pyro4.config.SERVERTYPE = "thread"
+        else:
+            Pyro4.config.SERVERTYPE = "multiplex"
         daemon=Pyro4.Daemon(host=self.host, port=self.port)
         # make the connect_server available to Pyros children
         uri=daemon.register(self, objectId=self.server_name)
@@ -133,6 +313,13 @@ class ConnectWorker(object):
         created on the client side and passed as a parameter.
     strategy : str
         strategy to use when choosing which minima to connect
+    lease_size : int, optional
+        the number of connect jobs leased from the server at once
+
+    Notes
+    -----
+    All minima and transition states found in a connect job are sent back
+    to the server in one compressed message when the job is finished.
 
     See Also
     --------
@@ -140,7 +327,8 @@ class ConnectWorker(object):
     pele.landscape.ConnectManager
     """
     
-    def __init__(self, uri, system=None, strategy="random"):
+    def __init__(self, uri, system=None, strategy="random", lease_size=4):
+        _check_pyro()
         print("connecting to",uri)
         self.connect_server = Pyro4.Proxy(uri)
         if system is None:
@@ -148,6 +336,7 @@ class ConnectWorker(object):
         self.system = system
         
         self.strategy = strategy
+        self.lease_size = lease_size
         
     def run(self, nruns=None):
         """ start the client
@@ -157,9 +346,7 @@ class ConnectWorker(object):
         nruns : integer, optional
             stop after so many connect runs
         """
-        # global minimum id
         system = self.system
-        pot = system.get_potential()
 
         # stores the global id's of the minima found
         self.gid = dict()
@@ -167,46 +354,58 @@ class ConnectWorker(object):
         # create a local database in memory
         db = system.create_database(db=":memory:")
 
-        # connect to events and forward them to server
-        db.on_minimum_added.connect(self._minimum_added)
-        db.on_ts_added.connect(self._ts_added)
+        # collect the new minima and transition states of each job
+        new_minima = []
+        new_ts = []
+        db.on_minimum_added.connect(new_minima.append)
+        db.on_ts_added.connect(new_ts.append)
     
         while True:
-            print("Obtain a new job")
-            id1, coords1, id2, coords2 = self.connect_server.get_connect_job(self.strategy)
-            
-            print("processing connect run between minima with global id", id1, id2)
-            
-            # add minima to local database
-            min1 = db.addMinimum(pot.getEnergy(coords1), coords1)
-            min2 = db.addMinimum(pot.getEnergy(coords2), coords2)
-            # assigned local ids", min1.id(), min2.id()
-
-            # run double ended connect
-            connect = system.get_double_ended_connect(min1, min2, db, fresh_connect=True)
-            connect.connect()
+            nlease = self.lease_size
+            if nruns is not None:
+                nlease = min(nlease, nruns)
+            print("Obtain new jobs")
+            jobs = self.connect_server.lease_connect_jobs(nlease, self.strategy)
+            if not jobs:
+                print("the server has no more connect jobs")
+                break
+
+            for job_id, id1, E1, coords1, id2, E2, coords2 in jobs:
+                print("processing connect run between minima with global id", id1, id2)
+
+                # add minima to local database
+                min1 = db.addMinimum(E1, coords1)
+                min2 = db.addMinimum(E2, coords2)
+                self.gid[min1] = id1
+                self.gid[min2] = id2
+                del new_minima[:]
+                del new_ts[:]
+
+                # run double ended connect
+                connect = system.get_double_ended_connect(min1, min2, db, fresh_connect=True)
+                connect.connect()
+
+                # send everything found back in one message
+                minima = list(new_minima)
+                known = set(minima)
+                for ts in new_ts:
+                    for m in (ts.minimum1, ts.minimum2):
+                        if m not in known:
+                            known.add(m)
+                            minima.append(m)
+                data = _pack_job_results(minima, new_ts, self.gid)
+                ids = self.connect_server.submit_connect_results(job_id, data)
+                self.gid.update(zip(minima, ids))
+
             if nruns is not None:
-                nruns -= 1
-                if nruns == 0: break
+                nruns -= len(jobs)
+                if nruns <= 0: break
 
         print("finished successfully!")
         print("Data collected during run:")
         print(db.number_of_minima(), "minima")
         print(db.number_of_transition_states(), "transition states")
 
-    def _minimum_added(self, minimum):
-        """forward new minimum to server"""
-        minid = self.connect_server.add_minimum(minimum.energy, minimum.coords)
-        # store the id of minimum on server-side for quick access later on
-        self.gid[minimum] = minid
-        
-    def _ts_added(self, ts):
-        """forward new transition state to server""" 
-        id1 = self.gid[ts.minimum1]
-        id2 = self.gid[ts.minimum2]
-        
-        self.connect_server.add_ts(id1, id2, ts.energy, ts.coords, eigenval=ts.eigenval, eigenvec=ts.eigenvec)
-
 class BasinhoppingWorker(object):
     """
     worker class to execute basinhopping runs in parallel
@@ -232,6 +431,7 @@ class BasinhoppingWorker(object):
     """
     
     def __init__(self,uri, system=None, **basinhopping_kwargs):
+        _check_pyro()
         print("connecting to",uri)
         self.connect_server = Pyro4.Proxy(uri)
         if system is None:
@@ -0,0 +1,232 @@
+from __future__ import print_function
+import sys
+import time
+import multiprocessing as mp
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from pele.landscape import ConnectManager
+from pele.utils.fork_pool import _get_fork_context, _alive_worker_pids, \
+    _apply_async_message, _get_message
+
+__all__ = ["LocalConnectFarm"]
+
+# the system and the connect parameters of a worker process
+_worker_system = None
+_worker_kwargs = None
+
+
+def _init_worker(system, connect_kwargs):
+    global _worker_system, _worker_kwargs
+    _worker_system = system
+    _worker_kwargs = connect_kwargs
+
+
+def _connect_job(job):
+    """run one double ended connect in a fresh in-memory database
+
+    Returns a message tuple.  For a finished job it holds the job id,
+    whether the connection succeeded and all minima and transition states
+    found, with the transition states referring to the minima by their index
+    in the returned list.
+    """
+    try:
+        return _run_connect_job(*job)
+    except Exception as err:
+        return "error", job[0], repr(err)
+
+
+def _run_connect_job(job_id, seed, E1, coords1, E2, coords2):
+    np.random.seed(seed)
+    system = _worker_system
+    db = system.create_database(db=":memory:")
+    min1 = db.addMinimum(E1, coords1)
+    min2 = db.addMinimum(E2, coords2)
+    connect = system.get_double_ended_connect(min1, min2, db, fresh_connect=True,
+                                              **_worker_kwargs)
+    connect.connect()
+
+    minima = db.minima()
+    index = dict((m, i) for i, m in enumerate(minima))
+    minima_rows = [dict(energy=m.energy, coords=np.asarray(m.coords), fvib=m.fvib,
+                        pgorder=m.pgorder) for m in minima]
+    ts_rows = [dict(energy=ts.energy, coords=np.asarray(ts.coords), eigenval=ts.eigenval,
+                    eigenvec=ts.eigenvec, fvib=ts.fvib, pgorder=ts.pgorder,
+                    min1=index[ts.minimum1], min2=index[ts.minimum2])
+               for ts in db.transition_states()]
+    return "done", job_id, connect.success(), index[min1], index[min2], minima_rows, ts_rows
+
+
+class LocalConnectFarm(object):
+    """run double ended connect jobs in a local process pool
+
+    The connect jobs are chosen by a `ConnectManager` in this process and
+    run with `system.get_double_ended_connect()` in a multiprocessing pool.
+    Each worker connects the minima in its own in-memory database and sends
+    back all minima and transition states it found in one message, which are
+    added to the database with `Database.add_minima` and
+    `Database.add_transition_states`.  This process is the only one
+    writing to the database.  No Pyro server or separately started workers
+    are needed, but all workers run on this machine.
+
+    Parameters
+    ----------
+    system : BaseSystem
+        the system class.  It is used to build the double ended connect
+        objects in the workers, so it must be available in the child
+        processes.
+    database : Database
+        the database to connect the minima of
+    nproc : int, optional
+        number of worker processes.  Defaults to the number of cores
+    connect_manager : ConnectManager, optional
+        decides which minima to connect.  By default
+        `ConnectManager(database, strategy=strategy)`
+    strategy : str, optional
+        the strategy passed to `connect_manager.get_connect_job()`
+    seed : int, optional
+        the connect jobs use the seeds seed, seed+1, ...  If None a random
+        seed is chosen.
+    outstream : open file object, optional
+        where to print the summary of each run.  None for no printing
+    kwargs :
+        extra keyword arguments are passed to
+        `system.get_double_ended_connect()`.  The workers can't start
+        processes of their own, so `nproc` and `mindist_nproc` are always 1.
+
+    Attributes
+    ----------
+    njobs : int
+        number of connect jobs finished in the last run
+    nsuccess : int
+        number of those which connected the minima
+    wall_time : float
+        wall clock time of the last run
+    jobs_per_second : float
+        connect jobs finished per second in the last run
+
+    Examples
+    --------
+
+    >>> system = LJCluster(38)
+    >>> db = system.create_database("lj38.sqlite")
+    >>> farm = LocalConnectFarm(system, db, nproc=4, strategy="combine")
+    >>> results = farm.run(100)
+
+    See Also
+    --------
+    ConnectServer : the same for workers on several machines
+    pele.landscape.ConnectManager
+    """
+    # seconds between the checks that all workers are alive
+    _poll_interval = 1.
+
+    def __init__(self, system, database, nproc=None, connect_manager=None, strategy="random",
+                 seed=None, outstream=sys.stdout, **kwargs):
+        self.system = system
+        self.database = database
+        if nproc is None:
+            nproc = mp.cpu_count()
+        self.nproc = nproc
+        if connect_manager is None:
+            connect_manager = ConnectManager(database, strategy=strategy)
+        self.connect_manager = connect_manager
+        self.strategy = strategy
+        if seed is None:
+            seed = np.random.randint(0, 2**30)
+        self.seed = seed
+        self.outstream = outstream
+        self.connect_kwargs = kwargs
+        self.connect_kwargs.setdefault("verbosity", 0)
+        # the workers are daemonic processes, which can't have a pool
+        self.connect_kwargs["nproc"] = 1
+        self.connect_kwargs["mindist_nproc"] = 1
+
+        self.njobs = 0
+        self.nsuccess = 0
+        self.wall_time = 0.
+        self.jobs_per_second = 0.
+
+    def _next_job(self, job_id):
+        """return the next job, or None if the connect manager ran out of pairs"""
+        try:
+            min1, min2 = self.connect_manager.get_connect_job(self.strategy)
+        except ConnectManager.NoMoreConnectionsError:
+            return None
+        if min1 is None or min2 is None:
+            return None
+        seed = (self.seed + job_id) % 2**32
+        return (min1, min2), (job_id, seed, min1.energy, np.asarray(min1.coords),
+                              min2.energy, np.asarray(min2.coords))
+
+    def _add_results(self, min1, min2, imin1, imin2, minima_rows, ts_rows):
+        """add the minima and transition states found by a worker"""
+        db = self.database
+        others = [i for i in range(len(minima_rows)) if i not in (imin1, imin2)]
+        minima = dict(zip(others, db.add_minima([minima_rows[i] for i in others],
+                                                commit=False)))
+        minima[imin1] = min1
+        minima[imin2] = min2
+        for row in ts_rows:
+            row["min1"] = minima[row["min1"]]
+            row["min2"] = minima[row["min2"]]
+        db.add_transition_states(ts_rows, commit=False)
+        db.session.commit()
+
+    def run(self, njobs):
+        """run njobs connect jobs, nproc at a time
+
+        Returns
+        -------
+        results : list
+            a tuple `(min1, min2, success)` for each finished job
+        """
+        tstart = time.time()
+        results = []
+        # the workers send the results back through this queue
+        done = queue.Queue()
+        # with fork the system doesn't have to be picklable
+        pool = _get_fork_context().Pool(self.nproc, initializer=_init_worker,
+                                        initargs=(self.system, self.connect_kwargs))
+        pids = _alive_worker_pids(pool)
+        pending = dict()
+        nsubmitted = 0
+        try:
+            while True:
+                while nsubmitted < njobs and len(pending) < self.nproc:
+                    job = self._next_job(nsubmitted)
+                    if job is None:
+                        # don't submit more jobs
+                        njobs = nsubmitted
+                        break
+                    pending[nsubmitted] = job[0]
+                    _apply_async_message(pool, _connect_job, job[1], nsubmitted, done)
+                    nsubmitted += 1
+                if not pending:
+                    break
+                message = _get_message(done, pool, pids, self._poll_interval,
+                                       "LocalConnectFarm worker")
+                if message[0] == "error":
+                    raise RuntimeError("connect job %d failed: %s" % (message[1], message[2]))
+                job_id, success, imin1, imin2, minima_rows, ts_rows = message[1:]
+                min1, min2 = pending.pop(job_id)
+                self._add_results(min1, min2, imin1, imin2, minima_rows, ts_rows)
+                results.append((min1, min2, success))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.seed += nsubmitted
+        self.wall_time = time.time() - tstart
+        self.njobs = len(results)
+        self.nsuccess = sum(1 for r in results if r[2])
+        self.jobs_per_second = self.njobs / self.wall_time
+        if self.outstream is not None:
+            self.outstream.write("LocalConnectFarm: %d processes  jobs= %d  successful= %d  time= %.4g s  jobs/s= %.4g\n"
+                                 % (self.nproc, self.njobs, self.nsuccess, self.wall_time,
+                                    self.jobs_per_second))
+        return results
@@ -0,0 +1,64 @@
+import unittest
+import time
+
+import numpy as np
+
+from pele.storage import Database
+from pele.concurrent import ConnectServer
+from pele.concurrent._connect_server import _pack_job_results
+
+
+class TestConnectServerLeases(unittest.TestCase):
+    def setUp(self):
+        # the random strategy doesn't always find three pairs of four minima
+        np.random.seed(0)
+        self.db = Database()
+        self.minima = [self.db.addMinimum(float(i), np.ones(3) * i) for i in range(4)]
+        self.server = ConnectServer(None, self.db)
+        self.server.connect_manager.verbosity = 0
+
+    def test_lease(self):
+        jobs = self.server.lease_connect_jobs(3)
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(len(set(job[0] for job in jobs)), 3)
+        job_id, id1, E1, coords1, id2, E2, coords2 = jobs[0]
+        self.assertEqual(self.db.getMinimum(id1).energy, E1)
+        self.assertEqual(list(coords2), list(self.db.getMinimum(id2).coords))
+
+    def test_requeue(self):
+        self.server.lease_timeout = 0.
+        job = self.server.lease_connect_jobs(1)[0]
+        time.sleep(0.01)
+        self.server.lease_timeout = 100.
+        job2 = self.server.lease_connect_jobs(1)[0]
+        self.assertNotEqual(job[0], job2[0])
+        self.assertEqual((job[1], job[4]), (job2[1], job2[4]))
+
+    def test_submit(self):
+        job_id, id1, E1, coords1, id2, E2, coords2 = self.server.lease_connect_jobs(1)[0]
+        # the results of the job, as found in the local database of a worker
+        local = Database()
+        min1 = local.addMinimum(E1, coords1)
+        min2 = local.addMinimum(E2, coords2)
+        new = local.addMinimum(10., np.ones(3) * 10)
+        ts1 = local.addTransitionState(11., np.zeros(3), min1, new, eigenval=-1.,
+                                       eigenvec=np.ones(3))
+        ts2 = local.addTransitionState(12., np.zeros(3), new, min2)
+        gids = {min1: id1, min2: id2}
+        data = _pack_job_results([new, min1, min2], [ts1, ts2], gids)
+
+        ids = self.server.submit_connect_results(job_id, data)
+        self.assertEqual(ids[1:], [id1, id2])
+        self.assertEqual(self.db.number_of_minima(), 5)
+        self.assertEqual(self.db.getMinimum(ids[0]).energy, 10.)
+        self.assertEqual(self.db.number_of_transition_states(), 2)
+        ts = self.db.getTransitionState(self.db.getMinimum(id1), self.db.getMinimum(ids[0]))
+        self.assertEqual(ts.eigenval, -1.)
+        self.assertEqual(list(ts.eigenvec), [1., 1., 1.])
+        ts = self.db.getTransitionState(self.db.getMinimum(id2), self.db.getMinimum(ids[0]))
+        self.assertIsNone(ts.eigenval)
+        self.assertEqual(self.server._leases, dict())
+
+
+if __name__ == "__main__":
+    unittest.main()
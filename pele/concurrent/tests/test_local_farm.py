@@ -0,0 +1,61 @@
+import os
+import unittest
+
+import numpy as np
+
+from pele.concurrent import LocalConnectFarm
+from pele.systems import LJCluster
+
+
+class _DyingLJCluster(LJCluster):
+    def get_double_ended_connect(self, *args, **kwargs):
+        os._exit(1)
+
+
+class TestLocalConnectFarm(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.system = LJCluster(13)
+        self.db = self.system.create_database()
+        bh = self.system.get_basinhopping(database=self.db, outstream=None)
+        bh.run(30)
+        self.nminima = self.db.number_of_minima()
+
+    def test_run(self):
+        farm = LocalConnectFarm(self.system, self.db, nproc=2, seed=0, outstream=None)
+        results = farm.run(3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(farm.njobs, 3)
+        self.assertEqual(farm.nsuccess, sum(1 for r in results if r[2]))
+        self.assertGreater(farm.nsuccess, 0)
+        self.assertGreater(self.db.number_of_transition_states(), 0)
+        # the transition states refer to minima of the database
+        minima = set(self.db.minima())
+        for ts in self.db.transition_states():
+            self.assertIn(ts.minimum1, minima)
+            self.assertIn(ts.minimum2, minima)
+        for min1, min2, success in results:
+            self.assertIn(min1, minima)
+            self.assertIn(min2, minima)
+
+    def test_no_more_jobs(self):
+        db = self.system.create_database()
+        db.addMinimum(self.db.minima()[0].energy, self.db.minima()[0].coords)
+        farm = LocalConnectFarm(self.system, db, nproc=2, outstream=None)
+        self.assertEqual(farm.run(2), [])
+
+    def test_worker_died(self):
+        system = _DyingLJCluster(13)
+        farm = LocalConnectFarm(system, self.db, nproc=2, outstream=None)
+        farm._poll_interval = 0.1
+        with self.assertRaises(RuntimeError):
+            farm.run(2)
+
+    def test_nproc_in_workers(self):
+        farm = LocalConnectFarm(self.system, self.db, nproc=2, outstream=None, mindist_nproc=4)
+        self.assertEqual(farm.connect_kwargs["mindist_nproc"], 1)
+        self.assertEqual(farm.connect_kwargs["nproc"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -36,6 +36,7 @@ Other utilities
    :toctree: generated/
 
     TSGraph
+    ArrayGraph
     database2graph
     smoothPath
 
@@ -57,6 +58,7 @@ from __future__ import absolute_import
 
 
 
+from ._array_graph import *
 from ._graph import *
 from .local_connect import *
 from .connect_min import *
@@ -1,11 +1,44 @@
-import networkx as nx
 import logging
 
+import numpy as np
+import networkx as nx
+
+from pele.utils.fork_pool import _get_fork_context
+
 
 __all__ = []
 
 logger = logging.getLogger("pele.connect")
 
+# the distance function used by the worker processes
+_worker_mindist = None
+
+
+def _init_worker(mindist):
+    global _worker_mindist
+    _worker_mindist = mindist
+
+
+def _mindist_worker(pair):
+    return _worker_mindist(pair[0], pair[1])[0]
+
+
+def radial_distance_bound(coords1, coords2):
+    """return a cheap lower bound on the optimized distance of two atomic clusters
+
+    The distances of the atoms from the centroid don't change under
+    translation, rotation, inversion and permutation of the atoms, and
+    pairing them in sorted order minimizes the difference.  So this is a
+    lower bound of the distance returned by any mindist which optimizes over
+    those symmetries, e.g. the mindist of an atomic cluster.  It is not a
+    bound for periodic systems or rigid bodies.
+    """
+    x1 = np.reshape(coords1, [-1, 3])
+    x2 = np.reshape(coords2, [-1, 3])
+    r1 = np.sort(np.linalg.norm(x1 - x1.mean(axis=0), axis=1))
+    r2 = np.sort(np.linalg.norm(x2 - x2.mean(axis=0), axis=1))
+    return np.linalg.norm(r1 - r2)
+
 
 class _DistanceGraph(object):
     """
@@ -21,6 +54,22 @@ class _DistanceGraph(object):
         the routine which calculates the optimized distance between two structures
     verbosity :
         how much info to print (not very thoroughly implemented)
+    nproc : int, optional
+        if larger than 1 the distances are calculated in a pool of nproc
+        processes, one batch for each added minimum.  mindist must be usable
+        in a forked process.
+    lazy : bool, optional
+        if True, the edges of a new minimum get the weight of a lower bound
+        of the distance, and mindist is only called for the edges on the
+        candidate path in `shortestPath`.
+    lower_bound : callable, optional
+        `lower_bound(coords1, coords2)` returns a lower bound of the distance
+        returned by mindist.  It is required in lazy mode, e.g.
+        `radial_distance_bound` for atomic clusters.
+    tag : string, optional
+        if given, the distances are also read from and written to the
+        distances table of the database under this name, so they are reused
+        by later connect runs.  It must identify mindist and its parameters.
     
     Description
     -----------
@@ -35,6 +84,12 @@ class _DistanceGraph(object):
         else:
             weight(u, v) = dist(u, v)**2
 
+    In lazy mode the weight of an edge is computed from a lower bound of the
+    distance until the edge is on a shortest path.  Then the distance is
+    calculated and the path found again, until all edges of the shortest
+    path are exact.  Because no bound is larger than the distance, that path
+    is the same as the one found with all distances calculated.
+
     Edge weights are set to Infinity to ensure that we don't try to connect
     them again.  The minimum weight path between min1 and min2 in this graph gives a
     good guess for the best way to try connect min1 and min2.  
@@ -43,13 +98,25 @@ class _DistanceGraph(object):
     algorithm?
     """
 
-    def __init__(self, database, graph, mindist, verbosity):
+    def __init__(self, database, graph, mindist, verbosity, nproc=1, lazy=False,
+                 lower_bound=None, tag=None):
         self.database = database
         self.graph = graph
         self.mindist = mindist
         self.verbosity = verbosity
+        self.nproc = nproc
+        self.lazy = lazy
+        if lazy and lower_bound is None:
+            raise ValueError("lazy mode requires a lower bound of the distance returned by mindist")
+        self.lower_bound = lower_bound
+        self.tag = tag
+        self._pool = None
+        # new distances which are not stored in the database yet
+        self._unsaved = []
+        self.save_interval = 100
 
         self.Gdist = nx.Graph()
+        self._nodes = dict()  # the minima in Gdist by id
         self.distance_map = dict()  # place to store distances locally for faster lookup
         nx.set_edge_attributes(self.Gdist, "weight", dict())
         self.debug = False
@@ -103,13 +170,91 @@ class _DistanceGraph(object):
         dist = self._getDistNoCalc(min1, min2)
         if dist is not None: return dist
 
+        # then try the distances stored in the database
+        if self.tag is not None:
+            dist = self.database.get_distance(min1, min2, self.tag)
+            if dist is not None:
+                self._setDist(min1, min2, dist)
+                return dist
+
         # if it's not already known we must calculate it
         dist, coords1, coords2 = self.mindist(min1.coords, min2.coords)
         if self.verbosity > 1:
             logger.debug("calculated distance between %s %s %s", min1.id(), min2.id(), dist)
         self._setDist(min1, min2, dist)
+        self._saveDistances([(min1, min2, dist)])
         return dist
 
+    def _saveDistances(self, distances, flush=False):
+        """store new distances in the database if there is a tag
+
+        The distances are written and committed in batches of save_interval
+        pairs, or at once if flush is True.  `close` stores the rest.
+        """
+        if self.tag is None:
+            return
+        self._unsaved.extend(distances)
+        if self._unsaved and (flush or len(self._unsaved) >= self.save_interval):
+            self.database.add_distances(self._unsaved, self.tag, commit=False)
+            self.database.session.commit()
+            self._unsaved = []
+
+    def _loadDistances(self, pairs):
+        """get the distances of a list of minima pairs from the database
+
+        Returns the pairs whose distance is still unknown
+        """
+        pairs = [(m1, m2) for m1, m2 in pairs if self._getDistNoCalc(m1, m2) is None]
+        if self.tag is None or not pairs:
+            return pairs
+        unknown = []
+        for (m1, m2), dist in zip(pairs, self.database.get_distances(pairs, self.tag)):
+            if dist is None:
+                unknown.append((m1, m2))
+            else:
+                self._setDist(m1, m2, dist)
+        return unknown
+
+    def _calculateDistances(self, pairs):
+        """calculate and store the distances of a list of minima pairs at once
+
+        The distances are calculated in the process pool if nproc > 1
+        """
+        pairs = self._loadDistances(pairs)
+        if not pairs:
+            return
+        if self.nproc <= 1 or len(pairs) <= 1:
+            dists = [self.mindist(m1.coords, m2.coords)[0] for m1, m2 in pairs]
+        else:
+            if self._pool is None:
+                # with fork the mindist function doesn't have to be picklable
+                self._pool = _get_fork_context().Pool(self.nproc, initializer=_init_worker,
+                                                      initargs=(self.mindist,))
+            chunksize = max(1, len(pairs) // (4 * self.nproc))
+            dists = self._pool.map(_mindist_worker, [(m1.coords, m2.coords) for m1, m2 in pairs],
+                                   chunksize=chunksize)
+        for (m1, m2), dist in zip(pairs, dists):
+            self._setDist(m1, m2, dist)
+        self._saveDistances([(m1, m2, dist) for (m1, m2), dist in zip(pairs, dists)], flush=True)
+        if self.verbosity > 1:
+            logger.debug("calculated %s distances in %s processes", len(pairs), self.nproc)
+
+    def close(self):
+        """store the remaining new distances and stop the process pool
+
+        A new pool is started if more distances are needed
+        """
+        self._saveDistances([], flush=True)
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _setExactWeight(self, min1, min2):
+        """replace the lower bound weight of an edge by the weight of the distance"""
+        weight = self.distToWeight(self.getDist(min1, min2))
+        self.Gdist.add_edge(min1, min2, weight=weight, exact=True)
+
     def _addMinimum(self, m):
         """
         add a new minimum to the graph
@@ -121,19 +266,32 @@ class _DistanceGraph(object):
         distance calculation is slow.
         """
         self.Gdist.add_node(m)
+        self._nodes[m.id()] = m
         # for nodes that are connected set the edge weight using setTransitionStateConnection
-        cc = nx.node_connected_component(self.graph.graph, m)
-        for m2 in cc:
-            if m2 in self.Gdist:
+        for id2 in self.graph.connectedComponentIds(m):
+            m2 = self._nodes.get(id2)
+            if m2 is not None and m2 != m:
                 # self.Gdist.add_edge(m, m2, weight=0.)
                 self.setTransitionStateConnection(m, m2)
 
         # for all other nodes set the weight to be the distance
-        for m2 in self.Gdist.nodes():
-            if not self.Gdist.has_edge(m, m2):
-                dist = self.getDist(m, m2)
-                weight = self.distToWeight(dist)
-                self.Gdist.add_edge(m, m2, weight = weight)
+        others = [m2 for m2 in self.Gdist.nodes() if m2 != m and not self.Gdist.has_edge(m, m2)]
+        if self.lazy:
+            self._loadDistances([(m, m2) for m2 in others])
+            for m2 in others:
+                dist = self._getDistNoCalc(m, m2)
+                if dist is None:
+                    bound = self.lower_bound(m.coords, m2.coords)
+                    self.Gdist.add_edge(m, m2, weight=self.distToWeight(bound), exact=False)
+                else:
+                    self.Gdist.add_edge(m, m2, weight=self.distToWeight(dist), exact=True)
+            return
+
+        self._calculateDistances([(m, m2) for m2 in others])
+        for m2 in others:
+            dist = self.getDist(m, m2)
+            weight = self.distToWeight(dist)
+            self.Gdist.add_edge(m, m2, weight = weight, exact=True)
 
 
     def addMinimum(self, m):
@@ -142,7 +300,9 @@ class _DistanceGraph(object):
         minima in the graph.  
         
         Note: this can take a very long time if there are lots of minima
-        in the graph.  mindist need to be run many many times.
+        in the graph.  mindist need to be run many many times.  Use nproc
+        to calculate the distances in parallel, or lazy mode to
+        calculate only the distances which are needed.
         """
         trans = self.database.connection.begin()
         try:
@@ -165,7 +325,7 @@ class _DistanceGraph(object):
         if self.Gdist.has_edge(min1, min2):
             w = self.Gdist[min1][min2]["weight"]
             if not w < 1e-6:
-                self.Gdist.add_edge(min1, min2, weight=self.infinite_weight)
+                self.Gdist.add_edge(min1, min2, weight=self.infinite_weight, exact=True)
         return True
 
     def replaceTransitionStateGraph(self, graph):
@@ -189,14 +349,26 @@ class _DistanceGraph(object):
         The edge weight will be set to zero
         """
         weight = 0.
-        self.Gdist.add_edge(min1, min2, weight = weight)
+        self.Gdist.add_edge(min1, min2, weight = weight, exact=True)
 
     def shortestPath(self, min1, min2):
-        """return the minimum weight path path between min1 and min2"""
-        try:
-            path = nx.shortest_path(self.Gdist, min1, min2, weight="weight")
-        except nx.NetworkXNoPath:
-            return None, None
+        """return the minimum weight path path between min1 and min2
+
+        In lazy mode the distances of the edges on the path are calculated
+        and the path is found again until it has only exact edge weights.
+        """
+        while True:
+            try:
+                path = nx.shortest_path(self.Gdist, min1, min2, weight="weight")
+            except nx.NetworkXNoPath:
+                return None, None
+            pairs = [(path[i], path[i + 1]) for i in range(len(path) - 1)
+                     if not self.Gdist[path[i]][path[i + 1]].get("exact", True)]
+            if not pairs:
+                break
+            self._calculateDistances(pairs)
+            for m1, m2 in pairs:
+                self._setExactWeight(m1, m2)
 
         # get_edge attributes is really slow:
         weights = [self.Gdist[path[i]][path[i + 1]]["weight"] for i in range(len(path) - 1)]
@@ -215,13 +387,16 @@ class _DistanceGraph(object):
             # self.add_edge(min1, m, **data)
 
             # the edge already exists, keep the edge with the lower weight
-            w2 = data["weight"]
-            w1 = self.Gdist[min1][m]["weight"]
-            wnew = min(w1, w2)
+            data1 = self.Gdist[min1][m]
+            if data["weight"] < data1["weight"]:
+                wnew, exact = data["weight"], data.get("exact", True)
+            else:
+                wnew, exact = data1["weight"], data1.get("exact", True)
             # note: this will override any previous call to self.setTransitionStateConnection
-            self.Gdist.add_edge(min1, m, weight=wnew)
+            self.Gdist.add_edge(min1, m, weight=wnew, exact=exact)
 
         self.Gdist.remove_node(min2)
+        self._nodes.pop(min2.id(), None)
 
 
     def checkGraph(self):
@@ -237,7 +412,8 @@ class _DistanceGraph(object):
         count = 0
         for e in self.Gdist.edges():
             are_connected = self.graph.areConnected(e[0], e[1])
-            zero_weight = weights[e] < 1e-10
+            # a lower bound of zero is not an inconsistency
+            zero_weight = weights[e] < 1e-10 and self.Gdist[e[0]][e[1]].get("exact", True)
 
             # if they are connected they should have zero_weight
             if are_connected and not zero_weight:
@@ -263,7 +439,7 @@ class _DistanceGraph(object):
                 logger.warning("    problem: are_connected %s %s %s %s %s %s %s",
                                are_connected, "but weight", weights[e], "dist", dist, e[0].id(), e[1].id())
                 w = self.distToWeight(dist)
-                self.Gdist.add_edge(e[0], e[1], weight = w)
+                self.Gdist.add_edge(e[0], e[1], weight = w, exact=True)
         if count > 0:
             logger.info("    found %s %s", count, "inconsistencies in Gdist")
 
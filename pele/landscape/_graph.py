@@ -2,10 +2,12 @@
 from __future__ import print_function
 import networkx as nx
 
+from pele.landscape._array_graph import ArrayGraph
+
 __all__ = ["TSGraph", "Graph", "database2graph"]
 
 
-def database2graph(db, Emax=None):
+def database2graph(db, Emax=None, chunk_size=1000):
     """
     make a networkx graph from a database
 
@@ -14,44 +16,29 @@ def database2graph(db, Emax=None):
     db : pele Database
     Emax : float optional
         including only transition states with energy < Emax
+    chunk_size : int, optional
+        the minima and transition states are loaded from the database this
+        many at a time, so only the graph is held in memory
     """
-    from pele.storage.database import Minimum, TransitionState
-
     g = nx.Graph()
     # js850> It's not strictly necessary to add the minima explicitly here,
     # but for some reason it is much faster if you do (factor of 2).  Even 
     # if this means there are many more minima in the graph.  I'm not sure 
     # why this is.  This step is already often the bottleneck of the d-graph 
     # calculation.
-    if Emax is not None:
-        minima = db.session.query(Minimum).filter(Minimum.energy <= Emax)
-    else:
-        minima = db.session.query(Minimum)
-    g.add_nodes_from(minima)
-    # if we order by energy first and add the transition states with the largest energy first
-    # then we will take the smallest energy transition state in the case of duplicates
-    if Emax is not None:
-        ts = db.session.query(TransitionState).filter(TransitionState.energy <= Emax) \
-            .order_by(-TransitionState.energy)
-    else:
-        ts = db.session.query(TransitionState).order_by(-TransitionState.energy)
+    # Keeping the minima in the graph also means the transition states find
+    # them in the session instead of querying them one by one.
+    g.add_nodes_from(db.iter_minima(order_energy=False, Emax=Emax, chunk_size=chunk_size))
+    # the transition states are added in order of increasing energy, so in the case
+    # of duplicates we keep the smallest energy transition state
+    ts = db.iter_transition_states(order_energy=True, Emax=Emax, chunk_size=chunk_size)
     for t in ts:
-        g.add_edge(t.minimum1, t.minimum2, ts=t)
+        m1, m2 = t.minimum1, t.minimum2
+        if not g.has_edge(m1, m2):
+            g.add_edge(m1, m2, ts=t)
     return g
 
 
-class _ConnectedComponents(nx.utils.UnionFind):
-    """
-    a class to build and maintain the connected components
-    
-    This allows connections to be determined much more rapidly because
-    the breadth first search algorithm is slow
-    """
-
-    def are_connected(self, m1, m2):
-        return self[m1] == self[m2]
-
-
 class TSGraph(object):
     """
     Wrapper to represent a database object as a graph
@@ -85,12 +72,14 @@ class TSGraph(object):
     the networkx graph is accessed directly by
 
     >>> networkx_graph = graph.graph
+
+    The connectivity is also kept in `array_graph`, an `ArrayGraph` of the
+    minimum ids, which answers `areConnected` in almost constant time.
     """
 
     def __init__(self, database, minima=None, no_edges=False):
         self.graph = nx.Graph()
         self.storage = database
-        self.connected_components = _ConnectedComponents()
         self.minima = minima
         self.no_edges = no_edges
         self.refresh()
@@ -99,12 +88,13 @@ class TSGraph(object):
         """
         add all minima and all transition states to the graph
         """
-        for m in self.storage.minima():
+        for m in self.storage.iter_minima(order_energy=False):
             self.graph.add_node(m)
+            self.array_graph.add_node(m.id())
         if not self.no_edges:
-            for ts in self.storage.transition_states():
+            for ts in self.storage.iter_transition_states():
                 self.graph.add_edge(ts.minimum1, ts.minimum2, ts=ts)
-                self.connected_components.union(ts.minimum1, ts.minimum2)
+                self.array_graph.add_edge(ts._minimum1_id, ts._minimum2_id)
 
     def _build_from_list(self, minima):
         """
@@ -114,15 +104,17 @@ class TSGraph(object):
         minima = set(minima)
         for m in minima:
             self.graph.add_node(m)
+            self.array_graph.add_node(m.id())
         if not self.no_edges:
-            for ts in self.storage.transition_states():
+            for ts in self.storage.iter_transition_states():
                 m1, m2 = ts.minimum1, ts.minimum2
                 if m1 in minima:
                     if m2 in minima:
                         self.graph.add_edge(ts.minimum1, ts.minimum2, ts=ts)
-                        self.connected_components.union(ts.minimum1, ts.minimum2)
+                        self.array_graph.add_edge(m1.id(), m2.id())
 
     def refresh(self):
+        self.array_graph = ArrayGraph()
         if self.minima is None:
             self._build_all()
         else:
@@ -133,15 +125,20 @@ class TSGraph(object):
         add a minimum to the database and graph
         """
         self.graph.add_node(minimum)
+        self.array_graph.add_node(minimum.id())
         return minimum
 
     def addTransitionState(self, ts):
         self.graph.add_edge(ts.minimum1, ts.minimum2, ts=ts)
-        self.connected_components.union(ts.minimum1, ts.minimum2)
+        self.array_graph.add_edge(ts.minimum1.id(), ts.minimum2.id())
         return ts
 
     def areConnected(self, min1, min2):
-        return self.connected_components.are_connected(min1, min2)
+        return self.array_graph.connected(min1.id(), min2.id())
+
+    def connectedComponentIds(self, minimum):
+        """return the ids of the minima connected to minimum, including itself"""
+        return self.array_graph.component(minimum.id())
 
     def getPath(self, min1, min2):
         try:
@@ -154,7 +151,7 @@ class TSGraph(object):
         delete minima2.  all transition states pointing to min2 should
         now point to min1
         """
-        self.connected_components.union(min1, min2)
+        self.array_graph.merge(min1.id(), min2.id())
         # make the edges of min2 now point to min1
         for v, data in self.graph[min2].items():
             if v == min1: continue
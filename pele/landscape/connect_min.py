@@ -1,18 +1,62 @@
 from __future__ import print_function
 import logging
 import operator
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import numpy as np
 import networkx as nx
 
 from pele.landscape import TSGraph, LocalConnect
 from pele.landscape._distance_graph import _DistanceGraph
+from pele.optimize import Result
+from pele.utils.fork_pool import _get_fork_context, _alive_worker_pids, \
+    _apply_async_message, _get_message
 
 
 __all__ = ["DoubleEndedConnect"]
 
 logger = logging.getLogger("pele.connect")
 
+# the local connect parameters of a worker process
+_worker_args = None
+
+
+def _init_local_connect_worker(pot, mindist, local_connect_params):
+    global _worker_args
+    _worker_args = (pot, mindist, local_connect_params)
+
+
+def _local_connect_job(job):
+    """do one local connect run in a worker process
+
+    Returns a message tuple.  For a finished run it holds the job id and the
+    new transition states as tuples of Result objects (ts, min1, min2) with
+    only the energies, coordinates and the eigenvalues.
+    """
+    from pele.optimize.optimization_exceptions import LineSearchError
+    from pele.storage import Minimum
+
+    job_id, seed, E1, coords1, E2, coords2 = job
+    try:
+        np.random.seed(seed)
+        pot, mindist, local_connect_params = _worker_args
+        local_connect = LocalConnect(pot, mindist, **local_connect_params)
+        res = local_connect.connect(Minimum(E1, coords1), Minimum(E2, coords2))
+        new_ts = []
+        for tsret, m1ret, m2ret in res.new_transition_states:
+            ts = Result(energy=tsret.energy, coords=tsret.coords, eigenval=tsret.eigenval,
+                        eigenvec=tsret.eigenvec)
+            new_ts.append((ts, Result(energy=m1ret.energy, coords=m1ret.coords),
+                           Result(energy=m2ret.energy, coords=m2ret.coords)))
+        return "done", job_id, new_ts
+    except LineSearchError as err:
+        return "line_search_error", job_id, str(err)
+    except Exception as err:
+        return "error", job_id, repr(err)
+
 
 class DoubleEndedConnect(object):
     """
@@ -59,6 +103,27 @@ class DoubleEndedConnect(object):
         
         If any configuration in a minimum-transition_state-minimum triplet fails
         a test then the whole triplet is rejected.
+    mindist_nproc : int, optional
+        number of processes used to calculate the distances between a new
+        minimum and the other minima in the distance graph
+    lazy_mindist : bool, optional
+        if True, guess the path with cheap lower bounds of the distances and
+        call mindist only for the minima pairs on the path.  Use this for
+        databases with many minima.
+    mindist_lower_bound : callable, optional
+        the lower bound of the distance returned by mindist.  Required if
+        lazy_mindist is True.  See _DistanceGraph
+    nproc : int, optional
+        if larger than 1, up to nproc pairs of minima from the guessed path
+        are connected with LocalConnect at the same time in a process pool.
+        The results are added as the runs finish and the path is guessed
+        again.  pot, mindist and local_connect_params must be usable in a
+        forked process.
+    mindist_tag : string, optional
+        if given, the computed distances are stored in the database under
+        this name and the stored distances are used instead of calling
+        mindist.  Use a name which identifies mindist and its parameters,
+        e.g. "lj38_mindist".  See `Database.add_distances`
     
     Notes
     -----
@@ -130,13 +195,16 @@ class DoubleEndedConnect(object):
     LocalConnect : the core algorithm of this routine
         
     """
+    # seconds between the checks that the local connect workers are alive
+    _poll_interval = 1.
 
     def __init__(self, min1, min2, pot, mindist, database,
                  verbosity=1,
                  merge_minima=False,
                  max_dist_merge=0.1, local_connect_params=None,
                  fresh_connect=False, longest_first=True,
-                 niter=200, conf_checks=None
+                 niter=200, conf_checks=None, mindist_nproc=1, lazy_mindist=False,
+                 mindist_lower_bound=None, mindist_tag=None, nproc=1
     ):
         self.minstart = min1
         assert min1.id() == min1, "minima must compare equal with their id %d %s %s" % (
@@ -147,6 +215,7 @@ class DoubleEndedConnect(object):
         self.pairsNEB = dict()
         self.longest_first = longest_first
         self.niter = niter
+        self.nproc = nproc
         if conf_checks is None:
             self.conf_checks = []
         else:
@@ -166,7 +235,9 @@ class DoubleEndedConnect(object):
         self.merge_minima = merge_minima
         self.max_dist_merge = float(max_dist_merge)
 
-        self.dist_graph = _DistanceGraph(self.database, self.graph, self.mindist, self.verbosity)
+        self.dist_graph = _DistanceGraph(self.database, self.graph, self.mindist, self.verbosity,
+                                         nproc=mindist_nproc, lazy=lazy_mindist,
+                                         lower_bound=mindist_lower_bound, tag=mindist_tag)
 
         # check if a connection exists before initializing distance graph
         if self.graph.areConnected(self.minstart, self.minend):
@@ -335,6 +406,19 @@ class DoubleEndedConnect(object):
             to find the minima the transition state connects. Add the new 
             transition state and minima to the graph 
         """
+        if not self._startLocalConnect(min1, min2):
+            return True
+
+        # do local connect run
+        local_connect = self._getLocalConnectObject()
+        res = local_connect.connect(min1, min2)
+        return self._finishLocalConnect(min1, min2, res.new_transition_states)
+
+    def _startLocalConnect(self, min1, min2):
+        """check that a local connect run between min1 and min2 is needed
+
+        Returns False if the pair was tried before or is already connected
+        """
         # Make sure we haven't already tried this pair and
         # record some data so we don't try it again in the future
         if (min1, min2) in self.pairsNEB:
@@ -342,7 +426,7 @@ class DoubleEndedConnect(object):
             logger.warning("         aborting NEB")
             # self._remove_edgeGdist(min1, min2)
             self.dist_graph.removeEdge(min1, min2)
-            return True
+            return False
         self.pairsNEB[(min1, min2)] = True
         self.pairsNEB[(min2, min1)] = True
 
@@ -352,19 +436,22 @@ class DoubleEndedConnect(object):
                            self.getDist(min1, min2))
             self.dist_graph.setTransitionStateConnection(min1, min2)
             self.dist_graph.checkGraph()
-            return True
-
-        # do local connect run
-        local_connect = self._getLocalConnectObject()
-        res = local_connect.connect(min1, min2)
+            return False
+        return True
 
+    def _finishLocalConnect(self, min1, min2, new_transition_states):
+        """add the results of a local connect run between min1 and min2"""
         # now add each new transition state to the graph and database.
         nsuccess = 0
-        for tsret, m1ret, m2ret in res.new_transition_states:
+        for tsret, m1ret, m2ret in new_transition_states:
             goodts = self._addTransitionState(tsret, m1ret, m2ret)
             if goodts:
                 nsuccess += 1
 
+        if min1 not in self.dist_graph.Gdist or min2 not in self.dist_graph.Gdist:
+            # one of the minima was merged while a parallel run was going on
+            return nsuccess > 0
+
         # check results
         if nsuccess == 0:
             dist = self.getDist(min1, min2)
@@ -411,6 +498,40 @@ class DoubleEndedConnect(object):
         update: find the shortest path weighted by distance squared.  This penalizes finding
         the NEB between minima that are very far away.  (Does this too much favor long paths?)
         """
+        weightlist = self._getPathSegments()
+        if weightlist is None:
+            return None, None
+
+        # select which minima pair to return
+        if self.longest_first:
+            weightlist.sort(key=operator.itemgetter(0))
+            w, min1, min2 = weightlist[-1]
+        else:
+            weightlist.sort(key=operator.itemgetter(0))
+            for w, min1, min2 in weightlist:
+                if w > 1e-6:
+                    break
+        return min1, min2
+
+    def _getNextPairs(self, npairs, busy):
+        """return up to npairs pairs of minima from the guessed path to try to connect
+
+        Pairs which are connected or in `busy`, a set of frozensets of
+        minima pairs, are skipped.
+        """
+        weightlist = self._getPathSegments()
+        if weightlist is None:
+            return []
+        weightlist = [(w, min1, min2) for w, min1, min2 in weightlist
+                      if w > 1e-6 and frozenset((min1, min2)) not in busy]
+        weightlist.sort(key=operator.itemgetter(0), reverse=self.longest_first)
+        return [(min1, min2) for w, min1, min2 in weightlist[:npairs]]
+
+    def _getPathSegments(self):
+        """return the segments (weight, min1, min2) of the guessed path
+
+        Returns None if there is no path
+        """
         logger.info("finding a good pair to try to connect")
         # get the shortest path on dist_graph between minstart and minend
         if True:
@@ -420,7 +541,7 @@ class DoubleEndedConnect(object):
         weightsum = sum(weights)
         if path is None or weightsum >= 10e9:
             logger.warning("Can't find any way to try to connect the minima")
-            return None, None
+            return None
 
         # get the weights of the path segements
         weightlist = []
@@ -443,16 +564,7 @@ class DoubleEndedConnect(object):
                     dist = w
                 logger.info("    path guess %s %s %s", min1.id(), min2.id(), dist)
 
-        # select which minima pair to return
-        if self.longest_first:
-            weightlist.sort(key=operator.itemgetter(0))
-            w, min1, min2 = weightlist[-1]
-        else:
-            weightlist.sort(key=operator.itemgetter(0))
-            for w, min1, min2 in weightlist:
-                if w > 1e-6:
-                    break
-        return min1, min2
+        return weightlist
 
 
     def connect(self):
@@ -460,6 +572,15 @@ class DoubleEndedConnect(object):
         the main loop of the algorithm
         """
         self.NEBattempts = 2
+        try:
+            if self.nproc > 1:
+                self._connectParallel()
+            else:
+                self._connect()
+        finally:
+            self.dist_graph.close()
+
+    def _connect(self):
         for i in range(self.niter):
             # stop if we're done
             if self.graph.areConnected(self.minstart, self.minend):
@@ -491,6 +612,60 @@ class DoubleEndedConnect(object):
 
         logger.info("failed to find connection between %s %s", self.minstart.id(), self.minend.id())
 
+    def _connectParallel(self):
+        """the main loop with nproc local connect runs at the same time"""
+        # the workers send the results back through this queue
+        done = queue.Queue()
+        # with fork the potential and mindist don't have to be picklable
+        pool = _get_fork_context().Pool(self.nproc, initializer=_init_local_connect_worker,
+                                        initargs=(self.pot, self.mindist,
+                                                  self.local_connect_params))
+        pids = _alive_worker_pids(pool)
+        running = dict()
+        niter = 0
+        try:
+            while True:
+                # stop if we're done
+                if self.graph.areConnected(self.minstart, self.minend):
+                    logger.info("found connection!")
+                    return
+
+                # start runs for the unconnected pairs of the guessed path
+                while len(running) < self.nproc and niter < self.niter:
+                    pairs = self._getNextPairs(self.nproc - len(running),
+                                               set(frozenset(p) for p in running.values()))
+                    if not pairs:
+                        break
+                    for min1, min2 in pairs[:self.niter - niter]:
+                        niter += 1
+                        if not self._startLocalConnect(min1, min2):
+                            continue
+                        logger.info("======== starting local connect %s %s %s %s", niter, "between",
+                                    min1.id(), min2.id())
+                        job = (niter, np.random.randint(0, 2**30), min1.energy,
+                               np.asarray(min1.coords), min2.energy, np.asarray(min2.coords))
+                        running[niter] = (min1, min2)
+                        _apply_async_message(pool, _local_connect_job, job, niter, done)
+
+                if not running:
+                    break
+                message = _get_message(done, pool, pids, self._poll_interval,
+                                       "local connect worker")
+                min1, min2 = running.pop(message[1])
+                if message[0] == "line_search_error":
+                    logger.warning("%s", message[2])
+                    logger.warning("caught line search error, aborting connection attempt")
+                    break
+                elif message[0] == "error":
+                    raise RuntimeError("local connect between minima %s and %s failed: %s"
+                                       % (min1.id(), min2.id(), message[2]))
+                self._finishLocalConnect(min1, min2, message[2])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        logger.info("failed to find connection between %s %s", self.minstart.id(), self.minend.id())
+
     def success(self):
         return self.graph.areConnected(self.minstart, self.minend)
 
@@ -0,0 +1,103 @@
+from __future__ import print_function
+import unittest
+
+import numpy as np
+import networkx as nx
+
+from pele.landscape import ArrayGraph
+
+
+class TestArrayGraph(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.nnodes = 60
+        self.graph = ArrayGraph(size=4)
+        self.nxgraph = nx.Graph()
+        for i in range(1, self.nnodes):
+            self.graph.add_node(i)
+            self.nxgraph.add_node(i)
+        for k in range(50):
+            u, v = np.random.randint(1, self.nnodes, 2)
+            if u == v:
+                continue
+            w = np.random.rand()
+            self.graph.add_edge(u, v, weight=w)
+            if not self.nxgraph.has_edge(u, v) or self.nxgraph[u][v]["weight"] > w:
+                self.nxgraph.add_edge(u, v, weight=w)
+
+    def check(self):
+        self.assertEqual(self.graph.number_of_nodes(), self.nxgraph.number_of_nodes())
+        self.assertEqual(sorted(self.graph.nodes()), sorted(self.nxgraph.nodes()))
+        for i in self.nxgraph.nodes():
+            cc = nx.node_connected_component(self.nxgraph, i)
+            self.assertEqual(sorted(self.graph.component(i)), sorted(cc))
+            self.assertEqual(sorted(self.graph.neighbors(i)), sorted(self.nxgraph[i]))
+        for i in self.nxgraph.nodes():
+            for j in self.nxgraph.nodes():
+                connected = nx.has_path(self.nxgraph, i, j)
+                self.assertEqual(self.graph.connected(i, j), connected)
+                if connected:
+                    length, path = self.graph.shortest_path(i, j)
+                    nxlength = nx.shortest_path_length(self.nxgraph, i, j, weight="weight")
+                    self.assertAlmostEqual(length, nxlength)
+                    self.assertEqual(path[0], i)
+                    self.assertEqual(path[-1], j)
+                    self.assertEqual(len(path), len(set(path)))
+                else:
+                    self.assertIsNone(self.graph.shortest_path(i, j))
+
+    def test_compare_networkx(self):
+        self.check()
+        self.assertFalse(self.graph.connected(1, 1000))
+        self.assertEqual(len(self.graph.component(1000)), 0)
+
+    def test_merge(self):
+        for keep, remove in [(1, 2), (3, 1), (10, 20)]:
+            self.graph.merge(keep, remove)
+            for v, data in list(self.nxgraph[remove].items()):
+                if v == keep:
+                    continue
+                if not self.nxgraph.has_edge(keep, v) or self.nxgraph[keep][v]["weight"] > data["weight"]:
+                    self.nxgraph.add_edge(keep, v, **data)
+            self.nxgraph.remove_node(remove)
+        self.check()
+
+    def test_reuse_merged_id(self):
+        graph = ArrayGraph()
+        graph.add_edge(3, 4)
+        graph.add_edge(3, 5)
+        graph.add_node(1)
+        # 3 is the root of the set it is merged out of
+        graph.merge(1, 3)
+        graph.add_node(3)
+        self.assertFalse(graph.connected(1, 3))
+        self.assertTrue(graph.connected(1, 4))
+        self.assertTrue(graph.connected(4, 5))
+        self.assertEqual(sorted(graph.component(1)), [1, 4, 5])
+        self.assertEqual(list(graph.component(3)), [3])
+        graph.add_edge(3, 6)
+        self.assertTrue(graph.connected(3, 6))
+        self.assertFalse(graph.connected(6, 5))
+
+    def test_absent_nodes(self):
+        graph = ArrayGraph(size=10)
+        graph.add_node(1)
+        self.assertIsNone(graph._find(5))
+        self.assertIsNone(graph._find(50))
+        self.assertFalse(graph.connected(5, 5))
+        self.assertFalse(graph.connected(1, 5))
+        self.assertIsNone(graph.shortest_path(5, 5))
+        graph.merge(1, 5)
+        self.assertEqual(list(graph.nodes()), [1])
+
+    def test_zero_weights(self):
+        graph = ArrayGraph()
+        graph.add_edge(0, 1, weight=0.)
+        graph.add_edge(1, 2, weight=0.)
+        graph.add_edge(0, 2, weight=1.)
+        self.assertEqual(graph.shortest_path(0, 2), (0., [0, 1, 2]))
+        self.assertEqual(graph.shortest_path(0, 2, weighted=False), (1., [0, 2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ import unittest
 import numpy as np
 
 from pele.landscape import DoubleEndedConnect
+from pele.landscape._distance_graph import radial_distance_bound
 from .test_graph import create_random_database
 from pele.systems import LJCluster
 
@@ -171,6 +172,122 @@ class TestDistanceGraph(unittest.TestCase):
         allok = self.connect.dist_graph.checkGraph()
         self.assertTrue(allok, "adding multiple transition states broke the distance graph")
 
+
+def _centered_dist(coords1, coords2):
+    """a deterministic mindist which only removes the translation"""
+    x1 = coords1.reshape(-1, 3)
+    x2 = coords2.reshape(-1, 3)
+    x1 = x1 - x1.mean(axis=0)
+    x2 = x2 - x2.mean(axis=0)
+    return np.linalg.norm(x1 - x2), x1.ravel(), x2.ravel()
+
+
+class TestDistanceGraphLazy(unittest.TestCase):
+    def setUp(self):
+        nmin = 10
+        natoms = 13
+        system = LJCluster(natoms)
+        self.pot = system.get_potential()
+        self.mindist = _centered_dist
+        self.natoms = natoms
+        self.db = create_random_database(nmin=nmin, natoms=natoms, nts=nmin // 2)
+        self.min1, self.min2 = list(self.db.minima())[:2]
+
+    def make_connect(self, **kwargs):
+        connect = DoubleEndedConnect(self.min1, self.min2, self.pot, self.mindist, self.db,
+                                     **kwargs)
+        for m in self.db.minima():
+            connect.dist_graph.addMinimum(m)
+        return connect
+
+    def test_lower_bound(self):
+        mindist = LJCluster(self.natoms).get_mindist()
+        for m1 in self.db.minima():
+            for m2 in self.db.minima():
+                dist = mindist(m1.coords, m2.coords)[0]
+                self.assertLessEqual(radial_distance_bound(m1.coords, m2.coords), dist + 1e-6)
+
+    def test_same_path(self):
+        eager = self.make_connect()
+        lazy = self.make_connect(lazy_mindist=True, mindist_lower_bound=radial_distance_bound)
+        ncalc = len(lazy.dist_graph.distance_map)
+        self.assertLess(ncalc, len(eager.dist_graph.distance_map))
+
+        path, weights = eager.dist_graph.shortestPath(self.min1, self.min2)
+        lpath, lweights = lazy.dist_graph.shortestPath(self.min1, self.min2)
+        self.assertAlmostEqual(sum(weights), sum(lweights), places=6)
+        for m1, m2 in zip(lpath[:-1], lpath[1:]):
+            self.assertTrue(lazy.dist_graph.Gdist[m1][m2]["exact"])
+        self.assertTrue(lazy.dist_graph.checkGraph())
+
+    def test_lower_bound_required(self):
+        with self.assertRaises(ValueError):
+            self.make_connect(lazy_mindist=True)
+        # an atomic cluster provides the bound
+        system = LJCluster(self.natoms)
+        connect = system.get_double_ended_connect(self.min1, self.min2, self.db,
+                                                  lazy_mindist=True)
+        self.assertIs(connect.dist_graph.lower_bound, radial_distance_bound)
+
+    def test_stored_distances(self):
+        ncalls = [0]
+
+        def mindist(coords1, coords2):
+            ncalls[0] += 1
+            return _centered_dist(coords1, coords2)
+
+        self.mindist = mindist
+        connect = self.make_connect(mindist_tag="centered")
+        nstored = len(connect.dist_graph.distance_map)
+        self.assertEqual(ncalls[0], nstored)
+
+        # a new connect run uses the stored distances
+        connect = self.make_connect(mindist_tag="centered")
+        self.assertEqual(ncalls[0], nstored)
+        self.assertEqual(len(connect.dist_graph.distance_map), nstored)
+        connect = self.make_connect(mindist_tag="centered", lazy_mindist=True,
+                                    mindist_lower_bound=radial_distance_bound)
+        connect.dist_graph.shortestPath(self.min1, self.min2)
+        self.assertEqual(ncalls[0], nstored)
+
+    def test_save_in_batches(self):
+        from pele.storage.database import Distance
+        connect = self.make_connect(mindist_tag="centered")
+        dist_graph = connect.dist_graph
+        nstored = self.db.session.query(Distance).count()
+        minima = list(self.db.minima())
+        dist_graph.distance_map.clear()
+        self.db.session.query(Distance).delete()
+        self.db.session.commit()
+        for m in minima[1:4]:
+            dist_graph.getDist(minima[0], m)
+        # the distances are kept until there are save_interval of them
+        self.assertEqual(self.db.session.query(Distance).count(), 0)
+        dist_graph.close()
+        self.assertEqual(self.db.session.query(Distance).count(), 3)
+        self.assertGreater(nstored, 3)
+
+    def test_parallel(self):
+        serial = self.make_connect()
+        parallel = self.make_connect(mindist_nproc=2)
+        try:
+            for (m1, m2), dist in serial.dist_graph.distance_map.items():
+                self.assertAlmostEqual(parallel.dist_graph.getDist(m1, m2), dist, places=6)
+        finally:
+            parallel.dist_graph.close()
+
+    def test_parallel_closure(self):
+        # the workers are forked, so the mindist function isn't pickled
+        mindist = self.mindist
+        self.mindist = lambda coords1, coords2: mindist(coords1, coords2)
+        parallel = self.make_connect(mindist_nproc=2)
+        try:
+            for (m1, m2), dist in parallel.dist_graph.distance_map.items():
+                self.assertAlmostEqual(dist, _centered_dist(m1.coords, m2.coords)[0], places=6)
+        finally:
+            parallel.dist_graph.close()
+
+
 if __name__ == "__main__":
     unittest.main()
 
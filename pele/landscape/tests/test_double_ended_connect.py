@@ -1,3 +1,4 @@
+import os
 import unittest
 
 import numpy as np
@@ -6,6 +7,18 @@ from pele.landscape import DoubleEndedConnect
 from pele.transition_states.tests.test_NEB import _x1, _x2
 
 
+class _DyingPotential(object):
+    """a potential which kills the process if it is used in a child process"""
+    def __init__(self, pot):
+        self.pot = pot
+        self.pid = os.getpid()
+
+    def __getattr__(self, name):
+        if os.getpid() != self.pid:
+            os._exit(1)
+        return getattr(self.pot, name)
+
+
 class TestDoubleEndedConnect(unittest.TestCase):
 #    def test1(self):
 #        from pele.systems import LJCluster
@@ -48,6 +61,44 @@ class TestDoubleEndedConnect(unittest.TestCase):
         
         path = connect.returnPath()
 
+    def test_parallel(self):
+        from pele.storage import Database
+        from pele.systems import LJCluster
+        np.random.seed(0)
+
+        natoms = 13
+        system = LJCluster(natoms)
+        pot = system.get_potential()
+        mindist = system.get_mindist(niter=1)
+
+        db = Database()
+        db.addMinimum(pot.getEnergy(_x1), _x1)
+        db.addMinimum(pot.getEnergy(_x2), _x2)
+        m1, m2 = db.minima()
+
+        connect = DoubleEndedConnect(m1, m2, pot, mindist, db, nproc=2)
+        connect.connect()
+        self.assertTrue(connect.success())
+        mints, S, energies = connect.returnPath()
+        self.assertEqual(len(mints), len(energies))
+
+    def test_parallel_worker_died(self):
+        from pele.storage import Database
+        from pele.systems import LJCluster
+
+        system = LJCluster(13)
+        pot = system.get_potential()
+        db = Database()
+        m1 = db.addMinimum(pot.getEnergy(_x1), _x1)
+        m2 = db.addMinimum(pot.getEnergy(_x2), _x2)
+
+        connect = DoubleEndedConnect(m1, m2, _DyingPotential(pot), system.get_mindist(niter=1),
+                                     db, nproc=2)
+        connect._poll_interval = 0.1
+        with self.assertRaises(RuntimeError):
+            connect.connect()
+
+
 if __name__ == "__main__":
     unittest.main()
 
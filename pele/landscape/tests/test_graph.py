@@ -90,6 +90,21 @@ class TestGraph(unittest.TestCase):
         # make sure min2 is not in database
         self.assertNotIn(min2, self.db.minima())
 
+    def test_merge_reused_id(self):
+        from pele.storage import Database
+        db = Database()
+        m1, m2, m3 = [db.addMinimum(float(i), [float(i)]) for i in range(3)]
+        db.addTransitionState(5., [5.], m1, m3)
+        graph = TSGraph(db)
+        graph.mergeMinima(m1, m3)
+        db.mergeMinima(m1, m3)
+        # the database gives the id of m3 to the next minimum
+        m4 = db.addMinimum(4., [4.])
+        self.assertEqual(m4.id(), m3.id())
+        graph.addMinimum(m4)
+        self.assertFalse(graph.areConnected(m1, m4))
+        self.assertFalse(graph.areConnected(m2, m4))
+
     def test_networkx(self):
         """check how networkx works"""
         graph = nx.Graph()
@@ -3,10 +3,116 @@ from __future__ import absolute_import
 import sys
 from .accept_tests import metropolis as metropolis
 import copy
+from timeit import default_timer
 import numpy as np
 from pele.optimize import Result
 
 
+class MCProfiler(object):
+    """accumulate the wall time spent in each phase of a monte carlo step
+
+    The phases are
+
+    - takestep : `takeStep.takeStep()`
+    - quench : the quench (or the energy evaluation for plain monte carlo).
+      With speculative quenching this includes taking the steps of a batch.
+    - confcheck : the `confCheck` callables
+    - accept : `acceptTest`
+    - storage : the storage callable
+    - updatestep : `takeStep.updateStep()`
+    - events : the `event_after_step` callables
+    - print : `printStep()`
+
+    Do not construct this directly, use `MonteCarlo.enable_profiling()`.
+
+    Parameters
+    ----------
+    print_interval : int, optional
+        if not None, write a summary line to `outstream` every
+        `print_interval` steps
+    outstream : open file object, optional
+
+    Attributes
+    ----------
+    times : dict
+        the accumulated wall time of each phase
+    ncalls : dict
+        the number of calls of each phase
+    nsteps : int
+        the number of steps profiled
+    nfev_counts : dict
+        a histogram of the number of function evaluations per quench,
+        mapping nfev to the number of quenches
+    """
+    phases = ("takestep", "quench", "confcheck", "accept", "storage", "updatestep", "events",
+              "print")
+    timer = staticmethod(default_timer)
+
+    def __init__(self, print_interval=None, outstream=sys.stdout):
+        self.print_interval = print_interval
+        self.outstream = outstream
+        self.reset()
+
+    def reset(self):
+        """set all counters to zero"""
+        self.times = dict((phase, 0.) for phase in self.phases)
+        self.ncalls = dict((phase, 0) for phase in self.phases)
+        self.nfev_counts = dict()
+        self.nsteps = 0
+        self.tstart = default_timer()
+
+    def lap(self, phase, tstart):
+        """add the time since tstart to phase and return the current time"""
+        t = default_timer()
+        self.times[phase] += t - tstart
+        self.ncalls[phase] += 1
+        return t
+
+    def add_nfev(self, nfev):
+        """record the number of function evaluations of one quench"""
+        self.nfev_counts[nfev] = self.nfev_counts.get(nfev, 0) + 1
+
+    def end_step(self):
+        """called at the end of each step"""
+        self.nsteps += 1
+        if self.print_interval and self.nsteps % self.print_interval == 0:
+            if self.outstream is not None:
+                self.outstream.write(self.summary_line() + "\n")
+
+    def nfev_histogram(self):
+        """return the arrays (nfev, counts) sorted by nfev"""
+        nfev = np.array(sorted(self.nfev_counts.keys()), dtype=int)
+        counts = np.array([self.nfev_counts[n] for n in nfev], dtype=int)
+        return nfev, counts
+
+    def mean_nfev(self):
+        nfev, counts = self.nfev_histogram()
+        if counts.sum() == 0:
+            return 0.
+        return float(np.dot(nfev, counts)) / counts.sum()
+
+    def wall_time(self):
+        """the time since the profiler was started or reset"""
+        return default_timer() - self.tstart
+
+    def as_dict(self):
+        """return the profile as a dictionary
+
+        the keys are the phases, each value is a dict with the keys `time`,
+        `ncalls` and `fraction` (the fraction of the wall time)
+        """
+        wall = max(self.wall_time(), 1e-300)
+        return dict((phase, dict(time=self.times[phase], ncalls=self.ncalls[phase],
+                                 fraction=self.times[phase] / wall))
+                    for phase in self.phases)
+
+    def summary_line(self):
+        wall = max(self.wall_time(), 1e-300)
+        parts = ["%s %.1f%%" % (phase, 100. * self.times[phase] / wall) for phase in self.phases]
+        return "MCProfile  steps= %d  time= %.4g s  %s  mean nfev= %.1f" % (
+            self.nsteps, wall, "  ".join(parts), self.mean_nfev())
+
+
 class MonteCarlo(object):
     """A class to run the Monte Carlo algorithm
 
@@ -56,6 +162,13 @@ class MonteCarlo(object):
         Default to standard out.
     store_initial : bool, optional
         if True store initial structure
+
+    Notes
+    -----
+    To find out where the time of a run is spent, call `enable_profiling()`.
+    The returned `MCProfiler` accumulates the wall time and the number of
+    calls of each phase of a step (takestep, quench, confCheck, acceptTest,
+    storage, events, ...) and a histogram of the quench function evaluations.
     
     See Also
     --------
@@ -63,6 +176,7 @@ class MonteCarlo(object):
     """
     
     insert_rejected = False
+    profiler = None
   
     def __init__(self, coords, potential, takeStep, storage=None, event_after_step=None, acceptTest=None,
                  temperature=1.0, confCheck=None, outstream=sys.stdout, store_initial=True, iprint=1):
@@ -90,6 +204,7 @@ class MonteCarlo(object):
             self.acceptTest = metropolis.Metropolis(self.temperature)
         
         self.stepnum = 0
+        self.profiler = None
     
         #########################################################################
         # store intial structure
@@ -121,6 +236,31 @@ class MonteCarlo(object):
         if frq is not None:
             self.printfrq = frq
     
+    def enable_profiling(self, print_interval=None, outstream="default"):
+        """time the phases of each step
+
+        Parameters
+        ----------
+        print_interval : int, optional
+            if not None, print a summary line every print_interval steps
+            instead of the output of `printStep`
+        outstream : open file or None
+            where to print the summary.  Defaults to self.outstream
+
+        Returns
+        -------
+        profiler : MCProfiler
+            the accumulated timings can be read from this object at any time
+        """
+        if outstream == "default":
+            outstream = self.outstream
+        self.profiler = MCProfiler(print_interval=print_interval, outstream=outstream)
+        return self.profiler
+
+    def disable_profiling(self):
+        """stop timing the steps"""
+        self.profiler = None
+
     def addEventAfterStep(self, event):
         """add an even to the list event_after_step """
         self.event_after_step.append( event )
@@ -129,17 +269,23 @@ class MonteCarlo(object):
     def _mcStep(self):
         """take one monte carlo basin hopping step
         """
+        profiler = self.profiler
+        if profiler is not None: t = profiler.timer()
         self.trial_coords = self.coords.copy() # make  a working copy
         #########################################################################
         # take step
         #########################################################################
         self.takeStep.takeStep(self.trial_coords, driver=self)
+        if profiler is not None: t = profiler.lap("takestep", t)
                 
         #########################################################################
         # calculate new energy
         #########################################################################
         self.trial_energy = self.potential.getEnergy(self.trial_coords)
         self.result.nfev += 1
+        if profiler is not None:
+            t = profiler.lap("quench", t)
+            profiler.add_nfev(1)
         
         
         
@@ -152,6 +298,7 @@ class MonteCarlo(object):
             if not check(self.trial_energy, self.trial_coords, driver=self):
                 self.acceptstep=False
                 self.config_ok = False
+        if profiler is not None: t = profiler.lap("confcheck", t)
         
         #########################################################################
         # check whether step is accepted with user defined tests.  If any returns
@@ -160,6 +307,7 @@ class MonteCarlo(object):
         if self.acceptstep:
             self.acceptstep = self.acceptTest(self.markovE, self.trial_energy,
                                               self.coords, self.trial_coords)
+        if profiler is not None: profiler.lap("accept", t)
             
         #########################################################################
         # return new coords and energy and whether or not they were accepted
@@ -178,9 +326,18 @@ class MonteCarlo(object):
         self.stepnum += 1
         self.markovE_old = self.markovE
         acceptstep, newcoords, newE = self._mcStep()
-        self.printStep()
+        profiler = self.profiler
+        if profiler is None:
+            self.printStep()
+        else:
+            t = profiler.timer()
+            # the summary line of the profiler replaces the step output
+            if not profiler.print_interval:
+                self.printStep()
+            t = profiler.lap("print", t)
         if self.storage and (self.insert_rejected or acceptstep) and self.config_ok:
             self.storage(newE, newcoords)
+            if profiler is not None: t = profiler.lap("storage", t)
 
         if acceptstep:
             self.coords = newcoords
@@ -191,9 +348,14 @@ class MonteCarlo(object):
                 self.result.energy = self.markovE
                 self.result.coords = self.coords.copy()
 
+        if profiler is not None: t = profiler.timer()
         self.takeStep.updateStep(acceptstep, driver=self)
+        if profiler is not None: t = profiler.lap("updatestep", t)
         for event in self.event_after_step:
             event(self.markovE, self.coords, acceptstep)
+        if profiler is not None:
+            profiler.lap("events", t)
+            profiler.end_step()
 
     def printStep(self):
         if self.stepnum % self.printfrq == 0:
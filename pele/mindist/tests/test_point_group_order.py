@@ -2,11 +2,14 @@ from __future__ import print_function
 import unittest
 import os
 import sys
+import shutil
+import tempfile
 import nose
 
 import numpy as np
 from pele.mindist import PointGroupOrderCluster, ExactMatchAtomicCluster
 from pele.utils.xyz import read_xyz
+from pele.storage.migrate import migrate_copy
 
 
 class TestPgorderLj75(unittest.TestCase):
@@ -71,9 +74,16 @@ class TestPgorderLj13(unittest.TestCase):
 
 class TestPgorderLj13Database(unittest.TestCase):
     """as of Mar 5 2014 this test fails.  It needs to be fixed"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
     def test1(self):
         d = os.path.dirname(__file__)
         dbfname = os.path.join(d, "lj13_small_pathsample.{}.sqlite".format(sys.version_info.major))
+        dbfname = migrate_copy(dbfname, os.path.join(self.tmpdir, "test.sqlite"))
 
         from pele.systems import LJCluster
         natoms = 13
@@ -94,9 +104,16 @@ class TestPgorderLj13Database(unittest.TestCase):
 
 class TestPgorderLj75Database(unittest.TestCase):
     """as of Mar 5 2014 this test fails.  It needs to be fixed"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
     def test1(self):
         d = os.path.dirname(__file__)
         dbfname = os.path.join(d, "lj75_very_small_pathsample.{}.sqlite".format(sys.version_info.major))
+        dbfname = migrate_copy(dbfname, os.path.join(self.tmpdir, "test.sqlite"))
 
         from pele.systems import LJCluster
         natoms = 75
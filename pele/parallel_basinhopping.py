@@ -0,0 +1,244 @@
+"""run several independent basinhopping walkers in parallel"""
+from __future__ import print_function
+import sys
+import time
+import multiprocessing as mp
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from pele.optimize import Result
+
+__all__ = ["ParallelBasinHopping"]
+
+
+class _QueueStorage(object):
+    """storage callable for a walker which forwards every minimum to the writer
+
+    The walker process never touches the database.  Instead the minima are
+    passed through `queue` to the parent process, which is the only one
+    writing to the database.
+    """
+    def __init__(self, queue, walker_id):
+        self.queue = queue
+        self.walker_id = walker_id
+
+    def __call__(self, E, coords):
+        # the queue pickles in a background thread, so pass a private copy
+        self.queue.put(("minimum", self.walker_id, E, np.array(coords)))
+
+
+class _BHWalker(mp.Process):
+    """run a single basinhopping chain in a separate process
+
+    the basinhopping object is built by `system.get_basinhopping()`.  When the
+    run is finished a summary message is put into the queue.
+    """
+    def __init__(self, walker_id, system, queue, nsteps, seed, coords=None, bh_kwargs=None):
+        mp.Process.__init__(self)
+        self.walker_id = walker_id
+        self.system = system
+        self.queue = queue
+        self.nsteps = nsteps
+        self.seed = seed
+        self.coords = coords
+        if bh_kwargs is None:
+            bh_kwargs = dict()
+        self.bh_kwargs = bh_kwargs
+
+    def run(self):
+        np.random.seed(self.seed)
+        try:
+            storage = _QueueStorage(self.queue, self.walker_id)
+            bh = self.system.get_basinhopping(coords=self.coords, add_minimum=storage,
+                                              **self.bh_kwargs)
+            bh.run(self.nsteps)
+            # the initial quench done in BasinHopping.__init__ counts as well
+            nquenches = self.nsteps + 1
+            self.queue.put(("done", self.walker_id, nquenches, bh.result.energy,
+                            bh.result.coords, bh.coords))
+        except Exception as err:
+            self.queue.put(("error", self.walker_id, repr(err)))
+            raise
+
+
+class ParallelBasinHopping(object):
+    """run independent basinhopping walkers in a process pool
+
+    Each walker is a separate process which runs its own Markov chain built
+    from `system.get_basinhopping()`.  All minima found by the walkers are sent
+    back to this process, which is the only one writing to the database.
+
+    Parameters
+    ----------
+    system : BaseSystem
+        the system class.  It is used to construct the basinhopping object
+        in each walker, so it must be available in the child processes.
+    database : Database, optional
+        the database to store the minima in.  If None, use
+        `system.create_database()`
+    nwalkers : int, optional
+        number of independent walkers.  Defaults to the number of cores
+    coords : list of arrays, optional
+        starting configurations, one per walker.  If None, each walker starts
+        from `system.get_random_configuration()`
+    seed : int, optional
+        the walkers use the seeds seed, seed+1, ...  If None a random seed
+        is chosen.
+    max_n_minima : int, optional
+        only keep this number of lowest energy minima in the database
+    commit_interval : int, optional
+        commit the database changes every `commit_interval` minima
+    outstream : open file object, optional
+        where to print the summary of each run.  None for no printing
+    kwargs :
+        extra keyword arguments are passed to `system.get_basinhopping()`.
+        By default the walkers don't print anything.
+
+    Attributes
+    ----------
+    nquenches : int
+        total number of quenches done by all walkers in the last run
+    wall_time : float
+        wall clock time of the last run
+    quenches_per_second : float
+        aggregate quench rate of the last run
+    result : Result
+        the lowest minimum found by any walker
+
+    Examples
+    --------
+
+    >>> system = LJCluster(38)
+    >>> db = system.create_database("lj38.sqlite")
+    >>> pbh = ParallelBasinHopping(system, database=db, nwalkers=4)
+    >>> res = pbh.run(1000)
+    >>> print res.energy, res.quenches_per_second
+
+    See Also
+    --------
+    pele.basinhopping.BasinHopping
+    pele.systems.BaseSystem.get_basinhopping
+    """
+    def __init__(self, system, database=None, nwalkers=None, coords=None, seed=None,
+                 max_n_minima=None, commit_interval=100, outstream=sys.stdout,
+                 **kwargs):
+        self.system = system
+        if database is None:
+            database = system.create_database()
+        self.database = database
+        if nwalkers is None:
+            nwalkers = mp.cpu_count()
+        self.nwalkers = nwalkers
+        if coords is not None and len(coords) != self.nwalkers:
+            raise ValueError("coords must have one configuration per walker")
+        self.coords = coords
+        if seed is None:
+            seed = np.random.randint(0, 2**30)
+        self.seed = seed
+        self.outstream = outstream
+        self.bh_kwargs = kwargs
+        self.bh_kwargs.setdefault("outstream", None)
+
+        self._add_minimum = self.database.minimum_adder(max_n_minima=max_n_minima,
+                                                        commit_interval=commit_interval)
+
+        self.nruns = 0
+        self.nquenches = 0
+        self.wall_time = 0.
+        self.quenches_per_second = 0.
+        self.result = Result()
+        self.result.energy = None
+        self.result.coords = None
+
+    def _start_walkers(self, nsteps, queue):
+        walkers = []
+        for i in range(self.nwalkers):
+            coords = None if self.coords is None else self.coords[i]
+            seed = self.seed + self.nruns * self.nwalkers + i
+            walker = _BHWalker(i, self.system, queue, nsteps, seed, coords=coords,
+                               bh_kwargs=self.bh_kwargs)
+            walker.daemon = True
+            walker.start()
+            walkers.append(walker)
+        return walkers
+
+    def _check_alive(self, walkers, finished):
+        for walker in walkers:
+            if walker.walker_id not in finished and not walker.is_alive():
+                if walker.exitcode != 0:
+                    raise RuntimeError("basinhopping walker %d died with exit code %s" %
+                                       (walker.walker_id, walker.exitcode))
+
+    def _terminate(self, walkers):
+        for walker in walkers:
+            if walker.is_alive():
+                walker.terminate()
+            walker.join()
+
+    def run(self, nsteps):
+        """run each walker for nsteps basinhopping steps
+
+        If run is called again, the walkers continue from the Markov chain
+        coordinates reached at the end of the previous run.
+
+        Returns
+        -------
+        res : Result
+            the lowest minimum found with the timing information of the run
+        """
+        msg_queue = mp.Queue()
+        tstart = time.time()
+        walkers = self._start_walkers(nsteps, msg_queue)
+        finished = dict()
+        last_coords = [None] * self.nwalkers
+        try:
+            while len(finished) < self.nwalkers:
+                try:
+                    message = msg_queue.get(timeout=1.)
+                except queue.Empty:
+                    self._check_alive(walkers, finished)
+                    continue
+                if message[0] == "minimum":
+                    E, coords = message[2:4]
+                    self._add_minimum(E, coords)
+                elif message[0] == "done":
+                    walker_id, nquenches, E, coords, markov_coords = message[1:]
+                    finished[walker_id] = nquenches
+                    last_coords[walker_id] = markov_coords
+                    if self.result.energy is None or E < self.result.energy:
+                        self.result.energy = E
+                        self.result.coords = coords
+                elif message[0] == "error":
+                    raise RuntimeError("basinhopping walker %d failed: %s" % (message[1], message[2]))
+        finally:
+            self._terminate(walkers)
+            self.database.session.commit()
+
+        self.wall_time = time.time() - tstart
+        self.nquenches = sum(finished.values())
+        self.quenches_per_second = self.nquenches / self.wall_time
+        self.coords = last_coords
+        self.nruns += 1
+
+        self.result.nquenches = self.nquenches
+        self.result.wall_time = self.wall_time
+        self.result.quenches_per_second = self.quenches_per_second
+
+        if self.outstream is not None:
+            self.outstream.write("ParallelBasinHopping: %d walkers  quenches= %d  time= %.4g s  quenches/s= %.4g  lowest E= %.12g\n"
+                                 % (self.nwalkers, self.nquenches, self.wall_time,
+                                    self.quenches_per_second, self.result.energy))
+        return self.result
+
+
+if __name__ == "__main__":
+    from pele.systems import LJCluster
+    system = LJCluster(38)
+    db = system.create_database()
+    pbh = ParallelBasinHopping(system, database=db)
+    pbh.run(100)
+    print(db.number_of_minima(), "minima found")
@@ -0,0 +1,26 @@
+"""
+.. currentmodule:: pele.parallel_tempering
+Parallel Tempering (`pele.parallel_tempering`)
+==============================================
+
+This module implements replica exchange (parallel tempering) basinhopping.
+A ladder of replicas, each a `BasinHopping` (or any `MonteCarlo`) chain at a
+different temperature, is run in long lived worker processes.  At regular
+intervals the configurations of neighbouring replicas are swapped according to
+the replica exchange Metropolis criterion.  The configurations are kept in
+shared memory, so an exchange is only a swap of two rows of an array and the
+overhead is small compared to the cost of the quenches.
+
+The temperature ladder can be adapted automatically so that all neighbour
+pairs exchange at a target acceptance ratio, and the run can be saved with
+`ParallelTempering.checkpoint` and restarted with `ParallelTempering.resume`.
+
+.. autosummary::
+   :toctree: generated/
+
+    ParallelTempering
+    geometric_temperatures
+
+"""
+from __future__ import absolute_import
+from ._parallel_tempering import *
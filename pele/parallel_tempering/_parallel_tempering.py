@@ -0,0 +1,505 @@
+from __future__ import print_function
+import os
+import sys
+import time
+import multiprocessing as mp
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from pele.optimize import Result
+from pele.takestep import AdaptiveStepsize, RandomDisplacement
+from pele.parallel_basinhopping import _QueueStorage
+from pele.utils.fork_pool import _get_fork_context
+
+__all__ = ["ParallelTempering", "geometric_temperatures"]
+
+
+def geometric_temperatures(Tmin, Tmax, nreplicas):
+    """return a geometrically spaced temperature ladder from Tmin to Tmax"""
+    if nreplicas == 1:
+        return np.array([float(Tmin)])
+    return Tmin * (float(Tmax) / Tmin) ** (np.arange(nreplicas) / float(nreplicas - 1))
+
+
+def _set_temperature(mc, T):
+    """set the temperature of a monte carlo object and of its accept test"""
+    mc.temperature = T
+    if hasattr(mc.acceptTest, "temperature"):
+        mc.acceptTest.temperature = T
+
+
+class _DefaultReplicaFactory(object):
+    """build a basinhopping replica from `system.get_basinhopping()`
+
+    The default takestep of the system also adapts the temperature, which
+    would break detailed balance of the exchanges.  The replicas therefore
+    only adapt the step size.
+    """
+    def __init__(self, system, stepsize=0.6, bh_kwargs=None):
+        self.system = system
+        self.stepsize = stepsize
+        if bh_kwargs is None:
+            bh_kwargs = dict()
+        self.bh_kwargs = bh_kwargs
+
+    def __call__(self, coords, temperature, storage):
+        takestep = AdaptiveStepsize(RandomDisplacement(stepsize=self.stepsize))
+        return self.system.get_basinhopping(coords=coords, takestep=takestep,
+                                            add_minimum=storage, temperature=temperature,
+                                            **self.bh_kwargs)
+
+
+class _ReplicaProcess(_get_fork_context().Process):
+    """run one replica of the temperature ladder in a long lived process
+
+    The replica at ladder position `index` reads its configuration, markov
+    energy and temperature from the shared buffers before each block of steps
+    and writes them back afterwards.  Exchanges are done by the parent, which
+    simply swaps the rows of the shared buffers.  Only small control messages
+    are passed through the pipe and the queue.
+    """
+    def __init__(self, index, factory, conn, msg_queue, shared, ndof, seed, use_storage):
+        super(_ReplicaProcess, self).__init__()
+        self.index = index
+        self.factory = factory
+        self.conn = conn
+        self.msg_queue = msg_queue
+        self.shared = shared
+        self.ndof = ndof
+        self.seed = seed
+        self.use_storage = use_storage
+
+    def _views(self):
+        coords, energies, temperatures, best_coords, best_energies = self.shared
+        n = len(energies)
+        return (np.frombuffer(coords).reshape(n, self.ndof), np.frombuffer(energies),
+                np.frombuffer(temperatures), np.frombuffer(best_coords).reshape(n, self.ndof),
+                np.frombuffer(best_energies))
+
+    def run(self):
+        i = self.index
+        np.random.seed(self.seed)
+        coords, energies, temperatures, best_coords, best_energies = self._views()
+        try:
+            storage = None
+            if self.use_storage:
+                storage = _QueueStorage(self.msg_queue, i)
+            mc = self.factory(coords[i].copy(), temperatures[i], storage)
+            coords[i, :] = mc.coords
+            energies[i] = mc.markovE
+            best_coords[i, :] = mc.result.coords
+            best_energies[i] = mc.result.energy
+            self.msg_queue.put(("ready", i))
+
+            while True:
+                message = self.conn.recv()
+                if message[0] == "stop":
+                    break
+                nsteps = message[1]
+                mc.coords = coords[i].copy()
+                mc.markovE = energies[i]
+                _set_temperature(mc, temperatures[i])
+                mc.run(nsteps)
+                coords[i, :] = mc.coords
+                energies[i] = mc.markovE
+                if mc.result.energy < best_energies[i]:
+                    best_coords[i, :] = mc.result.coords
+                    best_energies[i] = mc.result.energy
+                self.msg_queue.put(("done", i))
+        except Exception as err:
+            self.msg_queue.put(("error", i, repr(err)))
+            raise
+
+
+class ParallelTempering(object):
+    """replica exchange (parallel tempering) basinhopping
+
+    Each replica is a Markov chain (by default a `BasinHopping` object) at
+    a fixed temperature of the ladder, running in its own long lived
+    process.  Every `exchange_frq` steps the configurations of neighbouring
+    replicas are swapped with the probability
+
+        min(1, exp((1/T_k - 1/T_k+1) * (E_k - E_k+1)))
+
+    The even and the odd neighbour pairs are tried in alternation.  The
+    configurations live in shared memory buffers, so an exchange costs a swap
+    of two rows and no coordinates are pickled.
+
+    Parameters
+    ----------
+    system : BaseSystem
+        the system class.  It is used to build the replicas and the initial
+        configurations.
+    temperatures : list of floats, optional
+        the temperature ladder in increasing order.  If None a geometric
+        ladder from `Tmin` to `Tmax` with `nreplicas` temperatures is used.
+    Tmin, Tmax : float, optional
+        the bounds of the default ladder
+    nreplicas : int, optional
+        the number of replicas of the default ladder.  Defaults to the number
+        of cores
+    exchange_frq : int, optional
+        try exchanges every `exchange_frq` monte carlo steps
+    database : Database, optional
+        if passed, the minima found by all replicas are added to the database.
+        The parent process is the only one writing to the database.
+    coords : list of arrays, optional
+        starting configurations, one per replica.  If None, each replica
+        starts from `system.get_random_configuration()`
+    adaptive : bool, optional
+        if True, the inner temperatures of the ladder are adjusted every
+        `adapt_interval` exchange rounds to reach the acceptance ratio
+        `target_acceptance` for all neighbour pairs.  Tmin and Tmax are kept
+        fixed.
+    target_acceptance : float, optional
+    adapt_interval : int, optional
+    adapt_factor : float, optional
+        how strongly the ladder reacts to a deviation from the target
+    replica_factory : callable, optional
+        `replica_factory(coords, temperature, storage)` must return a
+        `MonteCarlo` like object with the methods and attributes `run`,
+        `coords`, `markovE`, `temperature`, `acceptTest` and `result`.  The
+        default builds the replicas with `system.get_basinhopping()` and an
+        adaptive step size.
+    stepsize : float, optional
+        initial step size of the default replicas
+    seed : int, optional
+        random seed.  The replicas use seed+1, seed+2, ...
+    max_n_minima, commit_interval :
+        passed to `database.minimum_adder()`
+    outstream : open file object, optional
+        where to print the summary of each run.  None for no printing
+    kwargs :
+        extra keyword arguments are passed to `system.get_basinhopping()` by
+        the default replica factory.  By default the replicas don't print
+        anything.
+
+    Attributes
+    ----------
+    temperatures : numpy array
+        the current temperature ladder
+    nattempts, naccepts : numpy arrays
+        the number of attempted and accepted exchanges for each neighbour pair
+        (k, k+1)
+    exchange_time : float
+        total time spent in the exchanges
+    wall_time : float
+        total wall clock time of all runs
+    result : Result
+        the lowest minimum found by any replica
+
+    Examples
+    --------
+
+    >>> system = LJCluster(31)
+    >>> pt = ParallelTempering(system, Tmin=0.1, Tmax=1., nreplicas=8,
+    ...                        adaptive=True)
+    >>> res = pt.run(10000)
+    >>> print res.energy, pt.acceptance_ratios()
+    >>> pt.checkpoint("pt.npz")
+    >>> pt.close()
+    >>> # later
+    >>> pt = ParallelTempering.resume("pt.npz", system)
+
+    See Also
+    --------
+    pele.basinhopping.BasinHopping
+    pele.parallel_basinhopping.ParallelBasinHopping
+    """
+    def __init__(self, system, temperatures=None, Tmin=1., Tmax=2., nreplicas=None,
+                 exchange_frq=10, database=None, coords=None, adaptive=False,
+                 target_acceptance=0.25, adapt_interval=10, adapt_factor=1.,
+                 replica_factory=None, stepsize=0.6, seed=None, max_n_minima=None,
+                 commit_interval=100, outstream=sys.stdout, **kwargs):
+        self.system = system
+        if temperatures is None:
+            if nreplicas is None:
+                nreplicas = mp.cpu_count()
+            temperatures = geometric_temperatures(Tmin, Tmax, nreplicas)
+        temperatures = np.array(temperatures, dtype=float)
+        if len(temperatures) > 1 and np.any(np.diff(temperatures) <= 0):
+            raise ValueError("the temperatures must be in increasing order")
+        self.nreplicas = len(temperatures)
+        if coords is None:
+            coords = [system.get_random_configuration() for i in range(self.nreplicas)]
+        if len(coords) != self.nreplicas:
+            raise ValueError("coords must have one configuration per replica")
+        self.ndof = len(coords[0])
+
+        self.exchange_frq = exchange_frq
+        self.adaptive = adaptive
+        self.target_acceptance = target_acceptance
+        self.adapt_interval = adapt_interval
+        self.adapt_factor = adapt_factor
+
+        if seed is None:
+            seed = np.random.randint(0, 2**30)
+        self.seed = seed
+        self._random = np.random.RandomState(seed)
+        self.outstream = outstream
+
+        if replica_factory is None:
+            kwargs.setdefault("outstream", None)
+            replica_factory = _DefaultReplicaFactory(system, stepsize=stepsize, bh_kwargs=kwargs)
+        self.replica_factory = replica_factory
+
+        self.database = database
+        self._add_minimum = None
+        if database is not None:
+            self._add_minimum = database.minimum_adder(max_n_minima=max_n_minima,
+                                                       commit_interval=commit_interval)
+
+        # the shared buffers.  Row k always belongs to the k'th temperature
+        self._ctx = _get_fork_context()
+        n, ndof = self.nreplicas, self.ndof
+        self._shared = (self._ctx.RawArray("d", n * ndof), self._ctx.RawArray("d", n),
+                        self._ctx.RawArray("d", n), self._ctx.RawArray("d", n * ndof),
+                        self._ctx.RawArray("d", n))
+        self.coords = np.frombuffer(self._shared[0]).reshape(n, ndof)
+        self.energies = np.frombuffer(self._shared[1])
+        self.temperatures = np.frombuffer(self._shared[2])
+        self._best_coords = np.frombuffer(self._shared[3]).reshape(n, ndof)
+        self._best_energies = np.frombuffer(self._shared[4])
+        for i in range(n):
+            self.coords[i, :] = coords[i]
+        self.temperatures[:] = temperatures
+        self.energies[:] = np.nan
+        self._best_energies[:] = np.inf
+
+        self.nattempts = np.zeros(max(n - 1, 0), dtype=int)
+        self.naccepts = np.zeros(max(n - 1, 0), dtype=int)
+        self._window_attempts = np.zeros_like(self.nattempts)
+        self._window_accepts = np.zeros_like(self.naccepts)
+        # replica_ids[k] is the label of the configuration at temperature k
+        self.replica_ids = np.arange(n)
+        self.nexchanges = 0
+        self.stepnum = 0
+        self.exchange_time = 0.
+        self.wall_time = 0.
+
+        self.result = Result()
+        self.result.energy = None
+        self.result.coords = None
+
+        self._processes = None
+        self._conns = None
+        self._msg_queue = None
+
+    def _start(self):
+        self._msg_queue = self._ctx.Queue()
+        self._processes = []
+        self._conns = []
+        for i in range(self.nreplicas):
+            parent_conn, child_conn = self._ctx.Pipe()
+            p = _ReplicaProcess(i, self.replica_factory, child_conn, self._msg_queue,
+                                self._shared, self.ndof, self.seed + 1 + i,
+                                self._add_minimum is not None)
+            p.daemon = True
+            p.start()
+            self._processes.append(p)
+            self._conns.append(parent_conn)
+        self._wait_for("ready")
+
+    def _check_alive(self):
+        for p in self._processes:
+            if not p.is_alive():
+                raise RuntimeError("replica %d died with exit code %s" % (p.index, p.exitcode))
+
+    def _wait_for(self, kind):
+        """process messages until every replica has sent the message `kind`"""
+        finished = set()
+        while len(finished) < self.nreplicas:
+            try:
+                message = self._msg_queue.get(timeout=1.)
+            except queue.Empty:
+                self._check_alive()
+                continue
+            if message[0] == "minimum":
+                self._add_minimum(message[2], message[3])
+            elif message[0] == kind:
+                finished.add(message[1])
+            elif message[0] == "error":
+                raise RuntimeError("replica %d failed: %s" % (message[1], message[2]))
+
+    def _run_block(self, nsteps):
+        for conn in self._conns:
+            conn.send(("run", nsteps))
+        self._wait_for("done")
+        self.stepnum += nsteps
+
+    def _exchange(self):
+        """try to swap the configurations of the even or the odd neighbour pairs"""
+        t0 = time.time()
+        beta = 1. / self.temperatures
+        for k in range(self.nexchanges % 2, self.nreplicas - 1, 2):
+            self.nattempts[k] += 1
+            self._window_attempts[k] += 1
+            delta = (beta[k] - beta[k + 1]) * (self.energies[k] - self.energies[k + 1])
+            if delta >= 0 or self._random.rand() < np.exp(delta):
+                self.naccepts[k] += 1
+                self._window_accepts[k] += 1
+                self.coords[[k, k + 1]] = self.coords[[k + 1, k]]
+                self.energies[[k, k + 1]] = self.energies[[k + 1, k]]
+                self.replica_ids[[k, k + 1]] = self.replica_ids[[k + 1, k]]
+        self.nexchanges += 1
+        if self.adaptive and self.nexchanges % self.adapt_interval == 0:
+            self._adapt_temperatures()
+        self.exchange_time += time.time() - t0
+
+    def _adapt_temperatures(self):
+        """rescale the gaps of the ladder according to the exchange acceptance
+
+        The gap in log(T) of each pair is multiplied by
+        exp(adapt_factor * (acceptance - target_acceptance)), then all gaps are
+        rescaled so that Tmin and Tmax don't change.
+        """
+        if self.nreplicas < 3:
+            return
+        tried = self._window_attempts > 0
+        if not np.all(tried):
+            return
+        acc = self._window_accepts / self._window_attempts.astype(float)
+        logT = np.log(self.temperatures)
+        gaps = np.diff(logT)
+        gaps *= np.exp(self.adapt_factor * (acc - self.target_acceptance))
+        gaps *= (logT[-1] - logT[0]) / gaps.sum()
+        newlogT = logT[0] + np.concatenate(([0.], np.cumsum(gaps)))
+        newlogT[-1] = logT[-1]
+        self.temperatures[:] = np.exp(newlogT)
+        self._window_attempts[:] = 0
+        self._window_accepts[:] = 0
+
+    def _update_result(self):
+        i = np.argmin(self._best_energies)
+        if self.result.energy is None or self._best_energies[i] < self.result.energy:
+            self.result.energy = self._best_energies[i]
+            self.result.coords = self._best_coords[i].copy()
+
+    def acceptance_ratios(self):
+        """return the exchange acceptance ratio of each neighbour pair"""
+        return self.naccepts / np.maximum(self.nattempts, 1).astype(float)
+
+    def run(self, nsteps):
+        """run every replica for nsteps monte carlo steps
+
+        exchanges are tried after every `exchange_frq` steps.  The replica
+        processes are started on the first call and kept alive until `close()`
+        is called, so `run` can be called repeatedly.
+
+        Returns
+        -------
+        res : Result
+            the lowest minimum found by any replica
+        """
+        tstart = time.time()
+        try:
+            if self._processes is None:
+                self._start()
+            nblocks, remainder = divmod(nsteps, self.exchange_frq)
+            for i in range(nblocks):
+                self._run_block(self.exchange_frq)
+                self._exchange()
+            if remainder > 0:
+                self._run_block(remainder)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if self.database is not None:
+                self.database.session.commit()
+        self.wall_time += time.time() - tstart
+        self._update_result()
+
+        self.result.nsteps = self.stepnum
+        self.result.nexchanges = self.nexchanges
+        self.result.acceptance_ratios = self.acceptance_ratios()
+        self.result.temperatures = self.temperatures.copy()
+
+        if self.outstream is not None:
+            self.outstream.write("ParallelTempering: %d replicas  steps= %d  exchanges= %d  exchange time= %.4g s (%.3g%%)  lowest E= %.12g\n"
+                                 % (self.nreplicas, self.stepnum, self.nexchanges, self.exchange_time,
+                                    100. * self.exchange_time / max(self.wall_time, 1e-300),
+                                    self.result.energy))
+        return self.result
+
+    def close(self):
+        """stop the replica processes"""
+        if self._processes is None:
+            return
+        for conn, p in zip(self._conns, self._processes):
+            if p.is_alive():
+                try:
+                    conn.send(("stop",))
+                except (IOError, OSError):
+                    pass
+        for p in self._processes:
+            p.join(5.)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self._processes = None
+        self._conns = None
+        self._msg_queue = None
+
+    def checkpoint(self, fname):
+        """save the state of the run to a numpy .npz file
+
+        The file is written to a temporary file first and then renamed, so an
+        existing checkpoint is never left half written.  The state of the
+        takestep objects of the replicas (e.g. the adapted step sizes) is not
+        saved.
+
+        See Also
+        --------
+        resume
+        """
+        self._update_result()
+        best_energy = np.inf if self.result.energy is None else self.result.energy
+        best_coords = self.coords[0] if self.result.coords is None else self.result.coords
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as fout:
+            np.savez(fout, coords=self.coords, energies=self.energies,
+                     temperatures=self.temperatures, nattempts=self.nattempts,
+                     naccepts=self.naccepts, replica_ids=self.replica_ids,
+                     nexchanges=self.nexchanges, stepnum=self.stepnum,
+                     exchange_frq=self.exchange_frq,
+                     best_energy=best_energy, best_coords=best_coords)
+        os.rename(tmpname, fname)
+
+    @classmethod
+    def resume(cls, fname, system, **kwargs):
+        """restart a run from a file written by `checkpoint()`
+
+        The remaining keyword arguments are passed to the constructor.
+
+        Returns
+        -------
+        pt : ParallelTempering
+        """
+        data = np.load(fname)
+        kwargs.setdefault("exchange_frq", int(data["exchange_frq"]))
+        pt = cls(system, temperatures=data["temperatures"], coords=list(data["coords"]),
+                 **kwargs)
+        pt.nattempts[:] = data["nattempts"]
+        pt.naccepts[:] = data["naccepts"]
+        pt.replica_ids[:] = data["replica_ids"]
+        pt.nexchanges = int(data["nexchanges"])
+        pt.stepnum = int(data["stepnum"])
+        if np.isfinite(data["best_energy"]):
+            pt.result.energy = float(data["best_energy"])
+            pt.result.coords = data["best_coords"].copy()
+        return pt
+
+
+if __name__ == "__main__":
+    from pele.systems import LJCluster
+    system = LJCluster(13)
+    pt = ParallelTempering(system, Tmin=0.2, Tmax=1., nreplicas=4, adaptive=True)
+    pt.run(200)
+    print("exchange acceptance", pt.acceptance_ratios())
+    print("temperatures", pt.temperatures)
+    pt.close()
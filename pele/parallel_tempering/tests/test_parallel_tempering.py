@@ -0,0 +1,140 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pele.parallel_tempering import ParallelTempering, geometric_temperatures
+from pele.systems import LJCluster
+
+
+class TestGeometricTemperatures(unittest.TestCase):
+    def test(self):
+        T = geometric_temperatures(0.5, 2., 5)
+        self.assertEqual(len(T), 5)
+        self.assertAlmostEqual(T[0], 0.5)
+        self.assertAlmostEqual(T[-1], 2.)
+        ratios = T[1:] / T[:-1]
+        self.assertTrue(np.allclose(ratios, ratios[0]))
+
+
+class TestExchange(unittest.TestCase):
+    """test the exchanges without starting any replicas"""
+    def setUp(self):
+        self.system = LJCluster(6)
+        self.pt = ParallelTempering(self.system, temperatures=[1., 2.], seed=0,
+                                    outstream=None)
+
+    def test_downhill_swap(self):
+        # the cold replica has the higher energy, so the swap is always accepted
+        pt = self.pt
+        pt.energies[:] = [-10., -12.]
+        c0, c1 = pt.coords[0].copy(), pt.coords[1].copy()
+        pt._exchange()
+        self.assertEqual(pt.naccepts[0], 1)
+        self.assertEqual(list(pt.energies), [-12., -10.])
+        self.assertTrue(np.all(pt.coords[0] == c1))
+        self.assertTrue(np.all(pt.coords[1] == c0))
+        self.assertEqual(list(pt.replica_ids), [1, 0])
+
+    def test_uphill_swap(self):
+        # exp(-0.5 * 1000) is never accepted
+        pt = self.pt
+        pt.energies[:] = [-1010., -10.]
+        pt._exchange()
+        self.assertEqual(pt.nattempts[0], 1)
+        self.assertEqual(pt.naccepts[0], 0)
+        self.assertEqual(pt.energies[0], -1010.)
+
+    def test_adapt_temperatures(self):
+        pt = ParallelTempering(self.system, temperatures=[1., 2., 4., 8.], adaptive=True,
+                               seed=0, outstream=None)
+        T0 = pt.temperatures.copy()
+        # the first pair exchanges too often, the last one too rarely
+        pt._window_attempts[:] = 10
+        pt._window_accepts[:] = [10, 2, 0]
+        pt._adapt_temperatures()
+        T = pt.temperatures
+        self.assertAlmostEqual(T[0], T0[0])
+        self.assertAlmostEqual(T[-1], T0[-1])
+        self.assertTrue(np.all(np.diff(T) > 0))
+        self.assertGreater(T[1], T0[1])
+        self.assertLess(np.log(T[3] / T[2]), np.log(T0[3] / T0[2]))
+        self.assertEqual(pt._window_attempts.sum(), 0)
+
+    def test_bad_temperatures(self):
+        with self.assertRaises(ValueError):
+            ParallelTempering(self.system, temperatures=[2., 1.])
+
+
+class TestParallelTempering(unittest.TestCase):
+    def setUp(self):
+        self.system = LJCluster(6)
+        self.db = self.system.create_database()
+        self.e1 = -12.7120622568
+        self.e2 = -12.302927529580728
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertEnergy(self, e):
+        self.assertTrue(abs(e - self.e1) < 1e-4 or abs(e - self.e2) < 1e-4)
+
+    def test_run(self):
+        pt = ParallelTempering(self.system, temperatures=[0.5, 1., 2.], exchange_frq=2,
+                               database=self.db, seed=0, outstream=None)
+        try:
+            res = pt.run(10)
+        finally:
+            pt.close()
+        self.assertEnergy(res.energy)
+        self.assertEqual(pt.nexchanges, 5)
+        self.assertEqual(pt.nattempts.sum(), 5)
+        self.assertEqual(pt.stepnum, 10)
+        self.assertEqual(sorted(pt.replica_ids), [0, 1, 2])
+        self.assertGreater(self.db.number_of_minima(), 0)
+        # the shared configurations must be consistent with the energies
+        pot = self.system.get_potential()
+        for x, e in zip(pt.coords, pt.energies):
+            self.assertAlmostEqual(pot.getEnergy(x), e, 5)
+
+    def test_adaptive(self):
+        pt = ParallelTempering(self.system, temperatures=[0.1, 0.2, 0.4, 3.], exchange_frq=1,
+                               adaptive=True, adapt_interval=4, seed=1, outstream=None)
+        T0 = pt.temperatures.copy()
+        try:
+            pt.run(12)
+        finally:
+            pt.close()
+        self.assertAlmostEqual(pt.temperatures[0], T0[0])
+        self.assertAlmostEqual(pt.temperatures[-1], T0[-1])
+        self.assertTrue(np.all(np.diff(pt.temperatures) > 0))
+
+    def test_checkpoint_resume(self):
+        fname = os.path.join(self.tmpdir, "pt.npz")
+        pt = ParallelTempering(self.system, temperatures=[0.5, 1.], exchange_frq=2,
+                               seed=0, outstream=None)
+        try:
+            pt.run(4)
+        finally:
+            pt.close()
+        pt.checkpoint(fname)
+
+        pt2 = ParallelTempering.resume(fname, self.system, seed=1, outstream=None)
+        self.assertEqual(pt2.nexchanges, pt.nexchanges)
+        self.assertEqual(pt2.stepnum, 4)
+        self.assertTrue(np.all(pt2.nattempts == pt.nattempts))
+        self.assertTrue(np.allclose(pt2.coords, pt.coords))
+        self.assertAlmostEqual(pt2.result.energy, pt.result.energy)
+        try:
+            res = pt2.run(2)
+        finally:
+            pt2.close()
+        self.assertEqual(pt2.stepnum, 6)
+        self.assertLessEqual(res.energy, pt.result.energy + 1e-8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ import networkx as nx
 import numpy as np
 
 from pele.utils.disconnectivity_graph import database2graph
+from pele.storage.landscape_arrays import LandscapeArrays
 from pele.rates._ngt_cpp import NGT
 from pele.rates._rates_linalg import reduce_rates, TwoStateRates, LinalgError
 
@@ -173,13 +174,107 @@ class _Minima2Rates(object):
                             ))
         return self.weights
 
+class _ArrayMinima2Rates(_Minima2Rates):
+    """prepare the arrays from Database.to_arrays() for a rate calculation
+
+    The nodes of the rate network are the minimum ids.  The rate constants
+    and equilibrium occupation probabilities are computed with vectorized
+    numpy operations.
+    """
+    def _check_thermodynamics(self, arrays, imin, its=None):
+        """raise an error if fvib or pgorder is unknown for one of the minima or transition states"""
+        missing = np.isnan(arrays.min_fvib[imin]) | np.isnan(arrays.min_pgorder[imin])
+        if np.any(missing):
+            raise ValueError("fvib or pgorder is missing for the minima with ids %s.  "
+                             "Use get_thermodynamic_information to compute them"
+                             % np.unique(arrays.min_id[imin][missing])[:10].tolist())
+        if its is not None:
+            missing = np.isnan(arrays.ts_fvib[its]) | np.isnan(arrays.ts_pgorder[its])
+            if np.any(missing):
+                raise ValueError("fvib or pgorder is missing for the transition states with ids %s.  "
+                                 "Use get_thermodynamic_information to compute them"
+                                 % arrays.ts_id[its][missing][:10].tolist())
+
+    def _log_rates(self, i, arrays, its):
+        """the log rates from the minima with indices i over the transition states its"""
+        log_k = -(arrays.ts_energy[its] - arrays.min_energy[i]) * self.beta
+        if self.use_fvib:
+            sigma = arrays.min_pgorder[i] / (2. * np.pi * arrays.ts_pgorder[its])
+            log_k += np.log(sigma) + (arrays.min_fvib[i] - arrays.ts_fvib[its]) / 2.
+        return log_k
+
+    def _compute_rate_constants(self):
+        arrays = self.transition_states
+        i1, i2 = arrays.ts_min1, arrays.ts_min2
+        ok = ~(arrays.ts_invalid | arrays.min_invalid[i1] | arrays.min_invalid[i2])
+        if not np.all(ok):
+            print("excluding", len(ok) - np.count_nonzero(ok), "invalid transition states from rate graph")
+        nts_skip_same = np.count_nonzero(ok & (i1 == i2))
+        if nts_skip_same > 0:
+            print("warning: not using", nts_skip_same, "transition states because they connect a minimum with itself")
+        its = np.where(ok & (i1 != i2))[0]
+        i1, i2 = i1[its], i2[its]
+        if self.use_fvib:
+            self._check_thermodynamics(arrays, np.concatenate((i1, i2)), its)
+        log_kuv = self._log_rates(i1, arrays, its)
+        log_kvu = self._log_rates(i2, arrays, its)
+        # order each pair, so both directions are summed together
+        swap = i1 > i2
+        i1, i2 = np.where(swap, i2, i1), np.where(swap, i1, i2)
+        log_kuv, log_kvu = np.where(swap, log_kvu, log_kuv), np.where(swap, log_kuv, log_kvu)
+
+        # sum contributions from multiple transition states between two minima.
+        pairs, inverse = np.unique(i1 * arrays.nminima + i2, return_inverse=True)
+        u = arrays.min_id[pairs // arrays.nminima]
+        v = arrays.min_id[pairs % arrays.nminima]
+        log_rates = []
+        for log_k in log_kuv, log_kvu:
+            lmax = np.full(len(pairs), -np.inf)
+            np.maximum.at(lmax, inverse, log_k)
+            total = np.zeros(len(pairs))
+            np.add.at(total, inverse, np.exp(log_k - lmax[inverse]))
+            log_rates.append(np.log(total) + lmax)
+
+        self.max_log_rate = max(np.max(l) for l in log_rates)
+        self.rate_norm = np.exp(-self.max_log_rate)
+        print("time scale need to be multiplied by", 1./np.exp(self.max_log_rate))
+        kuv, kvu = [np.exp(l - self.max_log_rate) for l in log_rates]
+        rates = dict(zip(zip(u.tolist(), v.tolist()), kuv.tolist()))
+        rates.update(zip(zip(v.tolist(), u.tolist()), kvu.tolist()))
+        self.rate_constants = rates
+        return self.rate_constants
+
+    def _get_equilibrium_occupation_probabilities(self, all=True):
+        arrays = self.transition_states
+        if all:
+            nodes = np.unique(np.concatenate((arrays.ts_min1, arrays.ts_min2)))
+        else:
+            nodes = np.searchsorted(arrays.min_id, list(self.A.union(self.B)))
+        nodes = nodes[~arrays.min_invalid[nodes]]
+        self._check_thermodynamics(arrays, nodes)
+        log_weights = (-self.beta * arrays.min_energy[nodes] - np.log(arrays.min_pgorder[nodes])
+                       - 0.5 * arrays.min_fvib[nodes])
+        # normalize the weights to avoid overflow or underflow when taking the exponential
+        weights = np.exp(log_weights - np.max(log_weights))
+        self.weights = dict(zip(arrays.min_id[nodes].tolist(), weights.tolist()))
+        return self.weights
+
+
+def _minima2rates(transition_states, A, B, T=1., use_fvib=True):
+    if isinstance(transition_states, LandscapeArrays):
+        return _ArrayMinima2Rates(transition_states, A, B, T=T, use_fvib=use_fvib)
+    return _Minima2Rates(transition_states, A, B, T=T, use_fvib=use_fvib)
+
+
 class RateCalculation(object):
     """compute transition rates from a database of minima and transition states
     
     Parameters 
     ----------
-    transition_states: iteratable
-        list (or iterator) of transition states that define the rate network
+    transition_states: iteratable or LandscapeArrays
+        list (or iterator) of transition states that define the rate network,
+        or the arrays returned by `Database.to_arrays()`.  In the latter
+        case the minima are represented by their ids.
     A, B : iterables
         groups of minima specifying the reactant and product groups.  The rates
         returned will be the rate from A to B and vice versa.
@@ -189,8 +284,8 @@ class RateCalculation(object):
     """
     def __init__(self, transition_states, A, B, T=1., 
                   use_fvib=True):
-        self.minima2rates = _Minima2Rates(transition_states, A, B, T=T,
-                                         use_fvib=use_fvib)
+        self.minima2rates = _minima2rates(transition_states, A, B, T=T,
+                                          use_fvib=use_fvib)
 
     def compute_rates(self):
         """compute the rates from A to B and vice versa"""
@@ -230,8 +325,8 @@ class RatesLinalg(object):
     _times_computed = False
     def __init__(self, transition_states, A, B, T=1., 
                   use_fvib=True):
-        self.minima2rates = _Minima2Rates(transition_states, A, B, T=T,
-                                         use_fvib=use_fvib)
+        self.minima2rates = _minima2rates(transition_states, A, B, T=T,
+                                          use_fvib=use_fvib)
 
     def initialize(self):
         self.minima2rates.run()
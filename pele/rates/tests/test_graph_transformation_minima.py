@@ -121,6 +121,25 @@ class TestOptimCollagen(unittest.TestCase):
         rla = RatesLinalg(self.db.transition_states(), [m1, m3], [m2, m4], T=0.592)
         rAB = rla.compute_rates()
         self.assertAlmostEqual(rAB, 8638736600., delta=1e4)
+
+    def test_arrays(self):
+        arrays = self.db.to_arrays()
+        rcalc = RateCalculation(arrays, [1, 3], [2, 4], T=0.592)
+        rcalc.compute_rates()
+        self.assertAlmostEqual(rcalc.get_rate_AB(), 8638736600., delta=1e4)
+        self.assertAlmostEqual(rcalc.get_rate_BA(), 3499625167., delta=1e4)
+
+        rla = RatesLinalg(arrays, [1], [2], T=0.592)
+        rAB = rla.compute_rates()
+        self.assertAlmostEqual(rAB, 7106337458., delta=1e4)
+
+    def test_arrays_missing_pgorder(self):
+        self.db.getMinimum(1).pgorder = None
+        arrays = self.db.to_arrays()
+        self.assertTrue(np.isnan(arrays.min_pgorder[0]))
+        rcalc = RateCalculation(arrays, [1, 3], [2, 4], T=0.592)
+        with self.assertRaises(ValueError):
+            rcalc.compute_rates()
         
 
 
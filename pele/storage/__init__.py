@@ -17,6 +17,9 @@ ensures that all minima and transition state objects are unique
     Database
     Minimum
     TransitionState
+    LandscapeArrays
+    merge_databases
+    DatabaseProfiler
 
 
 
@@ -51,6 +54,17 @@ Minima can be access from the database in a number of ways, but most often by
 
     >>> database.minim() #  an iterator over minima sorted by energy
 
+For large databases `iter_minima()` and `iter_transition_states()` load the
+objects in chunks instead of all at once, and can be restricted to a range of
+energies or ids::
+
+    >>> for m in database.iter_minima(Emax=-40., coords=True):
+    ...     print(m.energy, m.coords[0])
+
+The optimized distances between minima, which are expensive to compute, can
+be stored with `add_distances()` and read with `get_distances()`.
+DoubleEndedConnect does this if it is given a `mindist_tag`.
+
 .. note::
 
     When a minimum is added to the database
@@ -67,6 +81,20 @@ Minima can be access from the database in a number of ways, but most often by
     database as a unique Minimum.  If compares exact to an existing Minimum then that minimum
     is returned by `database.addMinimum()`. 
 
+    If the database has a `fingerprint` function (systems provide one through
+    `get_fingerprint()`), a cheap, rotation and permutation invariant number
+    is stored with every minimum, and only minima with a matching fingerprint
+    are passed to `database.compareMinima()`.
+
+    To add many minima at once use
+
+        >>> minima = database.add_minima([(energy1, coords1), (energy2, coords2)])
+
+    It does the same checks, but finds the existing minima with a few windowed
+    queries and inserts the new ones in a single transaction, which is much
+    faster for large imports.  `database.add_transition_states()` does the same
+    for transition states.
+
 TransitionState
 ---------------
 .. autosummary::
@@ -113,6 +141,53 @@ To connect to a database::
 Database will load data from "mydatabase.sqlite" if it already exists, or create a new 
 database with that name if it doesn't.
 
+For large landscapes the coordinates can be kept in memory mapped files next to
+the database file instead of in the sql tables::
+
+    >>> db = Database(db="mydatabase.sqlite", coords_store=True)
+    >>> coords = db.all_coords() #  a (number of minima, ndof) view of the file
+
+`minimum.coords` is then read from the file, and `db.all_coords()` gives all the
+coordinates without creating any Minimum objects.  Without the coordinate
+store the recently used coordinates are kept in a cache
+(`db.coords_cache`, 64 MB by default, see the `coords_cache_size`
+parameter), so they are not selected again after every commit.
+
+The other properties of the minima and transition states (energies, fvib,
+pgorder, and which minima are connected) can be read into numpy arrays with::
+
+    >>> arrays = db.to_arrays()
+    >>> arrays.save("landscape.npz")
+    >>> arrays = LandscapeArrays.load("landscape.npz")
+
+`RateCalculation`, `RatesLinalg` and `minima_to_cv` accept these arrays in place
+of the list of transition states or minima.
+
+A database which is used from several threads or processes at the same time
+must be opened with::
+
+    >>> db = Database(db="mydatabase.sqlite", concurrent=True)
+
+Each thread then gets its own session (`db.session` is a scoped session), and
+sqlite runs in WAL mode, so reading does not block writing.
+
+Databases from independent runs can be combined with::
+
+    >>> merge_databases(db, ["run1.sqlite", "run2.sqlite"], nproc=4)
+
+which removes the duplicate minima and transition states using the settings of
+`db`.  From the command line use `scripts/merge_databases.py`.
+
+To find out whether sqlite is a bottleneck, open the database with
+`profile=True`::
+
+    >>> db = Database(db="mydatabase.sqlite", profile=True)
+    >>> # ... run basinhopping or DoubleEndedConnect
+    >>> print(db.profiler.report())
+
+which lists the calls and time of the database methods, sql statements and
+commits, and the sizes of the candidate windows searched by `addMinimum`.
+
 .. note::
 
     basinhopping doesn't accept a database as a parameter, instead you should pass
@@ -122,6 +197,14 @@ database with that name if it doesn't.
         >>> minima_adder = database.minimum_adder()
         >>> bh = BasinHopping(coords, potential, takestep, storage=minima_adder)
 
+    If the database work shows up in the profile of a basinhopping run, the minima
+    can be written from a background thread instead::
+
+        >>> minima_adder = database.async_minimum_adder()
+        >>> bh = BasinHopping(coords, potential, takestep, storage=minima_adder)
+        >>> bh.run(1000)
+        >>> minima_adder.close()
+
 """
 from __future__ import absolute_import
 
@@ -129,4 +212,7 @@ from __future__ import absolute_import
 
 
 from .database import *
+from .landscape_arrays import LandscapeArrays
+from .merge import merge_databases
+from .profiling import DatabaseProfiler
 
@@ -0,0 +1,167 @@
+"""memory mapped storage for the coordinates of minima and transition states
+"""
+from __future__ import print_function
+import os
+import threading
+
+import numpy as np
+
+__all__ = ["CoordsStore"]
+
+_magic = b"PELECRD1"
+_header_size = 16
+# the file grows by at least this many rows at a time
+_min_grow = 1024
+
+
+class CoordsStore(object):
+    """an append only, memory mapped float64 matrix of coordinates
+
+    Row `id - 1` of the matrix holds the coordinates of the object with sql
+    id `id`.  Rows which were never written, or whose object was removed from
+    the database, are filled with nan.  The file starts with a 16 byte
+    header (a magic string and the number of degrees of freedom) followed by
+    the rows as little endian float64.
+
+    Parameters
+    ----------
+    filename : string
+        the file to store the coordinates in.  It is created when the first
+        coordinates are written.
+
+    Notes
+    -----
+    The file grows geometrically, so it usually ends with some nan rows
+    which don't belong to any object yet.  Rows appended by other connections
+    to the same file are mapped when an id beyond the known rows is accessed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.ndof = None
+        self._nrows = 0
+        self._map = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def __len__(self):
+        return self._nrows
+
+    def _refresh(self):
+        """update the number of rows from the size of the file
+
+        The file may have been grown by another connection.
+        """
+        if not os.path.isfile(self.filename):
+            return
+        size = os.path.getsize(self.filename)
+        if size == 0:
+            return
+        if self.ndof is None:
+            with open(self.filename, "rb") as f:
+                header = f.read(_header_size)
+            if header[:len(_magic)] != _magic:
+                raise IOError("%s is not a pele coordinate file" % self.filename)
+            self.ndof = int(np.frombuffer(header[len(_magic):], dtype="<i8")[0])
+        nrows = (size - _header_size) // (8 * self.ndof)
+        if nrows > self._nrows:
+            if self._map is not None:
+                self._map.flush()
+            self._nrows = nrows
+            self._map = None
+
+    def _get_map(self):
+        if self._map is None and self._nrows > 0:
+            self._map = np.memmap(self.filename, dtype="<f8", mode="r+",
+                                  offset=_header_size, shape=(self._nrows, self.ndof))
+        return self._map
+
+    def _grow(self, nrows):
+        """append rows of nan to the file, at least doubling its size"""
+        nrows = max(nrows, 2 * self._nrows, _min_grow)
+        if self._map is not None:
+            self._map.flush()
+        with open(self.filename, "ab") as f:
+            if self._nrows == 0 and f.tell() == 0:
+                f.write(_magic)
+                f.write(np.array([self.ndof], dtype="<i8").tobytes())
+            chunk = np.empty(max(1, (1 << 20) // self.ndof) * self.ndof, dtype="<f8")
+            chunk.fill(np.nan)
+            remaining = (nrows - self._nrows) * self.ndof
+            while remaining > 0:
+                n = min(remaining, chunk.size)
+                f.write(chunk[:n].tobytes())
+                remaining -= n
+        self._nrows = nrows
+        # old views keep their own mapping, so they stay valid
+        self._map = None
+
+    def write(self, id_, coords):
+        """write the coordinates of the object with id `id_`
+
+        If coords is None the row is filled with nan.
+        """
+        with self._lock:
+            self._write(id_, coords)
+
+    def _write(self, id_, coords):
+        if id_ > self._nrows:
+            self._refresh()
+        if coords is not None:
+            coords = np.asarray(coords, dtype=float).ravel()
+            if self.ndof is None:
+                self.ndof = coords.size
+            elif coords.size != self.ndof:
+                raise ValueError("the coordinate store holds %d degrees of freedom, got %d"
+                                 % (self.ndof, coords.size))
+        elif id_ > self._nrows:
+            # nothing to remove
+            return
+        if id_ > self._nrows:
+            self._grow(id_)
+        mmap = self._get_map()
+        if coords is None:
+            mmap[id_ - 1] = np.nan
+        else:
+            mmap[id_ - 1] = coords
+
+    def read(self, id_):
+        """return a read only view of the coordinates of object `id_`
+
+        Returns None if the coordinates were never written.
+        """
+        if id_ is None:
+            return None
+        if id_ > self._nrows:
+            with self._lock:
+                self._refresh()
+            if id_ > self._nrows:
+                return None
+        row = self._get_map()[id_ - 1]
+        if np.isnan(row[0]):
+            return None
+        row = row.view(np.ndarray)
+        row.flags.writeable = False
+        return row
+
+    def array(self, n=None):
+        """return a read only (n, ndof) view of the first n rows
+
+        No data is copied, the rows are loaded from the file when they are
+        accessed.
+        """
+        if n is None or n > self._nrows:
+            with self._lock:
+                self._refresh()
+        if n is None:
+            n = self._nrows
+        n = min(n, self._nrows)
+        if n == 0:
+            return np.zeros((0, self.ndof or 0))
+        view = self._get_map()[:n].view(np.ndarray)
+        view.flags.writeable = False
+        return view
+
+    def flush(self):
+        """write the changes to the file"""
+        if self._map is not None:
+            self._map.flush()
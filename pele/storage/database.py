@@ -2,23 +2,40 @@
 """
 from __future__ import print_function
 import threading
+import bisect
+import heapq
 import os
+import atexit
+import weakref
+import functools
+from collections import OrderedDict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import numpy as np
 
-from sqlalchemy import create_engine, and_, or_
-from sqlalchemy.orm import sessionmaker, undefer
-from sqlalchemy import Column, Integer, Float, PickleType, String
+from sqlalchemy import create_engine, and_, or_, func, event, inspect
+from sqlalchemy.orm import sessionmaker, scoped_session, undefer, object_session
+from sqlalchemy.orm.attributes import set_committed_value, get_history
+from sqlalchemy import Column, Integer, Float, PickleType, String, LargeBinary
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Index
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.exc import OperationalError
 
 from pele.utils.events import Signal
+from pele.storage.coords_store import CoordsStore
+from pele.storage.landscape_arrays import LandscapeArrays
+from pele.storage.profiling import DatabaseProfiler
 
-__all__ = ["Minimum", "TransitionState", "Database"]
+__all__ = ["Minimum", "TransitionState", "Database", "AsyncMinimumAdder"]
 
-_schema_version = 2
+_schema_version = 4
 verbose=False
 
 Base = declarative_base()
@@ -40,6 +57,30 @@ else:
     basestring = basestring
 
 
+class Float64Array(TypeDecorator):
+    """store a one dimensional numpy array as raw little endian float64 bytes
+
+    The values are returned by `np.frombuffer`, so loading does not copy the
+    data.  The returned arrays are read only.
+    """
+    impl = LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return np.ascontiguousarray(value, dtype="<f8").tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype="<f8")
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(x, y)
+
+
 class Minimum(Base):
     """
     The Minimum class represents a minimum in the database.
@@ -55,8 +96,10 @@ class Minimum(Base):
     energy :
         the energy of the minimum
     coords :
-        the coordinates of the minimum.  This is stored as a pickled numpy
-        array which SQL interprets as a BLOB.
+        the coordinates of the minimum.  This is stored as raw float64 bytes
+        which SQL interprets as a BLOB, or in the coordinate store of the
+        database (see `Database.all_coords`).  The array returned from the
+        database is read only, use `m.coords.copy()` to modify it.
     fvib :
         the log product of the squared normal mode frequencies.  This is used in
         the free energy calcualations
@@ -69,6 +112,11 @@ class Minimum(Base):
         Space to store anything that the user wants.  This is stored in SQL
         as a BLOB, so you can put anything here you want as long as it's serializable.
         Usually a dictionary works best.
+    fingerprint :
+        a rotation and permutation invariant number describing the structure,
+        e.g. the radius of gyration.  Minima with different fingerprints are
+        never compared with `compareMinima`.  None if the database has no
+        fingerprint function.
 
 
     Notes
@@ -85,7 +133,7 @@ class Minimum(Base):
     _id = Column(Integer, primary_key=True)
     energy = Column(Float) 
     # deferred means the object is loaded on demand, that saves some time / memory for huge graphs
-    coords = deferred(Column(PickleType))
+    coords = deferred(Column(Float64Array))
     '''coordinates of the minimum'''
     fvib = Column(Float)
     """log product of the squared normal mode frequencies"""
@@ -95,6 +143,8 @@ class Minimum(Base):
     """flag indicating if the minimum is invalid"""
     user_data = deferred(Column(PickleType))
     """this can be used to store information about the minimum"""
+    fingerprint = Column(Float)
+    """structural fingerprint used to avoid unnecessary calls to compareMinima"""
     
     
     def __init__(self, energy, coords):
@@ -151,8 +201,9 @@ class TransitionState(Base):
     energy :
         The energy of the transition state
     coords :
-        The coordinates of the transition state.  This is stored as a pickled numpy
-        array which SQL interprets as a BLOB.
+        The coordinates of the transition state.  This is stored as raw float64
+        bytes which SQL interprets as a BLOB.  The array returned from the
+        database is read only.
     fvib :
         The log product of the squared normal mode frequencies.  This is used in
         the free energy calcualations
@@ -193,7 +244,7 @@ class TransitionState(Base):
     energy = Column(Float)
     '''energy of transition state'''
     
-    coords = deferred(Column(PickleType))
+    coords = deferred(Column(Float64Array))
     '''coordinates of transition state'''
     
     _minimum1_id = Column(Integer, ForeignKey('tbl_minima._id'))
@@ -209,7 +260,7 @@ class TransitionState(Base):
     eigenval = Column(Float)
     '''coordinates of transition state'''
 
-    eigenvec = deferred(Column(PickleType))
+    eigenvec = deferred(Column(Float64Array))
     '''coordinates of transition state'''
 
     fvib = Column(Float)
@@ -246,6 +297,167 @@ class TransitionState(Base):
 
 
 
+def _get_coords_store(session, cls):
+    """return the coordinate store of the session for cls, or None"""
+    if session is None:
+        return None
+    db = session.info.get("database")
+    if db is None or db.coords_stores is None:
+        return None
+    return db.coords_stores[cls]
+
+
+def _pending_coords(session):
+    """the coordinates written in the current transaction of the session"""
+    return session.info.setdefault("coords_pending", dict())
+
+
+def _stored_coords(session, cls, id_):
+    """return the coordinates of an object from the pending writes or the store"""
+    pending = _pending_coords(session)
+    key = (cls, id_)
+    if key in pending:
+        return pending[key]
+    return _get_coords_store(session, cls).read(id_)
+
+
+def _get_coords_cache(session):
+    """return the coordinate cache of the session, or None"""
+    if session is None:
+        return None
+    db = session.info.get("database")
+    if db is None:
+        return None
+    return db.coords_cache
+
+
+def _on_load(target, context):
+    if _get_coords_store(context.session, type(target)) is not None:
+        set_committed_value(target, "coords",
+                            _stored_coords(context.session, type(target), target._id))
+    elif "coords" not in target.__dict__:
+        _coords_from_cache(target, context.session)
+
+
+def _on_refresh(target, context, attrs):
+    if _get_coords_store(context.session, type(target)) is not None:
+        if attrs is None or "coords" in attrs:
+            _on_load(target, context)
+    elif attrs is not None and "coords" in attrs:
+        # the deferred coordinates were just selected
+        cache = _get_coords_cache(context.session)
+        if cache is not None:
+            cache.miss()
+            cache.put((type(target), target._id), target.__dict__.get("coords"))
+
+
+def _on_expire(target, attrs):
+    # the session expires everything on commit.  Put the coordinates back
+    # so the next access doesn't need a select.
+    if attrs is not None or target is None:
+        return
+    # the id is expired as well, take it from the identity key
+    identity = inspect(target).identity
+    if identity is not None:
+        _coords_from_cache(target, object_session(target), identity[0])
+
+
+def _coords_from_cache(target, session, id_=None):
+    cache = _get_coords_cache(session)
+    if cache is None:
+        return
+    if id_ is None:
+        id_ = target._id
+    coords = cache.get((type(target), id_))
+    if coords is not None:
+        set_committed_value(target, "coords", coords)
+
+
+def _before_write(mapper, connection, target):
+    # the coordinates go to the store, the sql column is left empty
+    if _get_coords_store(object_session(target), type(target)) is None:
+        return
+    if get_history(target, "coords").has_changes():
+        target._new_coords = target.coords
+        target.coords = None
+
+
+def _after_write(mapper, connection, target):
+    cache = _get_coords_cache(object_session(target))
+    if cache is not None and "coords" in target.__dict__:
+        cache.put((type(target), target._id), target.__dict__["coords"])
+    if "_new_coords" not in target.__dict__:
+        return
+    coords = target.__dict__.pop("_new_coords")
+    session = object_session(target)
+    _pending_coords(session)[(type(target), target._id)] = coords
+    set_committed_value(target, "coords", coords)
+
+
+def _after_delete(mapper, connection, target):
+    session = object_session(target)
+    cache = _get_coords_cache(session)
+    if cache is not None:
+        cache.remove((type(target), target._id))
+    if _get_coords_store(session, type(target)) is not None:
+        _pending_coords(session)[(type(target), target._id)] = None
+
+
+for _cls in (Minimum, TransitionState):
+    event.listen(_cls, "load", _on_load)
+    event.listen(_cls, "refresh", _on_refresh)
+    event.listen(_cls, "expire", _on_expire)
+    event.listen(_cls, "before_insert", _before_write)
+    event.listen(_cls, "before_update", _before_write)
+    event.listen(_cls, "after_insert", _after_write)
+    event.listen(_cls, "after_update", _after_write)
+    event.listen(_cls, "after_delete", _after_delete)
+
+
+def _write_pending_coords(session):
+    """write the coordinates of the committed changes to the stores"""
+    pending = _pending_coords(session)
+    if not pending:
+        return
+    stores = session.info["database"].coords_stores
+    for (cls, id_), coords in pending.items():
+        stores[cls].write(id_, coords)
+    pending.clear()
+    for store in stores.values():
+        store.flush()
+
+
+def _discard_pending_coords(session):
+    _pending_coords(session).clear()
+
+
+def _retry_if_locked(method):
+    """run a Database method again if sqlite was locked for longer than the busy timeout
+
+    The session is rolled back before every retry, so this is only done if
+    it had no uncommitted changes when the method was called.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        retries = 0 if self._has_uncommitted_changes() else self.busy_retries
+        while True:
+            try:
+                return method(self, *args, **kwargs)
+            except OperationalError as e:
+                if retries <= 0 or "database is locked" not in str(e):
+                    raise
+                retries -= 1
+                self.session.rollback()
+    return wrapper
+
+
+def _set_wal_mode(dbapi_connection, connection_record):
+    # readers and the writer don't block each other in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
 class SystemProperty(Base):
     """table to hold system properties like potential parameters and number of atoms
     
@@ -291,9 +503,29 @@ class SystemProperty(Base):
         return self.name(), self.value()
             
 
+class Distance(Base):
+    """table to store the optimized distances between pairs of minima
+
+    The distances are computed by expensive alignment routines, so they are
+    kept to be reused by later connect runs.  `algorithm` names the
+    function which computed the distance, since the distances of different
+    functions can't be mixed.  minimum1 always has the lower id.
+    """
+    __tablename__ = "tbl_distances"
+    _id = Column(Integer, primary_key=True)
+
+    _minimum1_id = Column(Integer, ForeignKey('tbl_minima._id'))
+    _minimum2_id = Column(Integer, ForeignKey('tbl_minima._id'))
+    dist = Column(Float)
+    algorithm = Column(String)
+
+
 Index('idx_transition_states', TransitionState.__table__.c._minimum1_id, TransitionState.__table__.c._minimum2_id)
 Index('idx_minimum_energy', Minimum.__table__.c.energy)
 Index('idx_transition_state_energy', Minimum.__table__.c.energy)
+Index('idx_minimum_energy_fingerprint', Minimum.__table__.c.energy, Minimum.__table__.c.fingerprint)
+Index('idx_distances', Distance.__table__.c._minimum1_id, Distance.__table__.c._minimum2_id,
+      Distance.__table__.c.algorithm, unique=True)
 
 
 class MinimumAdder(object):
@@ -336,6 +568,328 @@ class MinimumAdder(object):
         if self.commit_interval != 1:
             self.db.session.commit()
 
+def _close_async_adder(ref):
+    adder = ref()
+    if adder is not None:
+        adder.close()
+
+
+class AsyncMinimumAdder(object):
+    """add minima to the database from a background thread
+
+    This is a write-behind replacement for `MinimumAdder`.  Calling it only
+    puts (E, coords) into a queue and returns immediately, so the database
+    work (the energy window query, loading the candidate coordinates,
+    compareMinima and the commit) is taken out of the basinhopping loop.  A
+    writer thread takes the minima from the queue in batches, removes the
+    duplicates within a batch, adds the rest to the database and commits once
+    per batch.
+
+    Parameters
+    ----------
+    db : database object
+    Ecut: float, optional
+        energy cutoff, don't add minima which are higher in energy
+    max_n_minima : int, optional
+        keep only the max_n_minima with the lowest energies.
+        See `Database.addMinimum`
+    batch_size : int, optional
+        the maximum number of minima added in one transaction
+    maxsize : int, optional
+        the maximum number of minima waiting in the queue.  If the queue is
+        full, calling the adder blocks until the writer has caught up.
+
+    Notes
+    -----
+    The return value of a call is always None, because the minimum is not yet
+    in the database.  Call `flush()` before using the database from another
+    thread, or hold `db.lock` while doing so.  The `on_minimum_added` signal
+    of the database is called from the writer thread.
+
+    The remaining minima are written when `close()` is called, and at the
+    latest when the interpreter exits.
+
+    Examples
+    --------
+
+    >>> add_minimum = db.async_minimum_adder()
+    >>> bh = BasinHopping(coords, pot, takestep, storage=add_minimum)
+    >>> bh.run(1000)
+    >>> add_minimum.close()
+    """
+    _stop = object()
+
+    def __init__(self, db, Ecut=None, max_n_minima=None, batch_size=1000, maxsize=10000):
+        self.db = db
+        self.Ecut = Ecut
+        self.max_n_minima = max_n_minima
+        self.batch_size = batch_size
+        self.count = 0
+        self.nbatches = 0
+        self.nduplicates = 0
+        self._error = None
+        self._closed = False
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._writer_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(_close_async_adder, weakref.ref(self))
+
+    def __call__(self, E, coords):
+        """queue a minimum to be added to the database"""
+        self._check_error()
+        if self._closed:
+            raise RuntimeError("the AsyncMinimumAdder has been closed")
+        if self.Ecut is not None:
+            if E > self.Ecut:
+                return None
+        self.count += 1
+        self._queue.put((E, np.array(coords, dtype=float)))
+        return None
+
+    def _check_error(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def _get_batch(self):
+        """block until there is work, then take everything up to batch_size"""
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, minima):
+        results = self.db.add_minima(minima, max_n_minima=self.max_n_minima)
+        # count the minima which were duplicates of another one in the batch
+        found = [m for m in results if m is not None]
+        self.nduplicates += len(found) - len(set(m.id() for m in found))
+        self.nbatches += 1
+
+    def _writer_loop(self):
+        while True:
+            batch = self._get_batch()
+            stop = any(item is self._stop for item in batch)
+            minima = [item for item in batch if item is not self._stop]
+            try:
+                if minima:
+                    self._write(minima)
+            except Exception as err:
+                self._error = err
+                try:
+                    self.db.session.rollback()
+                except Exception:
+                    pass
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """block until all queued minima are written to the database"""
+        self._queue.join()
+        self._check_error()
+
+    def close(self):
+        """write the remaining minima and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._stop)
+        self._thread.join()
+        self._check_error()
+
+
+def _batch_entries(batch, keys):
+    """convert the items of a bulk insert to dictionaries of column values
+
+    an item is either a tuple with the values of `keys` or a dictionary
+    """
+    entries = []
+    for item in batch:
+        if isinstance(item, dict):
+            entries.append(dict(item))
+        else:
+            entries.append(dict(zip(keys, item)))
+    return entries
+
+
+def _load_by_ids(session, cls, ids, chunk_size=500, coords=False):
+    """return a dictionary id -> object for all the ids
+
+    the ids are queried in chunks to stay below the sqlite limit on the
+    number of bound parameters.  Consecutive ids, like those of a bulk insert,
+    are queried as one range.  If coords is True the coordinates are loaded
+    with the same queries.
+    """
+    ids = sorted(set(ids))
+    objects = dict()
+    i = 0
+    while i < len(ids):
+        # find the end of the run of consecutive ids
+        j = i + 1
+        while j < len(ids) and ids[j] == ids[j - 1] + 1:
+            j += 1
+        query = session.query(cls)
+        if coords:
+            query = query.options(undefer("coords"))
+        if j - i >= chunk_size:
+            query = query.filter(cls._id.between(ids[i], ids[j - 1]))
+        else:
+            j = min(i + chunk_size, len(ids))
+            query = query.filter(cls._id.in_(ids[i:j]))
+        for obj in query:
+            objects[obj._id] = obj
+        i = j
+    return objects
+
+
+def _distance_key(min1, min2):
+    """return the ids of two minima, lowest first"""
+    id1, id2 = [m.id() if isinstance(m, Minimum) else int(m) for m in (min1, min2)]
+    if id1 > id2:
+        id1, id2 = id2, id1
+    return id1, id2
+
+
+def _insert_rows(session, cls, rows, first_id):
+    """insert the rows with executemany, giving them consecutive ids"""
+    keys = set()
+    for row in rows:
+        keys.update(row)
+    store = _get_coords_store(session, cls)
+    for i, row in enumerate(rows):
+        for k in keys:
+            row.setdefault(k, None)
+        row["_id"] = first_id + i
+    if store is not None:
+        pending = _pending_coords(session)
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            pending[(cls, row["_id"])] = row["coords"]
+            row["coords"] = None
+    session.execute(cls.__table__.insert(), rows)
+
+
+class _EnergyIndex(object):
+    """the energies of the minima in the database, used for max_n_minima
+
+    The highest energy minimum is found with a max heap.  Removed minima
+    are not taken out of the heap, an entry is only valid if the id is still
+    in `energies` with the same energy.  This also handles ids which sqlite
+    reuses after the minimum with the largest id was deleted.
+    """
+    def __init__(self, rows):
+        self.energies = dict(rows)
+        self._rebuild()
+
+    def _rebuild(self):
+        self.heap = [(-e, mid) for mid, e in self.energies.items()]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.energies)
+
+    def add(self, mid, energy):
+        self.energies[mid] = energy
+        heapq.heappush(self.heap, (-energy, mid))
+
+    def remove(self, mid):
+        self.energies.pop(mid, None)
+        if len(self.heap) > 2 * len(self.energies) + 100:
+            self._rebuild()
+
+    def highest(self, n=1):
+        """return the ids and energies of the n highest energy minima"""
+        result = []
+        ids = set()
+        while self.heap and len(result) < n:
+            item = heapq.heappop(self.heap)
+            mid = item[1]
+            if mid not in ids and self.energies.get(mid) == -item[0]:
+                result.append(item)
+                ids.add(mid)
+        for item in result:
+            heapq.heappush(self.heap, item)
+        return [(mid, -e) for e, mid in result]
+
+
+class _TableEnergyIndex(object):
+    """the interface of _EnergyIndex, read from the minima table with each call"""
+    def __init__(self, session):
+        self.session = session
+
+    def __len__(self):
+        return self.session.query(func.count(Minimum._id)).scalar()
+
+    def highest(self, n=1):
+        """return the ids and energies of the n highest energy minima"""
+        return self.session.query(Minimum._id, Minimum.energy).\
+            order_by(Minimum.energy.desc()).limit(n).all()
+
+
+class _CoordsCache(object):
+    """a least recently used cache of coordinate arrays, bounded in bytes
+
+    The keys are (class, id).  The arrays are not copied, an object gets
+    back the array it had before it was expired.
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            coords = self._data.pop(key, None)
+            if coords is None:
+                return None
+            self._data[key] = coords
+            self.hits += 1
+        return coords
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, coords):
+        if coords is None:
+            return
+        coords = np.asarray(coords, dtype=float)
+        if coords.nbytes > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._data[key] = coords
+            self.nbytes += coords.nbytes
+            while self.nbytes > self.maxbytes:
+                key, old = self._data.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+    def remove(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+    def clear(self, *args):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
 def _compare_properties(prop, v2):
     v1 = prop.value()
     try:
@@ -385,11 +939,58 @@ class Database(object):
         if the energies are within `accuracy` of each other.
     createdb : boolean, optional
         create database if not exists, default is true
+    fingerprint : callable, `float = fingerprint(coords)`, optional
+        a cheap, rotation and permutation invariant description of a
+        structure.  It is computed once for every minimum and stored in the
+        database.  Minima whose fingerprints differ by more than
+        `fingerprint_accuracy` are considered different without calling
+        compareMinima.
+    fingerprint_accuracy : float, optional
+        tolerance to count fingerprints as equal.  It must be large enough that
+        structures which compareMinima considers identical always match.
+    coords_store : boolean, optional
+        keep the coordinates of the minima and transition states in memory
+        mapped files next to the database (`db + ".min.coords"` and
+        `db + ".ts.coords"`) instead of in the sql tables.  The coordinates
+        of an existing database are moved to the files.  Once a database
+        uses the coordinate store it is always opened with it.  See
+        `all_coords`.
+    concurrent : boolean, optional
+        allow the database to be used from several threads and processes at
+        the same time.  `session` is then a scoped session, which gives every
+        thread its own session, and the sqlite database uses WAL mode, so
+        readers don't block the writer.  This needs a database file.
+    busy_timeout : float, optional
+        the number of seconds to wait for a lock held by another connection
+        before failing with "database is locked".
+    busy_retries : int, optional
+        the number of times addMinimum, addTransitionState, add_minima and
+        add_transition_states are started again after the busy timeout
+        expired.  The session is rolled back first, so they are only retried
+        if it had no uncommitted changes.
+    coords_cache_size : int, optional
+        the number of bytes of coordinates to keep in a least recently used
+        cache, so the deferred coordinates of recently used minima and
+        transition states are not selected again, e.g. after every commit.
+        Set it to 0 to disable the cache.  It is not used with the
+        coordinate store.
+    profile : boolean, optional
+        record the number of calls and the time spent in the methods, sql
+        statements and commits, see `DatabaseProfiler`.  The results are in
+        `profiler`.
 
     Attributes
     ----------
     engine : sqlalchemy database engine
     session : sqlalchemy session
+        or a scoped session if `concurrent` is True.  Both are used the same
+        way.
+    coords_cache : object or None
+        the coordinate cache.  `coords_cache.hits` and `coords_cache.misses`
+        count the coordinates which were taken from the cache and selected
+        from the database.
+    profiler : DatabaseProfiler or None
+        print it to see where the time goes
 
     accuracy : float
     on_minimum_removed : signal
@@ -424,11 +1025,25 @@ class Database(object):
     connection = None
     accuracy = 1e-3
     compareMinima=None
+    coords_stores = None
+    coords_cache = None
+    profiler = None
+    concurrent = False
+    busy_retries = 0
         
     def __init__(self, db=":memory:", accuracy=1e-3, connect_string='sqlite:///%s',
-                 compareMinima=None, createdb=True):
+                 compareMinima=None, createdb=True, fingerprint=None,
+                 fingerprint_accuracy=1e-2, coords_store=False, concurrent=False,
+                 busy_timeout=60., busy_retries=3, coords_cache_size=64 * 1024**2,
+                 profile=False):
         self.accuracy=accuracy
+        self.busy_retries = busy_retries
         self.compareMinima = compareMinima
+        self.fingerprint = fingerprint
+        self.fingerprint_accuracy = fingerprint_accuracy
+        self.concurrent = concurrent
+        if concurrent and db == ":memory:":
+            raise ValueError("a concurrent database needs a database file")
 
         if not os.path.isfile(db) or db == ":memory:":
             newfile = True
@@ -438,7 +1053,17 @@ class Database(object):
             newfile = False
 
         # set up the engine which will manage the backend connection to the database
-        self.engine = create_engine(connect_string % db, echo=verbose)
+        engine_kwargs = dict(echo=verbose)
+        if connect_string.startswith("sqlite"):
+            # the session may be used from the writer thread of AsyncMinimumAdder
+            engine_kwargs["connect_args"] = dict(check_same_thread=False,
+                                                 timeout=busy_timeout)
+            if db == ":memory:":
+                # every thread must see the same in-memory database
+                engine_kwargs["poolclass"] = StaticPool
+        self.engine = create_engine(connect_string % db, **engine_kwargs)
+        if concurrent and connect_string.startswith("sqlite"):
+            event.listen(self.engine, "connect", _set_wal_mode)
 
         if not newfile and not self._is_pele_database():
             raise IOError("existing file (%s) is not a pele database." % db)
@@ -452,8 +1077,13 @@ class Database(object):
 #         self._check_schema_version_and_create_tables(newfile)
 
         # set up the session which will manage the frontend connection to the database
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        Session = sessionmaker(bind=self.engine, info=dict(database=self))
+        if concurrent:
+            self.session = scoped_session(Session)
+        else:
+            self.session = Session()
+        event.listen(Session, "after_commit", _write_pending_coords)
+        event.listen(Session, "after_rollback", _discard_pending_coords)
         
         # these functions will be called when a minimum or transition state is 
         # added or removed
@@ -462,9 +1092,45 @@ class Database(object):
         self.on_ts_added = Signal()
         self.on_ts_removed = Signal()
         
+        # the energies of the minima, built the first time max_n_minima is used
+        self._energy_index = None
+        event.listen(Session, "after_rollback", self._invalidate_energy_index)
+
         self.lock = threading.Lock()
         self.connection = self.engine.connect()
 
+        self.coords_stores = None
+        if coords_store or self.get_property("coords_store") is not None:
+            if db == ":memory:":
+                raise ValueError("the coordinate store needs a database file")
+            self._open_coords_store(db)
+
+        self.coords_cache = None
+        if coords_cache_size > 0 and self.coords_stores is None:
+            self.coords_cache = _CoordsCache(coords_cache_size)
+            # a rollback can give the ids of discarded objects to new ones
+            event.listen(Session, "after_rollback", self.coords_cache.clear)
+
+        if profile:
+            DatabaseProfiler(self)
+
+    def _open_coords_store(self, db):
+        self.coords_stores = {Minimum: CoordsStore(db + ".min.coords"),
+                              TransitionState: CoordsStore(db + ".ts.coords")}
+        new = self.get_property("coords_store") is None
+        if new:
+            # move the coordinates out of the sql tables
+            for cls, store in self.coords_stores.items():
+                query = self.session.query(cls._id, cls.coords).\
+                    filter(cls.coords.isnot(None)).yield_per(1000)
+                for id_, coords in query:
+                    store.write(id_, coords)
+                store.flush()
+            for cls in self.coords_stores:
+                self.session.execute(cls.__table__.update().values(coords=None))
+            self.add_property("coords_store", True, commit=False)
+            self.session.commit()
+
     def _is_pele_database(self):
         conn = self.engine.connect()
         result = True
@@ -501,19 +1167,80 @@ class Database(object):
             limit(1).all()
         return candidates[0]
     
+    def _get_energy_index(self):
+        """return the energy index of the minima, building it if necessary
+
+        After it is built, the index is kept up to date by the functions
+        which add or remove minima, so max_n_minima needs no extra queries.
+        A concurrent database can be changed by other connections, so it
+        reads the energies from the table inside a write transaction
+        instead.
+        """
+        if self.concurrent:
+            self._begin_write(Minimum)
+            return _TableEnergyIndex(self.session)
+        if self._energy_index is None:
+            rows = self.session.query(Minimum._id, Minimum.energy).all()
+            self._energy_index = _EnergyIndex(rows)
+        return self._energy_index
+
+    def _invalidate_energy_index(self, *args):
+        # a rollback can bring back removed minima and discard added ones
+        self._energy_index = None
+
     def get_lowest_energy_minimum(self):
         """return the minimum with the lowest energy"""
         candidates = self.session.query(Minimum).order_by(Minimum.energy).\
             limit(1).all()
         return candidates[0]
     
+    def _compute_fingerprint(self, coords):
+        if self.fingerprint is None:
+            return None
+        return float(self.fingerprint(coords))
+
+    def _fingerprints_match(self, fp1, fp2):
+        if fp1 is None or fp2 is None:
+            return True
+        return abs(fp1 - fp2) <= self.fingerprint_accuracy
+
+    def _filter_fingerprint(self, query, fingerprint):
+        """restrict a query to minima which can match the fingerprint
+
+        minima without a fingerprint are always candidates
+        """
+        if fingerprint is None:
+            return query
+        return query.filter(or_(Minimum.fingerprint.is_(None),
+                                Minimum.fingerprint.between(fingerprint - self.fingerprint_accuracy,
+                                                            fingerprint + self.fingerprint_accuracy)))
+
+    def update_fingerprints(self, recalculate=False, commit=True):
+        """compute the fingerprints of the minima which don't have one yet
+
+        This is needed for databases which were created without a fingerprint
+        function, or migrated from an older schema version.
+        """
+        if self.fingerprint is None:
+            raise ValueError("the database has no fingerprint function")
+        query = self.session.query(Minimum).options(undefer("coords"))
+        if not recalculate:
+            query = query.filter(Minimum.fingerprint.is_(None))
+        for m in query:
+            m.fingerprint = self._compute_fingerprint(m.coords)
+        if commit:
+            self.session.commit()
+
     def findMinimum(self, E, coords):
+        fingerprint = self._compute_fingerprint(coords)
         candidates = self.session.query(Minimum).\
             options(undefer("coords")).\
             filter(Minimum.energy > E-self.accuracy).\
             filter(Minimum.energy < E+self.accuracy)
+        candidates = self._filter_fingerprint(candidates, fingerprint)
         
         new = Minimum(E, coords)
+        new.fingerprint = fingerprint
         
         for m in candidates:
             if self.compareMinima:
@@ -522,6 +1249,7 @@ class Database(object):
             return m
         return None
         
+    @_retry_if_locked
     def addMinimum(self, E, coords, commit=True, max_n_minima=-1, pgorder=None, fvib=None):
         """add a new minimum to database
         
@@ -537,6 +1265,9 @@ class Database(object):
             than the minimum with the highest energy in the database, then don't add
             this minimum and return None.  Else add this minimum and delete the minimum
             with the highest energy.  if max_n_minima < 0 then it is ignored.
+            The first call with max_n_minima loads the energies of all minima
+            into an in-memory index, which is then kept up to date, so later
+            calls need no extra queries.
 
         Returns
         -------
@@ -544,43 +1275,55 @@ class Database(object):
             minimum which was added (not necessarily a new minimum)
             
         """
-        self.lock.acquire()
-        # undefer coords because it is likely to be used by compareMinima and
-        # it is slow to load them individually by accessing the database repetitively.
-        candidates = self.session.query(Minimum).\
-            options(undefer("coords")).\
-            filter(Minimum.energy.between(E-self.accuracy, E+self.accuracy))
+        fingerprint = self._compute_fingerprint(coords)
+        with self.lock:
+            # undefer coords because it is likely to be used by compareMinima and
+            # it is slow to load them individually by accessing the database repetitively.
+            candidates = self.session.query(Minimum).\
+                options(undefer("coords")).\
+                filter(Minimum.energy.between(E-self.accuracy, E+self.accuracy))
+            # only minima with a matching fingerprint have to be compared
+            candidates = self._filter_fingerprint(candidates, fingerprint)
         
-        new = Minimum(E, coords)
+            new = Minimum(E, coords)
+            new.fingerprint = fingerprint
         
-        for m in candidates:
-            if self.compareMinima:
-                if not self.compareMinima(new, m):
-                    continue
-            self.lock.release()
-            return m
+            nscanned = 0
+            for m in candidates:
+                nscanned += 1
+                if self.compareMinima:
+                    if not self.compareMinima(new, m):
+                        continue
+                if self.profiler is not None:
+                    self.profiler.record_candidates(nscanned, True)
+                return m
+            if self.profiler is not None:
+                self.profiler.record_candidates(nscanned, False)
+
+            if max_n_minima is not None and max_n_minima > 0:
+                index = self._get_energy_index()
+                if len(index) >= max_n_minima:
+                    mid, emax = index.highest()[0]
+                    if E >= emax:
+                        # don't add the minimum
+                        return None
+                    else:
+                        # remove the minimum with the highest energy and continue
+                        self.removeMinimum(self.getMinimum(mid), commit=commit)
+
+            if fvib is not None:
+                new.fvib = fvib
+            if pgorder is not None:
+                new.pgorder = pgorder
+            self.session.add(new)
+            if commit:
+                self.session.commit()
+            if self._energy_index is not None:
+                if not commit:
+                    # the id is needed for the index
+                    self.session.flush()
+                self._energy_index.add(new._id, new.energy)
 
-        if max_n_minima is not None and max_n_minima > 0:
-            if self.number_of_minima() >= max_n_minima:
-                mmax = self._highest_energy_minimum()
-                if E >= mmax.energy:
-                    # don't add the minimum
-                    self.lock.release() 
-                    return None
-                else:
-                    # remove the minimum with the highest energy and continue
-                    self.removeMinimum(mmax, commit=commit)
-
-        if fvib is not None:
-            new.fvib = fvib
-        if pgorder is not None:
-            new.pgorder = pgorder
-        self.session.add(new)
-        if commit:
-            self.session.commit()
-        
-        self.lock.release()
-        
         self.on_minimum_added(new)
         return new
         
@@ -588,6 +1331,7 @@ class Database(object):
         """return the minimum with a given id"""
         return self.session.query(Minimum).get(mid)
         
+    @_retry_if_locked
     def addTransitionState(self, energy, coords, min1, min2, commit=True, 
                            eigenval=None, eigenvec=None, pgorder=None, fvib=None):
         """Add transition state object
@@ -615,31 +1359,340 @@ class Database(object):
         m1, m2 = min1, min2
         if m1.id() > m2.id():
             m1, m2 = m2, m1
-        candidates = self.session.query(TransitionState).\
-            options(undefer("coords")).\
-            filter(or_(
-                       and_(TransitionState.minimum1==m1, 
-                            TransitionState.minimum2==m2),
-                       and_(TransitionState.minimum1==m2, 
-                            TransitionState.minimum2==m1),
-                       )).\
-            filter(TransitionState.energy.between(energy-self.accuracy,  energy+self.accuracy))
+        with self.lock:
+            candidates = self.session.query(TransitionState).\
+                options(undefer("coords")).\
+                filter(or_(
+                           and_(TransitionState.minimum1==m1, 
+                                TransitionState.minimum2==m2),
+                           and_(TransitionState.minimum1==m2, 
+                                TransitionState.minimum2==m1),
+                           )).\
+                filter(TransitionState.energy.between(energy-self.accuracy,  energy+self.accuracy))
         
-        for m in candidates:
-            return m
+            for m in candidates:
+                return m
 
-        new = TransitionState(energy, coords, m1, m2, eigenval=eigenval, eigenvec=eigenvec)
+            new = TransitionState(energy, coords, m1, m2, eigenval=eigenval, eigenvec=eigenvec)
         
-        if fvib is not None:
-            new.fvib = fvib
-        if pgorder is not None:
-            new.pgorder = pgorder 
-        self.session.add(new)
-        if commit:
-            self.session.commit()
+            if fvib is not None:
+                new.fvib = fvib
+            if pgorder is not None:
+                new.pgorder = pgorder 
+            self.session.add(new)
+            if commit:
+                self.session.commit()
+
         self.on_ts_added(new)
         return new
 
+    def _has_uncommitted_changes(self):
+        """return True if the session has changes which a rollback would discard"""
+        session = self.session
+        if session.new or session.dirty or session.deleted:
+            return True
+        # pysqlite only begins a transaction for a write statement
+        dbapi_connection = session.connection().connection
+        return bool(getattr(dbapi_connection, "in_transaction", False))
+
+    def _begin_write(self, cls):
+        """start a write transaction on the table of cls
+
+        No other connection can change the table until the session commits.
+        """
+        if self.engine.dialect.name == "sqlite":
+            # a write statement makes sqlite take the write lock now instead
+            # of at the first insert
+            self.session.execute("UPDATE %s SET _id = _id WHERE 0" % cls.__tablename__)
+
+    def _next_id(self, cls):
+        """return the first free id of the table of cls
+
+        The ids are read inside a write transaction, so no other connection
+        can insert rows, and take the same ids, before the session commits.
+        """
+        self._begin_write(cls)
+        last = self.session.query(func.max(cls._id)).scalar()
+        return 1 if last is None else last + 1
+
+    @_retry_if_locked
+    def add_minima(self, batch, commit=True, max_n_minima=None, check_duplicates=True,
+                   window=1000):
+        """add many minima to the database at once
+
+        This gives the same result as calling `addMinimum` for every item of
+        the batch, but is much faster for large batches.  The batch is sorted
+        by energy and the existing minima are found with one query per window
+        of `window` minima.  The new minima are inserted with a single
+        executemany in one transaction, and `on_minimum_added` is called for
+        each of them after the commit.
+
+        Parameters
+        ----------
+        batch : list
+            the minima to add.  Each item is either a tuple `(E, coords)` or a
+            dictionary with the keys "energy" and "coords" and optionally any
+            other column of Minimum, e.g. "fvib" or "pgorder".
+        commit : bool, optional
+            commit changes to database
+        max_n_minima : int, optional
+            keep only the max_n_minima with the lowest energies.  See
+            `addMinimum`
+        check_duplicates : bool, optional
+            if False, every item is added as a new minimum
+        window : int, optional
+            the number of minima of the batch which are checked against the
+            database with one query
+
+        Returns
+        -------
+        minima : list
+            the Minimum for each item of the batch (not necessarily new).  The
+            entry is None if the item was rejected because of max_n_minima.
+        """
+        entries = _batch_entries(batch, ("energy", "coords"))
+        for entry in entries:
+            entry["energy"] = float(entry["energy"])
+            entry["coords"] = np.asarray(entry["coords"], dtype=float)
+            if "fingerprint" not in entry:
+                entry["fingerprint"] = self._compute_fingerprint(entry["coords"])
+            entry.setdefault("invalid", False)
+
+        order = sorted(range(len(entries)), key=lambda i: entries[i]["energy"])
+        results = [None] * len(entries)
+        new = []
+        with self.lock:
+            self.session.flush()
+            if check_duplicates:
+                duplicate_of = self._find_duplicate_minima(entries, order, window)
+            else:
+                duplicate_of = dict()
+            # duplicate_of maps an index to the id of an existing minimum or,
+            # as a negative number -(j+1), to the index j of a new minimum
+            for i in order:
+                if i not in duplicate_of:
+                    new.append(i)
+
+            # take the ids before any minimum is removed, so they are not reused
+            first_id = self._next_id(Minimum)
+            removed = set()
+            if max_n_minima is not None and max_n_minima > 0 and new:
+                index = self._get_energy_index()
+                nexisting = len(index)
+                nremove = nexisting + len(new) - max_n_minima
+                if nremove > 0:
+                    highest = index.highest(min(nremove, nexisting))
+                    # on equal energies the new minimum is rejected, as in addMinimum
+                    pool = [(energy, 0, mid) for mid, energy in highest] + \
+                           [(entries[i]["energy"], 1, i) for i in new]
+                    pool.sort(key=lambda x: x[:2], reverse=True)
+                    rejected = set()
+                    for energy, isnew, x in pool[:nremove]:
+                        if isnew:
+                            rejected.add(x)
+                        else:
+                            removed.add(x)
+                            self.removeMinimum(self.getMinimum(x), commit=False)
+                    new = [i for i in new if i not in rejected]
+
+            # the ids are given in the order of the batch
+            new.sort()
+            if new:
+                _insert_rows(self.session, Minimum, [entries[i] for i in new], first_id)
+            if commit:
+                self.session.commit()
+
+            new_ids = dict((i, first_id + k) for k, i in enumerate(new))
+            if self._energy_index is not None:
+                for i in new:
+                    self._energy_index.add(new_ids[i], entries[i]["energy"])
+            ids = dict()
+            for i in range(len(entries)):
+                if i in new_ids:
+                    ids[i] = new_ids[i]
+                elif i in duplicate_of:
+                    d = duplicate_of[i]
+                    if d < 0:
+                        ids[i] = new_ids.get(-d - 1)
+                    elif d not in removed:
+                        ids[i] = d
+            objects = _load_by_ids(self.session, Minimum,
+                                   [mid for mid in ids.values() if mid is not None])
+            for i, mid in ids.items():
+                if mid is not None:
+                    results[i] = objects[mid]
+
+        for i in new:
+            self.on_minimum_added(results[i])
+        return results
+
+    def _find_duplicate_minima(self, entries, order, window):
+        """find the entries which are already in the database or in the batch"""
+        accuracy = self.accuracy
+        duplicate_of = dict()
+        accepted = []
+        cache = dict()
+
+        def transient(i):
+            if i not in cache:
+                m = Minimum(entries[i]["energy"], entries[i]["coords"])
+                m.fingerprint = entries[i]["fingerprint"]
+                cache[i] = m
+            return cache[i]
+
+        for start in range(0, len(order), window):
+            chunk = order[start:start + window]
+            emin = entries[chunk[0]]["energy"] - accuracy
+            emax = entries[chunk[-1]]["energy"] + accuracy
+            rows = self.session.query(Minimum._id, Minimum.energy, Minimum.fingerprint).\
+                filter(Minimum.energy.between(emin, emax)).\
+                order_by(Minimum.energy).all()
+            energies = [r[1] for r in rows]
+
+            # the candidates in the database for each entry of the window
+            candidates = dict()
+            for i in chunk:
+                E = entries[i]["energy"]
+                fp = entries[i]["fingerprint"]
+                lo = bisect.bisect_left(energies, E - accuracy)
+                hi = bisect.bisect_right(energies, E + accuracy)
+                candidates[i] = [r[0] for r in rows[lo:hi]
+                                 if self._fingerprints_match(r[2], fp)]
+            existing = dict()
+            if self.compareMinima is not None:
+                ids = set(mid for c in candidates.values() for mid in c)
+                if ids:
+                    existing = _load_by_ids(self.session, Minimum, list(ids), coords=True)
+
+            for i in chunk:
+                E = entries[i]["energy"]
+                fp = entries[i]["fingerprint"]
+                for mid in candidates[i]:
+                    if self.compareMinima is None or self.compareMinima(transient(i), existing[mid]):
+                        duplicate_of[i] = mid
+                        break
+                if i in duplicate_of:
+                    continue
+                # compare with the new minima of the batch, which are sorted by energy
+                for j in reversed(accepted):
+                    if entries[j]["energy"] < E - accuracy:
+                        break
+                    if not self._fingerprints_match(entries[j]["fingerprint"], fp):
+                        continue
+                    if self.compareMinima is None or self.compareMinima(transient(i), transient(j)):
+                        duplicate_of[i] = -j - 1
+                        break
+                if i not in duplicate_of:
+                    accepted.append(i)
+        return duplicate_of
+
+    @_retry_if_locked
+    def add_transition_states(self, batch, commit=True, check_duplicates=True,
+                              window=1000):
+        """add many transition states to the database at once
+
+        This gives the same result as calling `addTransitionState` for every
+        item of the batch, but is much faster for large batches.  See
+        `add_minima`.
+
+        Parameters
+        ----------
+        batch : list
+            the transition states to add.  Each item is either a tuple
+            `(energy, coords, min1, min2)` or a dictionary with the keys
+            "energy", "coords", "min1", "min2" and optionally any other column
+            of TransitionState, e.g. "eigenval", "eigenvec", "fvib" or
+            "pgorder".  min1 and min2 can be Minimum objects or minimum ids.
+            They are stored such that minimum1 has the lower id.  To store the
+            minima in a given order pass the columns "_minimum1_id" and
+            "_minimum2_id" instead.
+        commit : bool, optional
+            commit changes to database
+        check_duplicates : bool, optional
+            if False, every item is added as a new transition state
+        window : int, optional
+            the number of transition states of the batch which are checked
+            against the database with one query
+
+        Returns
+        -------
+        transition_states : list
+            the TransitionState for each item of the batch (not necessarily new)
+        """
+        entries = _batch_entries(batch, ("energy", "coords", "min1", "min2"))
+        for entry in entries:
+            if "min1" in entry or "min2" in entry:
+                id1, id2 = [m.id() if isinstance(m, Minimum) else int(m)
+                            for m in (entry.pop("min1"), entry.pop("min2"))]
+                if id1 > id2:
+                    id1, id2 = id2, id1
+                entry["_minimum1_id"] = id1
+                entry["_minimum2_id"] = id2
+            entry["energy"] = float(entry["energy"])
+            entry["coords"] = np.asarray(entry["coords"], dtype=float)
+            entry.setdefault("invalid", False)
+
+        order = sorted(range(len(entries)), key=lambda i: entries[i]["energy"])
+        accuracy = self.accuracy
+        duplicate_of = dict()
+        new = []
+        with self.lock:
+            self.session.flush()
+            accepted = dict()
+            for start in range(0, len(order), window):
+                chunk = order[start:start + window]
+                if check_duplicates:
+                    emin = entries[chunk[0]]["energy"] - accuracy
+                    emax = entries[chunk[-1]]["energy"] + accuracy
+                    rows = self.session.query(TransitionState._id, TransitionState.energy,
+                                              TransitionState._minimum1_id,
+                                              TransitionState._minimum2_id).\
+                        filter(TransitionState.energy.between(emin, emax))
+                    existing = dict()
+                    for tsid, energy, id1, id2 in rows:
+                        existing.setdefault((min(id1, id2), max(id1, id2)), []).append((energy, tsid))
+                for i in chunk:
+                    if check_duplicates:
+                        E = entries[i]["energy"]
+                        pair = tuple(sorted((entries[i]["_minimum1_id"],
+                                             entries[i]["_minimum2_id"])))
+                        for energy, tsid in existing.get(pair, []):
+                            if abs(energy - E) <= accuracy:
+                                duplicate_of[i] = tsid
+                                break
+                        else:
+                            for j in accepted.get(pair, []):
+                                if abs(entries[j]["energy"] - E) <= accuracy:
+                                    duplicate_of[i] = -j - 1
+                                    break
+                        if i in duplicate_of:
+                            continue
+                        accepted.setdefault(pair, []).append(i)
+                    new.append(i)
+
+            first_id = self._next_id(TransitionState)
+            # the ids are given in the order of the batch
+            new.sort()
+            if new:
+                _insert_rows(self.session, TransitionState, [entries[i] for i in new], first_id)
+            if commit:
+                self.session.commit()
+
+            new_ids = dict((i, first_id + k) for k, i in enumerate(new))
+            ids = []
+            for i in range(len(entries)):
+                if i in new_ids:
+                    ids.append(new_ids[i])
+                else:
+                    d = duplicate_of[i]
+                    ids.append(new_ids[-d - 1] if d < 0 else d)
+            objects = _load_by_ids(self.session, TransitionState, ids)
+            results = [objects[tsid] for tsid in ids]
+
+        for i in new:
+            self.on_ts_added(results[i])
+        return results
+
     def getTransitionState(self, min1, min2):
         """return the TransitionState between two minima
         
@@ -691,6 +1744,9 @@ class Database(object):
         coords for multiple minima it is *much* faster to `undefer` before
         executing the query by, e.g.
         `session.query(Minimum).options(undefer("coords"))`
+
+        For large databases use `iter_minima`, which doesn't load all minima
+        into memory at once.
         """
         if order_energy:
             return self.session.query(Minimum).order_by(Minimum.energy).all()
@@ -704,7 +1760,114 @@ class Database(object):
             return self.session.query(TransitionState).order_by(TransitionState.energy).all()
         else:
             return self.session.query(TransitionState).all()
-    
+
+    def _iter_query(self, cls, order_energy, Emin, Emax, id_min, id_max, coords, chunk_size):
+        query = self.session.query(cls)
+        if Emin is not None:
+            query = query.filter(cls.energy >= Emin)
+        if Emax is not None:
+            query = query.filter(cls.energy <= Emax)
+        if id_min is not None:
+            query = query.filter(cls._id >= id_min)
+        if id_max is not None:
+            query = query.filter(cls._id <= id_max)
+        if coords:
+            query = query.options(undefer("coords"))
+        if order_energy:
+            query = query.order_by(cls.energy, cls._id)
+        else:
+            query = query.order_by(cls._id)
+        return iter(query.yield_per(chunk_size))
+
+    def iter_minima(self, order_energy=True, Emin=None, Emax=None, id_min=None, id_max=None,
+                    coords=False, chunk_size=1000):
+        """return a generator over the minima in the database
+
+        Unlike `minima()` the minima are loaded `chunk_size` at a time, so
+        only the minima which are still referenced elsewhere are kept in
+        memory.
+
+        Parameters
+        ----------
+        order_energy : bool, optional
+            order the minima by energy, else by id
+        Emin, Emax : float, optional
+            only include minima with Emin <= energy <= Emax
+        id_min, id_max : int, optional
+            only include minima with id_min <= id <= id_max
+        coords : bool, optional
+            load the coordinates together with each chunk instead of on
+            first access
+        chunk_size : int, optional
+            the number of minima loaded per query round trip
+
+        Notes
+        -----
+        The database should not be modified while the generator is in use.
+        """
+        return self._iter_query(Minimum, order_energy, Emin, Emax, id_min, id_max,
+                                coords, chunk_size)
+
+    def iter_transition_states(self, order_energy=False, Emin=None, Emax=None, id_min=None,
+                               id_max=None, coords=False, chunk_size=1000):
+        """return a generator over the transition states in the database
+
+        See `iter_minima` for a description of the parameters.  The minima
+        connected by the transition states are loaded when they are first
+        accessed, unless they are already in the session.
+        """
+        return self._iter_query(TransitionState, order_energy, Emin, Emax, id_min, id_max,
+                                coords, chunk_size)
+
+    def all_coords(self, transition_states=False):
+        """return the coordinates of all minima (or transition states) as a matrix
+
+        Row `m.id() - 1` holds the coordinates of the minimum `m`.  Rows which
+        don't belong to a minimum are nan.  With the coordinate store this is
+        a read only view of the memory mapped file, so nothing is loaded until
+        the rows are accessed.  Only committed changes are included.  Without
+        the coordinate store the matrix is built from the sql table.
+
+        Parameters
+        ----------
+        transition_states : bool, optional
+            return the coordinates of the transition states instead
+
+        Returns
+        -------
+        coords : numpy array, shape (max id, ndof)
+        """
+        cls = TransitionState if transition_states else Minimum
+        nrows = self.session.query(func.max(cls._id)).scalar()
+        if nrows is None:
+            nrows = 0
+        if self.coords_stores is not None:
+            return self.coords_stores[cls].array(nrows)
+
+        rows = self.session.query(cls._id, cls.coords).filter(cls.coords.isnot(None)).all()
+        ndof = rows[0][1].size if rows else 0
+        coords = np.empty((nrows, ndof))
+        coords.fill(np.nan)
+        for id_, x in rows:
+            coords[id_ - 1] = x
+        return coords
+
+    def to_arrays(self):
+        """return the minima and transition states as numpy arrays
+
+        The energies, fvib, pgorder and invalid flags of all minima and
+        transition states are read with two sql queries, without creating any
+        Minimum or TransitionState objects.  The result can be saved to an npz
+        file and used in place of the database, e.g. by `RateCalculation`
+        and `minima_to_cv`.
+
+        Returns
+        -------
+        arrays : LandscapeArrays
+        """
+        self.session.flush()
+        return LandscapeArrays.from_connection(self.session.connection().connection)
+
     def minimum_adder(self, Ecut=None, max_n_minima=None, commit_interval=1):
         """wrapper class to add minima
 
@@ -730,7 +1893,120 @@ class Database(object):
         """
         return MinimumAdder(self, Ecut=Ecut, max_n_minima=max_n_minima,
                             commit_interval=commit_interval)
+
+    def async_minimum_adder(self, Ecut=None, max_n_minima=None, batch_size=1000):
+        """return an adder which writes the minima from a background thread
+
+        The adder returns immediately, the minima are deduplicated and added
+        to the database in batches by a writer thread.
+
+        Parameters
+        ----------
+        Ecut: float, optional
+             energy cutoff, don't add minima which are higher in energy
+        max_n_minima : int, optional
+            keep only the max_n_minima with the lowest energies.
+        batch_size : int, optional
+            the maximum number of minima added in one transaction
+
+        Returns
+        -------
+        handler: AsyncMinimumAdder
+            call `handler.close()` when finished to write the remaining minima
+
+        See Also
+        --------
+        AsyncMinimumAdder
+        """
+        return AsyncMinimumAdder(self, Ecut=Ecut, max_n_minima=max_n_minima,
+                                 batch_size=batch_size)
     
+    def get_distances(self, pairs, algorithm, chunk_size=200):
+        """return the stored distances of pairs of minima
+
+        Parameters
+        ----------
+        pairs : list
+            a list of pairs `(min1, min2)` of Minimum objects or minimum ids
+        algorithm : string
+            the name of the function which computed the distances
+        chunk_size : int, optional
+            the number of pairs which are selected with one query
+
+        Returns
+        -------
+        dists : list
+            the distance of each pair, or None if it is not stored
+
+        See Also
+        --------
+        add_distances
+        """
+        keys = [_distance_key(m1, m2) for m1, m2 in pairs]
+        table = Distance.__table__
+        found = dict()
+        unique = list(set(keys))
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            query = self.session.query(Distance._minimum1_id, Distance._minimum2_id,
+                                       Distance.dist).\
+                filter(table.c.algorithm == algorithm).\
+                filter(or_(*[and_(table.c._minimum1_id == id1, table.c._minimum2_id == id2)
+                             for id1, id2 in chunk]))
+            for id1, id2, dist in query:
+                found[(id1, id2)] = dist
+        return [found.get(key) for key in keys]
+
+    def get_distance(self, min1, min2, algorithm):
+        """return the stored distance between two minima, or None"""
+        return self.get_distances([(min1, min2)], algorithm)[0]
+
+    def add_distances(self, distances, algorithm, commit=True):
+        """store optimized distances between pairs of minima
+
+        The distances are kept in the table `tbl_distances` so connect runs
+        on the same database don't have to compute them again.  Distances
+        which are already stored are not changed.  The distances of a
+        minimum are deleted with the minimum.
+
+        Parameters
+        ----------
+        distances : list
+            a list of tuples `(min1, min2, dist)`.  min1 and min2 can be
+            Minimum objects or minimum ids
+        algorithm : string
+            the name of the function which computed the distances, e.g. the
+            name of the mindist routine and its parameters
+        commit : bool, optional
+            commit changes to database
+        """
+        rows = dict()
+        for min1, min2, dist in distances:
+            key = _distance_key(min1, min2)
+            rows.setdefault(key, dict(_minimum1_id=key[0], _minimum2_id=key[1],
+                                      dist=float(dist), algorithm=algorithm))
+        insert = Distance.__table__.insert()
+        with self.lock:
+            if self.engine.dialect.name == "sqlite":
+                # distances stored in the meantime by another connection are
+                # skipped by the unique index
+                insert = insert.prefix_with("OR IGNORE")
+            else:
+                keys = list(rows.keys())
+                for key, dist in zip(keys, self.get_distances(keys, algorithm)):
+                    if dist is not None:
+                        del rows[key]
+            if rows:
+                self.session.execute(insert, list(rows.values()))
+            if commit:
+                self.session.commit()
+
+    def _remove_distances(self, m):
+        """delete the stored distances of a minimum"""
+        self.session.query(Distance).\
+            filter(or_(Distance._minimum1_id == m._id, Distance._minimum2_id == m._id)).\
+            delete(synchronize_session=False)
+
     def removeMinimum(self, m, commit=True):
         """remove a minimum from the database
         
@@ -747,8 +2023,11 @@ class Database(object):
             self.session.delete(ts)
         
         self.on_minimum_removed(m)
+        self._remove_distances(m)
         # delete the minimum
         self.session.delete(m)
+        if self._energy_index is not None:
+            self._energy_index.remove(m._id)
         if commit:
             self.session.commit()
 
@@ -777,7 +2056,10 @@ class Database(object):
             if ts.minimum1.id() > ts.minimum2.id():
                 ts.minimum1, ts.minimum2 = ts.minimum2, ts.minimum1
         
+        self._remove_distances(min2)
         self.session.delete(min2)
+        if self._energy_index is not None:
+            self._energy_index.remove(min2._id)
         self.session.commit()
 
     def remove_transition_state(self, ts, commit=True):
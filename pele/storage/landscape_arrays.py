@@ -0,0 +1,112 @@
+"""columnar snapshot of the minima and transition states of a database
+"""
+from __future__ import print_function
+
+import numpy as np
+
+__all__ = ["LandscapeArrays"]
+
+_min_columns = ("_id", "energy", "fvib", "pgorder", "invalid")
+_ts_columns = ("_id", "energy", "_minimum1_id", "_minimum2_id", "fvib", "pgorder", "invalid")
+
+
+def _read_columns(connection, table, columns, chunk_size=100000):
+    """read the columns of a table, ordered by id, into float arrays
+
+    NULL values become nan.  The rows are fetched in chunks, so only one
+    chunk is ever held as python objects.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT %s FROM %s ORDER BY _id" % (", ".join(columns), table))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=float).reshape(-1, len(columns)))
+    cursor.close()
+    if not chunks:
+        return np.zeros((len(columns), 0))
+    return np.concatenate(chunks).transpose()
+
+
+class LandscapeArrays(object):
+    """the minima and transition states of a database as numpy arrays
+
+    This is created by `Database.to_arrays()` and can be saved to and loaded
+    from a numpy npz file, so the landscape can be analysed without the
+    database.  The minima are ordered by id.  Transition states refer to the
+    minima by their index in the minimum arrays.
+
+    Attributes
+    ----------
+    min_id, min_energy, min_fvib, min_pgorder, min_invalid : numpy arrays
+        the id, energy, log product of the squared normal mode frequencies,
+        point group order and invalid flag of the minima.  Unknown fvib
+        values and point group orders are nan, so the point group orders
+        are stored as floats.
+    ts_id, ts_energy, ts_fvib, ts_pgorder, ts_invalid : numpy arrays
+        the same for the transition states
+    ts_min1, ts_min2 : numpy arrays
+        the indices of the minima connected by each transition state
+
+    Examples
+    --------
+
+    >>> arrays = database.to_arrays()
+    >>> arrays.save("landscape.npz")
+    >>> arrays = LandscapeArrays.load("landscape.npz")
+    >>> rcalc = RateCalculation(arrays, A, B) #  A and B are minimum ids
+    """
+    _fields = ("min_id", "min_energy", "min_fvib", "min_pgorder", "min_invalid",
+               "ts_id", "ts_energy", "ts_min1", "ts_min2", "ts_fvib", "ts_pgorder",
+               "ts_invalid")
+
+    def __init__(self, **kwargs):
+        for name in self._fields:
+            setattr(self, name, kwargs[name])
+
+    @classmethod
+    def from_connection(cls, connection):
+        """read the arrays with two queries
+
+        Parameters
+        ----------
+        connection : DBAPI connection
+            a raw connection to a pele database, e.g. from the sqlite3 module
+        """
+        mid, menergy, mfvib, mpgorder, minvalid = _read_columns(
+            connection, "tbl_minima", _min_columns)
+        tid, tenergy, tmin1, tmin2, tfvib, tpgorder, tinvalid = _read_columns(
+            connection, "tbl_transition_states", _ts_columns)
+        mid = mid.astype(np.int64)
+        return cls(min_id=mid,
+                   min_energy=menergy,
+                   min_fvib=mfvib,
+                   min_pgorder=mpgorder,
+                   min_invalid=np.nan_to_num(minvalid).astype(bool),
+                   ts_id=tid.astype(np.int64),
+                   ts_energy=tenergy,
+                   ts_min1=np.searchsorted(mid, tmin1.astype(np.int64)),
+                   ts_min2=np.searchsorted(mid, tmin2.astype(np.int64)),
+                   ts_fvib=tfvib,
+                   ts_pgorder=tpgorder,
+                   ts_invalid=np.nan_to_num(tinvalid).astype(bool))
+
+    @property
+    def nminima(self):
+        return len(self.min_id)
+
+    @property
+    def ntransition_states(self):
+        return len(self.ts_id)
+
+    def save(self, filename):
+        """save the arrays to a numpy npz file"""
+        np.savez(filename, **dict((name, getattr(self, name)) for name in self._fields))
+
+    @classmethod
+    def load(cls, filename):
+        """load arrays saved with `save`"""
+        with np.load(filename) as data:
+            return cls(**dict((name, data[name]) for name in cls._fields))
@@ -0,0 +1,283 @@
+"""merge several pele databases into one
+
+The minima of all databases are streamed in order of increasing energy and
+split into windows which are separated by energy gaps larger than the
+accuracy, so no minimum in one window can be a duplicate of a minimum in
+another.  The windows are deduplicated in parallel, the unique minima are
+inserted in bulk and the transition states are added with their minima ids
+remapped to the merged database.
+
+Usage from the command line::
+
+    python -m pele.storage.merge <out> <database1> [<database2> ...] [--nproc N]
+        [--system lj --natoms N]
+"""
+from __future__ import print_function
+import argparse
+import bisect
+import heapq
+import itertools
+
+from sqlalchemy import select
+
+from pele.storage.database import Database, Minimum, TransitionState, _insert_rows
+from pele.utils.fork_pool import _get_fork_context
+
+__all__ = ["merge_databases"]
+
+_min_columns = ("energy", "coords", "fvib", "pgorder", "invalid", "user_data", "fingerprint")
+_ts_columns = ("energy", "coords", "eigenval", "eigenvec", "fvib", "pgorder", "invalid",
+               "user_data", "_minimum1_id", "_minimum2_id")
+
+# properties which describe how a database is stored, not the system
+_internal_properties = ("coords_store",)
+
+# the comparison settings used by the worker processes
+_compare = None
+
+
+def _set_compare(compareMinima, accuracy, fingerprint_accuracy):
+    global _compare
+    _compare = (compareMinima, accuracy, fingerprint_accuracy)
+
+
+def _read_rows(db, cls, columns, order_by=None):
+    """yield the rows of a table of db as dictionaries, with the coordinates"""
+    table = cls.__table__
+    query = select([table.c._id] + [table.c[c] for c in columns])
+    if order_by is not None:
+        query = query.order_by(table.c[order_by])
+    stores = db.coords_stores
+    for row in db.session.execute(query):
+        row = dict(row)
+        if stores is not None:
+            row["coords"] = stores[cls].read(row["_id"])
+        yield row
+
+
+def _minima_stream(db, source, fingerprint):
+    """yield (energy, source, id, row) for the minima of db sorted by energy"""
+    for row in _read_rows(db, Minimum, _min_columns, order_by="energy"):
+        if fingerprint is not None and source >= 0:
+            row["fingerprint"] = fingerprint(row["coords"])
+        yield row["energy"], source, row.pop("_id"), row
+
+
+def _energy_windows(stream, accuracy, window):
+    """split a stream sorted by energy into windows of independent minima"""
+    current = []
+    for item in stream:
+        if len(current) >= window and item[0] - current[-1][0] > accuracy:
+            yield current
+            current = []
+        current.append(item)
+    if current:
+        yield current
+
+
+def _dedup_window(entries):
+    """return the index of the representative of each entry
+
+    entries is a list of (energy, coords, fingerprint, existing) sorted by
+    energy.  The minima which are already in the output database are the
+    representatives of their duplicates.
+    """
+    compareMinima, accuracy, fingerprint_accuracy = _compare
+    reps = [None] * len(entries)
+    energies = []
+    accepted = []
+    cache = dict()
+
+    def transient(i):
+        if i not in cache:
+            m = Minimum(entries[i][0], entries[i][1])
+            m.fingerprint = entries[i][2]
+            cache[i] = m
+        return cache[i]
+
+    order = [i for i, e in enumerate(entries) if e[3]] + \
+            [i for i, e in enumerate(entries) if not e[3]]
+    for i in order:
+        E, coords, fp, existing = entries[i]
+        if not existing:
+            lo = bisect.bisect_left(energies, E - accuracy)
+            hi = bisect.bisect_right(energies, E + accuracy)
+            for j in accepted[lo:hi]:
+                fpj = entries[j][2]
+                if fp is not None and fpj is not None and abs(fp - fpj) > fingerprint_accuracy:
+                    continue
+                if compareMinima is None or compareMinima(transient(i), transient(j)):
+                    reps[i] = j
+                    break
+            if reps[i] is not None:
+                continue
+        reps[i] = i
+        k = bisect.bisect_right(energies, E)
+        energies.insert(k, E)
+        accepted.insert(k, i)
+    return reps
+
+
+def _open(db):
+    if isinstance(db, Database):
+        return db
+    return Database(db, createdb=False)
+
+
+def merge_databases(out, inputs, nproc=1, window=1000, verbose=True):
+    """merge the minima and transition states of several databases into one
+
+    Minima are considered identical if their energies are within
+    `out.accuracy` and, if `out` has a fingerprint function, their
+    fingerprints match and `out.compareMinima` returns True, just like
+    in `Database.addMinimum`.  Transition states are identical if they connect
+    the same minima and their energies are within `out.accuracy`.  The
+    minima already in `out` are kept.  System properties which `out` doesn't
+    have are copied from the inputs.  The signals of `out` are not called.
+    Transition states of the inputs which connect missing minima are
+    skipped with a warning.
+
+    Parameters
+    ----------
+    out : Database or string
+        the database to merge into, or the name of its file
+    inputs : list
+        the databases to merge, as Database objects or file names
+    nproc : int, optional
+        the number of processes used to compare the minima.  compareMinima
+        must be usable in a forked process.
+    window : int, optional
+        the minimum number of minima which are deduplicated together
+    verbose : bool, optional
+        print progress
+
+    Returns
+    -------
+    out : Database
+        the merged database
+    """
+    if not isinstance(out, Database):
+        out = Database(out)
+    inputs = [_open(db) for db in inputs]
+    accuracy = out.accuracy
+
+    # the minima of out are read at once, because the inserts commit the session
+    streams = [list(_minima_stream(out, -1, None))]
+    streams += [_minima_stream(db, k, out.fingerprint) for k, db in enumerate(inputs)]
+    windows = _energy_windows(heapq.merge(*streams), accuracy, window)
+
+    settings = (out.compareMinima, accuracy, out.fingerprint_accuracy)
+    if nproc > 1:
+        pool = _get_fork_context().Pool(nproc, initializer=_set_compare, initargs=settings)
+        dedup = pool.map
+    else:
+        pool = None
+        _set_compare(*settings)
+        dedup = lambda f, windows: [f(w) for w in windows]
+
+    # the id of each minimum of the inputs in the merged database
+    idmaps = [dict() for db in inputs]
+    nnew = 0
+    try:
+        while True:
+            # send a few windows per process at a time, to limit the memory
+            chunk = list(itertools.islice(windows, 4 * nproc))
+            if not chunk:
+                break
+            payload = [[(E, row["coords"], row["fingerprint"], source < 0)
+                        for E, source, id_, row in w] for w in chunk]
+            new_rows = []
+            first_id = out._next_id(Minimum)
+            for w, reps in zip(chunk, dedup(_dedup_window, payload)):
+                new_ids = dict()
+                for i, (E, source, id_, row) in enumerate(w):
+                    if reps[i] == i:
+                        if source < 0:
+                            new_ids[i] = id_
+                        else:
+                            new_ids[i] = first_id + len(new_rows)
+                            new_rows.append(row)
+                for i, (E, source, id_, row) in enumerate(w):
+                    if source >= 0:
+                        idmaps[source][id_] = new_ids[reps[i]]
+            if new_rows:
+                _insert_rows(out.session, Minimum, new_rows, first_id)
+                out.session.commit()
+                nnew += len(new_rows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if verbose:
+        print("merged databases: added", nnew, "new minima")
+
+    ntsold = out.number_of_transition_states()
+    for k, db in enumerate(inputs):
+        batch = []
+        nskipped = 0
+        for row in _read_rows(db, TransitionState, _ts_columns):
+            del row["_id"]
+            try:
+                row["min1"] = idmaps[k][row.pop("_minimum1_id")]
+                row["min2"] = idmaps[k][row.pop("_minimum2_id")]
+            except KeyError:
+                # the input database is inconsistent
+                nskipped += 1
+                continue
+            batch.append(row)
+            if len(batch) >= 10000:
+                out.add_transition_states(batch, commit=False)
+                batch = []
+        if batch:
+            out.add_transition_states(batch, commit=False)
+        out.session.commit()
+        if nskipped > 0:
+            print("warning: skipped", nskipped, "transition states of input", k,
+                  "which connect minima missing from the database")
+    if verbose:
+        print("merged databases: added", out.number_of_transition_states() - ntsold,
+              "new transition states")
+
+    for db in inputs:
+        for p in db.properties():
+            if p.name() in _internal_properties:
+                continue
+            if out.get_property(p.name()) is None:
+                out.add_property(p.name(), p.value(), commit=False)
+    out.session.commit()
+    return out
+
+
+def _get_system(name, natoms):
+    # pele.systems imports pele.storage, so it can't be imported at the top
+    from pele.systems import LJCluster, MorseCluster
+    systems = {"lj": LJCluster, "morse": MorseCluster}
+    return systems[name](natoms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="merge several pele databases into one.  "
+                                     "Without --system the minima are compared by energy only.")
+    parser.add_argument("out", type=str, help="the database to merge into (created if it doesn't exist)")
+    parser.add_argument("inputs", type=str, nargs="+", help="the databases to merge")
+    parser.add_argument("--nproc", type=int, default=1, help="number of processes")
+    parser.add_argument("--accuracy", type=float, default=1e-3,
+                        help="energy tolerance to count minima as equal")
+    parser.add_argument("--system", type=str, choices=["lj", "morse"], default=None,
+                        help="compare the structures of the minima as this system does")
+    parser.add_argument("--natoms", type=int, default=None,
+                        help="number of atoms of the system")
+    args = parser.parse_args()
+
+    if args.system is None:
+        out = Database(args.out, accuracy=args.accuracy)
+    else:
+        if args.natoms is None:
+            parser.error("--system requires --natoms")
+        system = _get_system(args.system, args.natoms)
+        out = system.create_database(args.out, accuracy=args.accuracy)
+    merge_databases(out, args.inputs, nproc=args.nproc)
+
+
+if __name__ == "__main__":
+    main()
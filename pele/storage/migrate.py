@@ -0,0 +1,174 @@
+"""migrate a pele database to the newest schema version
+
+The schema version is stored in the sqlite `user_version`.  Each migration
+step updates the tables in place and increments the version by one.
+
+Usage from the command line::
+
+    python -m pele.storage.migrate <database1> [<database2> ...]
+"""
+from __future__ import print_function
+import sys
+import pickle
+import shutil
+import sqlite3
+
+import numpy as np
+import sqlalchemy
+
+from pele.storage import database
+
+__all__ = ["migrate", "migrate_copy", "get_schema_version"]
+
+
+def from_0_to_1(connection, schema):
+    ''' migrating from version 0 to 1
+
+        fields for log product of frequencies and point group order were added
+        to Minimum and TransitionState
+    '''
+    assert schema == 0
+    connection.execute("ALTER TABLE tbl_minima ADD fvib FLOAT;")
+    connection.execute("ALTER TABLE tbl_minima ADD pgorder INTEGER;")
+    connection.execute("ALTER TABLE tbl_transition_states ADD fvib FLOAT;")
+    connection.execute("ALTER TABLE tbl_transition_states ADD pgorder INTEGER;")
+    connection.execute("PRAGMA user_version = 1;")
+    return 1
+
+
+def from_1_to_2(connection, schema):
+    """the invalid flag and user_data were added to Minimum and TransitionState"""
+    assert schema == 1
+    connection.execute("ALTER TABLE tbl_minima ADD invalid INTEGER;")
+    connection.execute("ALTER TABLE tbl_transition_states ADD invalid INTEGER;")
+    connection.execute("ALTER TABLE tbl_minima ADD user_data BLOB;")
+    connection.execute("ALTER TABLE tbl_transition_states ADD user_data BLOB;")
+    connection.execute("PRAGMA user_version = 2;")
+    return 2
+
+
+def from_2_to_3(connection, schema):
+    """the structural fingerprint was added to Minimum
+
+    The fingerprints of the existing minima are left empty.  They can be
+    computed with `Database.update_fingerprints()`.
+    """
+    assert schema == 2
+    connection.execute("ALTER TABLE tbl_minima ADD fingerprint FLOAT;")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_minimum_energy_fingerprint "
+                       "ON tbl_minima (energy, fingerprint);")
+    connection.execute("PRAGMA user_version = 3;")
+    return 3
+
+
+def _unpickle(blob):
+    try:
+        # numpy arrays pickled by python 2 need the latin1 encoding
+        return pickle.loads(blob, encoding="latin1")
+    except TypeError:
+        return pickle.loads(blob)
+
+
+# the number of rows converted at once by _convert_to_float64
+_batch_size = 10000
+
+
+def _convert_to_float64(connection, table, column):
+    """convert the pickled arrays of a column in batches of increasing id
+
+    Only one batch is held in memory.  The batches are written in the
+    transaction of the migration step, so an interrupted migration leaves
+    the column unchanged instead of half converted.
+    """
+    batch_size = _batch_size
+    last_id = -1
+    while True:
+        rows = connection.execute("SELECT _id, %s FROM %s WHERE %s IS NOT NULL AND _id > ? "
+                                  "ORDER BY _id LIMIT ?;" % (column, table, column),
+                                  (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        params = []
+        for _id, blob in rows:
+            x = np.asarray(_unpickle(bytes(blob)), dtype="<f8").ravel()
+            params.append((sqlite3.Binary(x.tobytes()), _id))
+        connection.execute("UPDATE %s SET %s = ? WHERE _id = ?;" % (table, column), params)
+        last_id = rows[-1][0]
+
+
+def from_3_to_4(connection, schema):
+    """the coordinates and eigenvectors are stored as raw float64 bytes instead
+    of pickled numpy arrays"""
+    assert schema == 3
+    _convert_to_float64(connection, "tbl_minima", "coords")
+    _convert_to_float64(connection, "tbl_transition_states", "coords")
+    _convert_to_float64(connection, "tbl_transition_states", "eigenvec")
+    connection.execute("PRAGMA user_version = 4;")
+    return 4
+
+
+migrate_script = {0: from_0_to_1,
+                  1: from_1_to_2,
+                  2: from_2_to_3,
+                  3: from_3_to_4,
+                  }
+
+
+def get_schema_version(engine):
+    """return the schema version of a database"""
+    res = engine.execute("PRAGMA user_version;")
+    schema = res.fetchone()[0]
+    res.close()
+    return schema
+
+
+def migrate(db, verbose=True):
+    """update the database file `db` to the newest schema version"""
+    engine = sqlalchemy.create_engine("sqlite:///%s" % db)
+    schema = get_schema_version(engine)
+
+    if verbose:
+        print("current version:", schema)
+        print("newest version:", database._schema_version)
+
+    connection = engine.connect()
+    try:
+        while schema < database._schema_version:
+            trans = connection.begin()
+            try:
+                schema = migrate_script[schema](connection, schema)
+            except Exception:
+                trans.rollback()
+                raise
+            trans.commit()
+    finally:
+        connection.close()
+        engine.dispose()
+    if verbose:
+        print("database is at newest version")
+
+
+def migrate_copy(db, newdb, verbose=False):
+    """copy the database file `db` to `newdb` and update the copy
+
+    The original file is left unchanged, e.g. for databases that are shipped
+    with the tests.
+    """
+    shutil.copy(db, newdb)
+    migrate(newdb, verbose=verbose)
+    return newdb
+
+
+def main():
+    if len(sys.argv) < 2 or "--help" in sys.argv or "-h" in sys.argv:
+        print("usage:\npython migrate_db.py <database1> [<database2> ...]")
+        print("")
+        print("update pele database to the newest version")
+        sys.exit()
+    for dbfile in sys.argv[1:]:
+        print(dbfile)
+        migrate(dbfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""opt-in timing of the methods, sql statements and commits of a Database
+"""
+from __future__ import print_function
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+__all__ = ["DatabaseProfiler"]
+
+_table_re = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+class _Timing(object):
+    """the number of calls and the total and largest time of something"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, dt):
+        self.count += 1
+        self.total += dt
+        self.max = max(self.max, dt)
+
+
+class DatabaseProfiler(object):
+    """record where the time spent in a Database goes
+
+    The profiler wraps the public methods of the database, listens to the
+    sqlalchemy engine and session events and records
+
+    - the number of calls and the wall time of each method
+    - the number of calls and the wall time of the sql statements, by
+      statement type and table
+    - the latency of the commits, including the flush
+    - the number of candidate minima which `addMinimum` loads from the
+      energy window of width `2 * accuracy`, and how often a duplicate was
+      found among them
+
+    Parameters
+    ----------
+    db : Database
+        the database to profile.  The profiler is attached immediately.
+    methods : list of strings, optional
+        the methods of the database to time.  By default the methods which
+        access the database.
+
+    Examples
+    --------
+
+    >>> db = Database("lj38.sqlite", profile=True)
+    >>> # ... run a connect job
+    >>> print(db.profiler.report())
+
+    or attach a profiler to an existing database
+
+    >>> profiler = DatabaseProfiler(db)
+    >>> # ...
+    >>> profiler.detach()
+    >>> print(profiler.report())
+
+    Notes
+    -----
+    If the candidate windows of addMinimum contain many minima which are
+    not duplicates, `accuracy` is too large or the minima need a fingerprint.
+    If commits dominate, use `commit=False` or a larger `commit_interval`
+    and commit less often.
+    """
+    default_methods = ("addMinimum", "addTransitionState", "add_minima", "add_transition_states",
+                       "findMinimum", "getMinimum", "getTransitionState",
+                       "getTransitionStatesMinimum", "getTransitionStateFromID",
+                       "removeMinimum", "mergeMinima", "remove_transition_state", "minima",
+                       "transition_states", "number_of_minima", "number_of_transition_states",
+                       "get_property", "add_property", "all_coords", "to_arrays", "get_distances",
+                       "add_distances")
+
+    def __init__(self, db, methods=None):
+        self.db = db
+        if methods is None:
+            methods = self.default_methods
+        self.method_names = [name for name in methods if hasattr(db, name)]
+        self._lock = threading.Lock()
+        self._attached = False
+        self.reset()
+        self.attach()
+
+    def reset(self):
+        """forget everything which was recorded"""
+        with self._lock:
+            self.methods = dict()
+            self.statements = dict()
+            self.commits = _Timing()
+            self.candidate_calls = 0
+            self.candidate_rows = 0
+            self.candidate_max = 0
+            self.duplicates = 0
+
+    def _add(self, timings, key, dt):
+        with self._lock:
+            try:
+                timing = timings[key]
+            except KeyError:
+                timing = timings[key] = _Timing()
+            timing.add(dt)
+
+    def _wrap(self, name, method):
+        def wrapper(*args, **kwargs):
+            t0 = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._add(self.methods, name, time.time() - t0)
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def attach(self):
+        """start recording"""
+        if self._attached:
+            return
+        for name in self.method_names:
+            setattr(self.db, name, self._wrap(name, getattr(self.db, name)))
+        event.listen(self.db.engine, "before_cursor_execute", self._before_execute)
+        event.listen(self.db.engine, "after_cursor_execute", self._after_execute)
+        event.listen(self.db.session, "before_commit", self._before_commit)
+        event.listen(self.db.session, "after_commit", self._after_commit)
+        event.listen(self.db.session, "after_rollback", self._after_rollback)
+        self.db.profiler = self
+        self._attached = True
+
+    def detach(self):
+        """stop recording.  The recorded values are kept."""
+        if not self._attached:
+            return
+        for name in self.method_names:
+            # remove the wrapper, which is an instance attribute
+            self.db.__dict__.pop(name, None)
+        event.remove(self.db.engine, "before_cursor_execute", self._before_execute)
+        event.remove(self.db.engine, "after_cursor_execute", self._after_execute)
+        event.remove(self.db.session, "before_commit", self._before_commit)
+        event.remove(self.db.session, "after_commit", self._after_commit)
+        event.remove(self.db.session, "after_rollback", self._after_rollback)
+        if self.db.profiler is self:
+            self.db.profiler = None
+        self._attached = False
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiler_start", []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        dt = time.time() - conn.info["profiler_start"].pop()
+        words = statement.split(None, 1)
+        kind = words[0].upper() if words else ""
+        match = _table_re.search(statement)
+        if match is not None:
+            kind += " " + match.group(1)
+        self._add(self.statements, kind, dt)
+
+    def _before_commit(self, session):
+        session.info["profiler_commit_start"] = time.time()
+
+    def _after_commit(self, session):
+        t0 = session.info.pop("profiler_commit_start", None)
+        if t0 is not None:
+            dt = time.time() - t0
+            with self._lock:
+                self.commits.add(dt)
+
+    def _after_rollback(self, session):
+        session.info.pop("profiler_commit_start", None)
+
+    def record_candidates(self, nrows, duplicate):
+        """record the size of a candidate window of addMinimum"""
+        with self._lock:
+            self.candidate_calls += 1
+            self.candidate_rows += nrows
+            self.candidate_max = max(self.candidate_max, nrows)
+            if duplicate:
+                self.duplicates += 1
+
+    def report(self):
+        """return the recorded values as a text table"""
+        lines = []
+
+        def table(title, timings):
+            lines.append("%-40s %10s %12s %12s %12s" % (title, "calls", "total (s)",
+                                                       "mean (ms)", "max (ms)"))
+            items = sorted(timings.items(), key=lambda item: -item[1].total)
+            for name, t in items:
+                lines.append("%-40s %10d %12.4f %12.4f %12.4f" % (
+                    name, t.count, t.total, 1e3 * t.total / max(t.count, 1), 1e3 * t.max))
+            lines.append("")
+
+        with self._lock:
+            table("method", self.methods)
+            table("sql statement", self.statements)
+            table("commit", dict(commit=self.commits))
+            lines.append("addMinimum candidate windows: %d, rows loaded: %d "
+                         "(mean %.2f, max %d), duplicates found: %d" % (
+                             self.candidate_calls, self.candidate_rows,
+                             float(self.candidate_rows) / max(self.candidate_calls, 1),
+                             self.candidate_max, self.duplicates))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.report()
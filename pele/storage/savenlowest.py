@@ -6,21 +6,54 @@ Created on Apr 18, 2012
 from __future__ import print_function
 
 import threading
-import operator
+import bisect
+import math
+
+import numpy as np
+
 
 class Minimum(object):
     """
     class for storing minima
+
+    The coordinates of a minimum stored in SaveN are a row of the
+    coordinates array of SaveN, which is reused after the minimum is removed.
+    `coords` then returns a copy of the row.
     """
+    _view = None
     
-    def __init__(self, E, coords):        
+    def __init__(self, E, coords, copy=True):
         self.energy = E
-        self.coords = coords.copy()        
+        self.coords = coords.copy() if copy else coords
+
+    @property
+    def coords(self):
+        if self._view is not None:
+            return self._view.copy()
+        return self._coords
+
+    @coords.setter
+    def coords(self, coords):
+        self._view = None
+        self._coords = coords
+
+    def __setstate__(self, dct):
+        # older versions stored the coordinates as a plain attribute
+        if "coords" in dct:
+            dct["_coords"] = dct.pop("coords")
+        self.__dict__.update(dct)
     
 class SaveN(object):
     """
     Stores only the nsave lowest minima. Minima are considered as different
     if energy differs by more than accuracy
+
+    `data` is the list of minima sorted by energy.  The coordinates of the
+    minima are rows of a single array, and the minima are also hashed into
+    energy buckets of width accuracy, so an insert only compares with the
+    minima in the neighbouring buckets.  `coords` of a stored minimum returns
+    a copy of its row, and a minimum which is removed gets its own copy of
+    the coordinates.
     """
 
     def __init__(self, nsave=1, accuracy=1e-3, onMinimumAdded=None, onMinimumRemoved=None, compareMinima=None):
@@ -34,37 +67,114 @@ class SaveN(object):
         self.onMinimumRemoved=onMinimumRemoved
         self.compareMinima=compareMinima
         self.lock = threading.Lock()
+        self._rebuild()
         
     def __call__(self, E, coords):
         self.insert(E, coords)
 
     def addMinimum(self, E, coords):
         self.insert(E, coords)
+
+    def _rebuild(self):
+        """build the energy list, the buckets and the coordinates array from data"""
+        self._energies = [m.energy for m in self.data]
+        self._buckets = dict()
+        self._coords = None
+        self._free = []
+        if not self.data:
+            return
+        nrows = max(len(self.data), min(self.nsave + 1, 16))
+        self._coords = np.empty((nrows, np.size(self.data[0].coords)))
+        self._free = list(range(nrows - 1, len(self.data) - 1, -1))
+        for row, m in enumerate(self.data):
+            self._bucket(m.energy).append(m)
+            coords = np.asarray(m.coords)
+            self._coords[row] = coords.ravel()
+            m._row = row
+            m._coords = None
+            m._view = self._coords[row].reshape(coords.shape)
+
+    def _bucket_key(self, E):
+        if self.accuracy <= 0:
+            return 0
+        return int(math.floor(E / self.accuracy))
+
+    def _bucket(self, E):
+        return self._buckets.setdefault(self._bucket_key(E), [])
+
+    def _candidates(self, E):
+        """the minima with energies within accuracy of E"""
+        if self.accuracy <= 0:
+            return
+        key = self._bucket_key(E)
+        for k in (key, key - 1, key + 1):
+            for m in self._buckets.get(k, ()):
+                if abs(m.energy - E) < self.accuracy:
+                    yield m
+
+    def _store_coords(self, m, coords):
+        """copy the coordinates of m into a free row of the coordinates array"""
+        if self._coords is None:
+            self._coords = np.empty((min(max(self.nsave + 1, 1), 16), coords.size))
+            self._free = list(range(len(self._coords) - 1, -1, -1))
+        elif coords.size != self._coords.shape[1]:
+            raise ValueError("all minima must have %d coordinates, got %d"
+                             % (self._coords.shape[1], coords.size))
+        if not self._free:
+            # grow geometrically, there is at most one more minimum than nsave
+            nrows = len(self._coords)
+            new = np.empty((max(min(2 * nrows, self.nsave + 1), nrows + 1), self._coords.shape[1]))
+            new[:nrows] = self._coords
+            # point the stored minima to the new array
+            for other in self.data:
+                other._view = new[other._row].reshape(other._view.shape)
+            self._coords = new
+            self._free = list(range(len(new) - 1, nrows - 1, -1))
+        row = self._free.pop()
+        self._coords[row] = coords.ravel()
+        m._row = row
+        m._coords = None
+        m._view = self._coords[row].reshape(coords.shape)
+
+    def _pop(self):
+        """remove the highest energy minimum"""
+        removed = self.data.pop()
+        self._energies.pop()
+        key = self._bucket_key(removed.energy)
+        bucket = self._buckets[key]
+        bucket.remove(removed)
+        if not bucket:
+            del self._buckets[key]
+        # the row will be reused
+        removed.coords = removed._view.copy()
+        self._free.append(removed._row)
+        del removed._row
+        return removed
         
     def insert(self, E, coords):
-        new = Minimum(E, coords)
+        coords = np.asarray(coords)
+        new = Minimum(E, coords, copy=False)
         # does minima already exist, if yes exit?
-        self.lock.acquire()
-        for i in self.data:
-            if abs(i.energy - E) < self.accuracy:
+        with self.lock:
+            for i in self._candidates(E):
                 if self.compareMinima:
                     if not self.compareMinima(new, i):
-                        continue                
-                
-                self.lock.release()
+                        continue
                 return
-                
-        # otherwise, add it to list & sort
-        self.data.append(new)
-        self.data.sort(key=operator.attrgetter('energy'))
-        if self.onMinimumAdded:
-            self.onMinimumAdded(new)
-        # remove if too many entries
-        while len(self.data) > self.nsave:
-            removed = self.data.pop()
-            if self.onMinimumRemoved:
-                self.onMinimumRemoved(removed)
-        self.lock.release()
+
+            # otherwise, add it to list at the right position
+            self._store_coords(new, coords)
+            k = bisect.bisect_right(self._energies, E)
+            self._energies.insert(k, E)
+            self.data.insert(k, new)
+            self._bucket(E).append(new)
+            if self.onMinimumAdded:
+                self.onMinimumAdded(new)
+            # remove if too many entries
+            while len(self.data) > self.nsave:
+                removed = self._pop()
+                if self.onMinimumRemoved:
+                    self.onMinimumRemoved(removed)
         
     def save(self, filename):
         import pickle
@@ -83,11 +193,15 @@ class SaveN(object):
         ddict["onMinimumAdded"]=None
         ddict["onMinimumRemoved"]=None
         del ddict["lock"]
+        # the indices are rebuilt when unpickled
+        for key in ("_energies", "_buckets", "_coords", "_free"):
+            ddict.pop(key, None)
         return ddict #.items()
     
     def __setstate__(self, dct):
         self.__dict__.update(dct)
         self.lock = threading.Lock()
+        self._rebuild()
         
     
         
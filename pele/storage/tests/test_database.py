@@ -1,8 +1,18 @@
 from __future__ import print_function
 import unittest
 import os
+import sys
+import shutil
+import tempfile
 
-from pele.storage import Database
+import numpy as np
+
+from pele.storage import Database, LandscapeArrays, merge_databases, DatabaseProfiler
+import sqlite3
+
+from pele.storage.migrate import migrate, migrate_copy, _unpickle
+import pele.storage.migrate as migrate_module
+from pele.storage.database import Distance, Minimum
 
 class TestDB(unittest.TestCase):
     def setUp(self):
@@ -117,6 +127,111 @@ class TestDB(unittest.TestCase):
         self.assertEqual(self.nminima+4, self.db.number_of_minima())
         
     
+    def test_async_minimum_adder(self):
+        ma = self.db.async_minimum_adder()
+        ma(101., [101.])
+        ma(0., [0.])
+        ma(101., [101.])
+        ma(102., [102.])
+        ma.flush()
+        self.assertEqual(self.db.number_of_minima(), self.nminima + 2)
+        self.assertEqual(ma.nduplicates, 1)
+        ma.close()
+
+    def test_async_minimum_adder_Ecut(self):
+        ma = self.db.async_minimum_adder(Ecut=0)
+        ma(101., [101.])
+        ma(-101., [-101.])
+        ma.close()
+        self.assertEqual(self.db.number_of_minima(), self.nminima + 1)
+        self.assertEqual(self.db.minima()[0].energy, -101.)
+
+    def test_async_minimum_adder_max_n_minima(self):
+        ma = self.db.async_minimum_adder(max_n_minima=self.nminima)
+        ma(-1., [-1.])
+        ma(100., [100.])
+        ma.close()
+        self.assertEqual(self.db.number_of_minima(), self.nminima)
+        energies = [m.energy for m in self.db.minima()]
+        self.assertIn(-1., energies)
+        self.assertNotIn(100., energies)
+
+    def test_async_minimum_adder_signal(self):
+        added = []
+        def on_added(m):
+            added.append(m.energy)
+        self.db.on_minimum_added.connect(on_added)
+        ma = self.db.async_minimum_adder()
+        for i in range(5):
+            e = 100. + i
+            ma(e, [e])
+        ma.close()
+        self.assertEqual(sorted(added), [100. + i for i in range(5)])
+        with self.assertRaises(RuntimeError):
+            ma(200., [200.])
+
+    def test_add_minima(self):
+        minima = self.db.add_minima([(101., [101.]), (0., [0.]),
+                                     (101., [101.]), (102., [102.])])
+        self.assertEqual(self.db.number_of_minima(), self.nminima + 2)
+        self.assertEqual(minima[0], minima[2])
+        self.assertEqual(minima[1], self.db.minima()[0])
+        self.assertEqual([m.energy for m in minima], [101., 0., 101., 102.])
+        self.assertEqual(list(minima[3].coords), [102.])
+
+    def test_add_minima_columns(self):
+        m, = self.db.add_minima([dict(energy=101., coords=[101.], fvib=1.5, pgorder=2)])
+        self.assertEqual(m.fvib, 1.5)
+        self.assertEqual(m.pgorder, 2)
+        self.assertFalse(m.invalid)
+
+    def test_add_minima_compareMinima(self):
+        db = Database(compareMinima=lambda m1, m2: abs(m1.coords[0] - m2.coords[0]) < 0.5)
+        db.addMinimum(0., [0.])
+        minima = db.add_minima([(0., [0.1]), (0., [2.]), (0., [2.1]), (0., [3.])])
+        self.assertEqual(db.number_of_minima(), 3)
+        self.assertEqual(minima[0], db.minima()[0])
+        self.assertEqual(minima[1], minima[2])
+        self.assertNotEqual(minima[1], minima[3])
+
+    def test_add_minima_no_check(self):
+        minima = self.db.add_minima([(0., [0.]), (0., [0.])], check_duplicates=False)
+        self.assertEqual(self.db.number_of_minima(), self.nminima + 2)
+        self.assertEqual(minima[1].id(), minima[0].id() + 1)
+
+    def test_add_minima_max_n_minima(self):
+        minima = self.db.add_minima([(-1., [-1.]), (100., [100.]), (-2., [-2.])],
+                                    max_n_minima=self.nminima + 1)
+        self.assertEqual(self.db.number_of_minima(), self.nminima + 1)
+        self.assertIsNone(minima[1])
+        energies = [m.energy for m in self.db.minima()]
+        self.assertEqual(energies[:2], [-2., -1.])
+        self.assertNotIn(float(self.nminima - 1), energies)
+
+    def test_add_minima_signal(self):
+        added = []
+        def on_added(m):
+            added.append(m.energy)
+        self.db.on_minimum_added.connect(on_added)
+        self.db.add_minima([(101., [101.]), (0., [0.]), (101., [101.])])
+        self.assertEqual(added, [101.])
+
+    def test_add_transition_states(self):
+        m = self.db.minima()
+        added = []
+        def on_added(ts):
+            added.append(ts)
+        self.db.on_ts_added.connect(on_added)
+        tslist = self.db.add_transition_states([(0., [0.], m[1], m[0]),
+                                                (5., [5.], m[3], m[4]),
+                                                (5., [5.], m[4].id(), m[3].id())])
+        self.assertEqual(self.db.number_of_transition_states(), self.nts + 1)
+        self.assertEqual(tslist[0], self.db.getTransitionState(m[0], m[1]))
+        self.assertIs(tslist[1], tslist[2])
+        self.assertEqual(tslist[1].minimum1, m[3])
+        self.assertEqual(tslist[1].minimum2, m[4])
+        self.assertEqual(added, [tslist[1]])
+
     def test_merge_minima(self):
         m1 = self.db.minima()[0]
         m2 = self.db.minima()[1]
@@ -157,6 +272,37 @@ class TestDB(unittest.TestCase):
         self.assertEqual(self.nminima, self.db.number_of_minima())
         self.assertIn(m, self.db.minima())
 
+    def test_maximum_number_of_minima_index(self):
+        # the energy index must follow removals and reused ids
+        self.db.addMinimum(-1., [-1.], max_n_minima=self.nminima)
+        self.db.removeMinimum(self.db.minima()[-1])
+        self.db.mergeMinima(self.db.minima()[0], self.db.minima()[1])
+        m = self.db.addMinimum(100., [100.], max_n_minima=self.nminima)
+        self.assertIsNotNone(m)
+        self.db.addMinimum(-2., [-2.], commit=False, max_n_minima=self.nminima)
+        self.db.addMinimum(-3., [-3.], commit=False, max_n_minima=self.nminima)
+        self.assertNotIn(100., [m.energy for m in self.db.minima()])
+        self.assertEqual(self.nminima, self.db.number_of_minima())
+
+        np.random.seed(0)
+        for e in np.random.uniform(-5, 20, 100):
+            self.db.addMinimum(e, [e], max_n_minima=self.nminima)
+        energies = [m.energy for m in self.db.minima()]
+        index = self.db._get_energy_index()
+        self.assertEqual(len(index), len(energies))
+        self.assertEqual(index.highest()[0][1], energies[-1])
+        self.assertEqual(sorted(index.energies.values()), energies)
+
+    def test_maximum_number_of_minima_rollback(self):
+        self.db.addMinimum(-1., [-1.], commit=False, max_n_minima=self.nminima)
+        self.db.session.rollback()
+        self.assertIsNone(self.db._energy_index)
+        e = float(self.nminima - 1)
+        m = self.db.addMinimum(e - 0.5, [e - 0.5], max_n_minima=self.nminima)
+        self.assertIsNotNone(m)
+        self.assertEqual(self.nminima, self.db.number_of_minima())
+        self.assertEqual(self.db._highest_energy_minimum(), m)
+
     def test_getTSfromID(self):
         ts = self.db.transition_states()[0]
         ts1 = self.db.getTransitionStateFromID(ts._id)
@@ -240,9 +386,69 @@ class TestDB(unittest.TestCase):
     
     def test_load_right_schema(self):
         current_dir = os.path.dirname(__file__)
-        dbname = current_dir + "/lj6_schema2.sqlite"
-        db = Database(dbname, createdb=False)
+        dbname = os.path.join(current_dir, "lj6_schema2.{}.sqlite".format(sys.version_info.major))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tmpname = os.path.join(tmpdir, "lj6.sqlite")
+            shutil.copy(dbname, tmpname)
+            with self.assertRaises(IOError):
+                Database(tmpname, createdb=False)
+            migrate(tmpname, verbose=False)
+            db = Database(tmpname, createdb=False)
+            self.assertGreater(db.number_of_minima(), 0)
+            self.assertIsNone(db.minima()[0].fingerprint)
+            self.assertEqual(db.minima()[0].coords.shape, (18,))
+        finally:
+            shutil.rmtree(tmpdir)
     
+    def test_iter_minima(self):
+        minima = list(self.db.iter_minima(chunk_size=3))
+        self.assertEqual(minima, self.db.minima())
+        minima = list(self.db.iter_minima(Emin=2., Emax=5., chunk_size=3))
+        self.assertEqual([m.energy for m in minima], [2., 3., 4., 5.])
+        ids = [m.id() for m in self.db.iter_minima(order_energy=False, id_min=4, id_max=6)]
+        self.assertEqual(ids, [4, 5, 6])
+        m = next(self.db.iter_minima(coords=True))
+        self.assertIn("coords", m.__dict__)
+        self.assertEqual(list(m.coords), [0.])
+
+    def test_iter_transition_states(self):
+        tslist = list(self.db.iter_transition_states(chunk_size=2))
+        self.assertEqual(tslist, self.db.transition_states())
+        self.assertEqual(len(list(self.db.iter_transition_states(Emin=1.))), 0)
+        ts, = self.db.iter_transition_states(id_min=2, id_max=2, coords=True)
+        self.assertEqual(ts.id(), 2)
+        self.assertEqual(ts.minimum1, self.db.minima()[1])
+
+    def test_to_arrays(self):
+        m = self.db.minima()[3]
+        m.fvib = 1.5
+        m.pgorder = 2
+        self.db.minima()[4].invalid = True
+        arrays = self.db.to_arrays()
+        self.assertEqual(arrays.nminima, self.nminima)
+        self.assertEqual(arrays.ntransition_states, self.nts)
+        self.assertEqual(list(arrays.min_id), [m.id() for m in self.db.minima()])
+        self.assertEqual(list(arrays.min_energy), [m.energy for m in self.db.minima()])
+        self.assertEqual(arrays.min_fvib[3], 1.5)
+        self.assertTrue(np.isnan(arrays.min_fvib[0]))
+        self.assertTrue(np.isnan(arrays.min_pgorder[2]))
+        self.assertEqual(arrays.min_pgorder[3], 2)
+        self.assertEqual(list(np.where(arrays.min_invalid)[0]), [4])
+        ts = self.db.transition_states()[1]
+        self.assertEqual(arrays.min_id[arrays.ts_min1[1]], ts.minimum1.id())
+        self.assertEqual(arrays.min_id[arrays.ts_min2[1]], ts.minimum2.id())
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "landscape.npz")
+            arrays.save(fname)
+            loaded = LandscapeArrays.load(fname)
+        finally:
+            shutil.rmtree(tmpdir)
+        for name in LandscapeArrays._fields:
+            np.testing.assert_array_equal(getattr(arrays, name), getattr(loaded, name))
+
     def test_invalid(self):
         m = self.db.minima()[0]
         self.assertFalse(m.invalid)
@@ -269,6 +475,528 @@ class TestDB(unittest.TestCase):
         self.db.session.commit()
         v = m.user_data["key"]
         
+class TestFloat64Storage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmpdir, "test.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        db = Database(self.dbname)
+        x1 = np.random.uniform(size=9)
+        x2 = np.random.uniform(size=9)
+        m1 = db.addMinimum(1., x1)
+        m2 = db.addMinimum(2., x2)
+        db.addTransitionState(3., x1 + x2, m1, m2, eigenval=-1., eigenvec=x1 - x2)
+        db.session.close()
+
+        db = Database(self.dbname, createdb=False)
+        m1, m2 = db.minima()
+        self.assertTrue(np.all(m1.coords == x1))
+        self.assertEqual(m1.coords.dtype, np.float64)
+        ts = db.transition_states()[0]
+        self.assertTrue(np.all(ts.coords == x1 + x2))
+        self.assertTrue(np.all(ts.eigenvec == x1 - x2))
+
+    def test_no_eigenvec(self):
+        db = Database(self.dbname)
+        m1 = db.addMinimum(1., [1.])
+        m2 = db.addMinimum(2., [2.])
+        ts = db.addTransitionState(3., [3.], m1, m2)
+        db.session.expire_all()
+        self.assertIsNone(ts.eigenvec)
+
+    def test_raw_bytes(self):
+        db = Database(self.dbname)
+        db.addMinimum(1., [1., 2.])
+        blob = db.engine.execute("SELECT coords FROM tbl_minima").fetchone()[0]
+        self.assertEqual(len(blob), 16)
+
+    def test_migrate_pickles(self):
+        # the pathsample fixtures are at schema 2 with pickled coordinates
+        import pele.mindist.tests
+        d = os.path.dirname(pele.mindist.tests.__file__)
+        pyversions = [2, 3] if sys.version_info.major >= 3 else [2]
+        for pyversion in pyversions:
+            fname = os.path.join(d, "lj13_small_pathsample.{}.sqlite".format(pyversion))
+            conn = sqlite3.connect(fname)
+            expected = dict((_id, _unpickle(bytes(blob))) for _id, blob in
+                            conn.execute("SELECT _id, coords FROM tbl_minima"))
+            eigenvecs = conn.execute("SELECT COUNT(*) FROM tbl_transition_states "
+                                     "WHERE eigenvec IS NOT NULL").fetchone()[0]
+            conn.close()
+
+            # convert in several batches
+            batch_size = migrate_module._batch_size
+            migrate_module._batch_size = 7
+            try:
+                tmpname = migrate_copy(fname, os.path.join(self.tmpdir, "lj13.{}.sqlite".format(pyversion)))
+            finally:
+                migrate_module._batch_size = batch_size
+            db = Database(tmpname, createdb=False)
+            self.assertEqual(db.number_of_minima(), len(expected))
+            for m in db.minima():
+                self.assertEqual(m.coords.dtype, np.float64)
+                self.assertTrue(np.all(m.coords == expected[m.id()]))
+            for ts in db.transition_states():
+                self.assertEqual(ts.coords.shape, (39,))
+            self.assertEqual(len([ts for ts in db.transition_states() if ts.eigenvec is not None]),
+                             eigenvecs)
+            db.session.close()
+            db.engine.dispose()
+
+
+class TestCoordsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmpdir, "test.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_coords(self):
+        db = Database(self.dbname, coords_store=True)
+        for i in range(4):
+            db.addMinimum(float(i), np.arange(3.) + i)
+        db.add_minima([(10., [10.] * 3)])
+        m1, m2 = db.minima()[:2]
+        db.addTransitionState(0.5, [5.] * 3, m1, m2, eigenvec=[1., 0., 0.])
+        blob = db.engine.execute("SELECT coords FROM tbl_minima").fetchone()[0]
+        self.assertIsNone(blob)
+
+        db.session.expire_all()
+        self.assertTrue(np.all(db.minima()[2].coords == np.arange(3.) + 2))
+        coords = db.all_coords()
+        self.assertEqual(coords.shape, (5, 3))
+        self.assertTrue(np.all(coords[4] == 10.))
+        self.assertTrue(np.all(db.all_coords(transition_states=True) == 5.))
+
+        db.removeMinimum(db.minima()[3])
+        m1.coords = np.zeros(3)
+        db.session.commit()
+        db.session.close()
+
+        db = Database(self.dbname, createdb=False)
+        self.assertIsNotNone(db.coords_stores)
+        coords = db.all_coords()
+        self.assertTrue(np.all(np.isnan(coords[3])))
+        self.assertTrue(np.all(coords[0] == 0.))
+        self.assertTrue(np.all(db.transition_states()[0].eigenvec == [1., 0., 0.]))
+
+    def test_rollback(self):
+        db = Database(self.dbname, coords_store=True)
+        m = db.addMinimum(1., [1., 1.])
+        db.removeMinimum(m, commit=False)
+        db.session.rollback()
+        self.assertTrue(np.all(db.all_coords() == 1.))
+        self.assertTrue(np.all(db.minima()[0].coords == 1.))
+
+    def test_move_coords(self):
+        db = Database(self.dbname)
+        db.addMinimum(1., [1., 2.])
+        db.addMinimum(2., [3., 4.])
+        db.session.close()
+
+        db = Database(self.dbname, coords_store=True)
+        self.assertTrue(np.all(db.all_coords() == [[1., 2.], [3., 4.]]))
+        self.assertTrue(np.all(db.minima()[1].coords == [3., 4.]))
+
+    def test_no_store(self):
+        db = Database()
+        db.addMinimum(1., [1., 2.])
+        db.addMinimum(2., [3., 4.])
+        db.removeMinimum(db.minima()[0])
+        coords = db.all_coords()
+        self.assertTrue(np.all(np.isnan(coords[0])))
+        self.assertTrue(np.all(coords[1] == [3., 4.]))
+
+
+class TestConcurrent(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmpdir, "test.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_threads(self):
+        import threading
+        db = Database(self.dbname, concurrent=True)
+        m1 = db.addMinimum(-1., [-1.])
+        m2 = db.addMinimum(-2., [-2.])
+        errors = []
+        def add(offset):
+            try:
+                for i in range(20):
+                    # half of the minima are added by both threads
+                    e = float(offset * (i % 2) + i)
+                    db.addMinimum(e, [e])
+                    db.addTransitionState(e, [e], db.getMinimum(m1.id()), db.getMinimum(m2.id()))
+                db.session.remove()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=add, args=(100 * (i + 1),)) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(db.number_of_minima(), 2 + 30)
+        self.assertEqual(db.number_of_transition_states(), 30)
+        mode = db.engine.execute("PRAGMA journal_mode").scalar()
+        self.assertEqual(mode, "wal")
+
+    def test_next_id_locks(self):
+        from sqlalchemy.exc import OperationalError
+        from pele.storage.database import Minimum
+        db1 = Database(self.dbname, busy_timeout=0.1)
+        db2 = Database(self.dbname, busy_timeout=0.1)
+        db1.add_minima([(1., [1.])])
+        first_id = db2._next_id(Minimum)
+        # the id is reserved for db2 until it commits
+        with self.assertRaises(OperationalError):
+            db1.add_minima([(2., [2.])])
+        db1.session.rollback()
+        db2.add_minima([(3., [3.])])
+        db1.add_minima([(2., [2.])])
+        self.assertEqual(db2.getMinimum(first_id).energy, 3.)
+        self.assertEqual(sorted(m.energy for m in db1.minima()), [1., 2., 3.])
+
+    def test_retry_locked(self):
+        import threading
+        from sqlalchemy.exc import OperationalError
+        from pele.storage.database import Minimum
+        db1 = Database(self.dbname, busy_timeout=0.1)
+        db2 = Database(self.dbname, busy_timeout=0.1, busy_retries=0)
+        db1._next_id(Minimum)
+        with self.assertRaises(OperationalError):
+            db2.addMinimum(1., [1.])
+        # the lock is released after the error
+        self.assertFalse(db2.lock.locked())
+        db2.session.rollback()
+
+        db2.busy_retries = 100
+        timer = threading.Timer(0.3, db1.session.commit)
+        timer.start()
+        m = db2.addMinimum(1., [1.])
+        timer.join()
+        self.assertEqual(db1.getMinimum(m.id()).energy, 1.)
+
+        db2.addMinimum(2., [2.], commit=False)
+        self.assertTrue(db2._has_uncommitted_changes())
+        db2.session.commit()
+        self.assertFalse(db2._has_uncommitted_changes())
+
+    def test_max_n_minima_two_connections(self):
+        db1 = Database(self.dbname, concurrent=True)
+        db2 = Database(self.dbname, concurrent=True)
+        for e in [1., 2., 3.]:
+            db1.addMinimum(e, [e], max_n_minima=3)
+        # db2 removes the highest minimum, db1 must not try to remove it again
+        db2.removeMinimum(db2.minima()[-1])
+        db1.addMinimum(0., [0.], max_n_minima=3)
+        # db2 adds a minimum db1 has never seen
+        db2.addMinimum(-1., [-1.], max_n_minima=3)
+        db1.addMinimum(-2., [-2.], max_n_minima=3)
+        db1.add_minima([(-3., [-3.]), (-4., [-4.])], max_n_minima=3)
+        self.assertEqual(db2.number_of_minima(), 3)
+        self.assertEqual(sorted(m.energy for m in db2.minima()), [-4., -3., -2.])
+
+    def test_coords_store_two_connections(self):
+        db1 = Database(self.dbname, concurrent=True, coords_store=True)
+        db2 = Database(self.dbname, concurrent=True, coords_store=True)
+        m = db1.addMinimum(1., [1., 2.])
+        # the coordinate file was created by db1 after db2 opened it
+        self.assertTrue(np.all(db2.getMinimum(m.id()).coords == [1., 2.]))
+        # db2 grows the file beyond the rows mapped by db1
+        for i in range(1500):
+            db2.add_minima([(float(i + 2), [float(i), 0.])])
+        self.assertTrue(np.all(db1.getMinimum(1501).coords == [1499., 0.]))
+        self.assertEqual(db1.all_coords().shape, (1501, 2))
+
+    def test_memory(self):
+        with self.assertRaises(ValueError):
+            Database(concurrent=True)
+
+
+class TestCoordsCache(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(coords_cache_size=3 * 8 * 10)
+        self.minima = [self.db.addMinimum(float(i), np.ones(10) * i) for i in range(5)]
+        cache = self.db.coords_cache
+        cache.clear()
+        cache.hits = cache.misses = 0
+        self.db.session.expire_all()
+
+    def test_cache(self):
+        cache = self.db.coords_cache
+        m = self.minima[0]
+        self.assertEqual(m.coords[0], 0.)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.db.session.commit()
+        self.assertIn("coords", m.__dict__)
+        self.assertEqual(m.coords[0], 0.)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_size(self):
+        cache = self.db.coords_cache
+        for m in self.minima:
+            m.coords
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3 * 8 * 10)
+        self.assertIsNone(cache.get((type(self.minima[0]), self.minima[0].id())))
+
+    def test_invalidate(self):
+        cache = self.db.coords_cache
+        m1, m2, m3 = self.minima[:3]
+        key = (type(m1), m1.id())
+        for m in (m1, m2, m3):
+            m.coords
+        self.db.removeMinimum(m1)
+        self.assertIsNone(cache.get(key))
+        key = (type(m3), m3.id())
+        self.db.mergeMinima(m2, m3)
+        self.assertIsNone(cache.get(key))
+        m2.coords = np.zeros(10)
+        self.db.session.commit()
+        self.assertEqual(cache.get((type(m2), m2.id()))[0], 0.)
+        self.db.session.rollback()
+        self.assertEqual(len(cache), 0)
+
+    def test_no_cache(self):
+        db = Database(coords_cache_size=0)
+        m = db.addMinimum(0., [0.])
+        self.assertIsNone(db.coords_cache)
+        self.assertEqual(list(m.coords), [0.])
+
+
+class TestProfiler(unittest.TestCase):
+    def test_profile(self):
+        db = Database(profile=True)
+        m1 = db.addMinimum(0., [0.])
+        m2 = db.addMinimum(1., [1.])
+        db.addMinimum(0., [0.])
+        db.addTransitionState(2., [0.5], m1, m2)
+        profiler = db.profiler
+        self.assertEqual(profiler.methods["addMinimum"].count, 3)
+        self.assertEqual(profiler.methods["addTransitionState"].count, 1)
+        self.assertEqual(profiler.statements["INSERT tbl_minima"].count, 2)
+        self.assertEqual(profiler.commits.count, 3)
+        self.assertEqual(profiler.candidate_calls, 3)
+        self.assertEqual(profiler.candidate_rows, 1)
+        self.assertEqual(profiler.duplicates, 1)
+        self.assertIn("addTransitionState", profiler.report())
+
+        profiler.detach()
+        self.assertIsNone(db.profiler)
+        db.addMinimum(3., [3.])
+        self.assertEqual(profiler.methods["addMinimum"].count, 3)
+        self.assertEqual(profiler.commits.count, 3)
+
+    def test_attach(self):
+        db = Database()
+        self.assertIsNone(db.profiler)
+        profiler = DatabaseProfiler(db)
+        self.assertIs(db.profiler, profiler)
+        db.minima()
+        self.assertEqual(profiler.methods["minima"].count, 1)
+
+
+def _compare_coords(m1, m2):
+    return np.allclose(m1.coords, m2.coords, atol=0.1)
+
+
+class TestDistances(unittest.TestCase):
+    def setUp(self):
+        self.db = Database()
+        self.minima = [self.db.addMinimum(float(i), np.ones(3) * i) for i in range(4)]
+
+    def test_add_get(self):
+        m0, m1, m2, m3 = self.minima
+        self.db.add_distances([(m0, m1, 1.), (m2._id, m1._id, 2.)], "test")
+        self.assertEqual(self.db.get_distance(m1, m0, "test"), 1.)
+        self.assertEqual(self.db.get_distances([(m1, m2), (m0, m3)], "test"), [2., None])
+        self.assertIsNone(self.db.get_distance(m0, m1, "other"))
+
+        # stored distances are kept
+        self.db.add_distances([(m0, m1, 5.), (m0, m3, 3.)], "test")
+        self.assertEqual(self.db.get_distances([(m0, m1), (m0, m3)], "test"), [1., 3.])
+
+    def test_add_same_twice(self):
+        # the second batch is not committed when the first one is inserted
+        m0, m1, m2, m3 = self.minima
+        self.db.add_distances([(m0, m1, 1.), (m0, m2, 2.)], "test", commit=False)
+        self.db.add_distances([(m1, m0, 5.), (m0, m3, 3.)], "test", commit=False)
+        self.db.session.commit()
+        self.assertEqual(self.db.session.query(Distance).count(), 3)
+        self.assertEqual(self.db.get_distances([(m0, m1), (m0, m3)], "test"), [1., 3.])
+
+    def test_remove_minimum(self):
+        m0, m1, m2, m3 = self.minima
+        self.db.add_distances([(m0, m1, 1.), (m1, m2, 2.), (m2, m3, 3.)], "test")
+        self.db.removeMinimum(m1)
+        self.db.mergeMinima(m2, m3)
+        self.assertEqual(self.db.session.query(Distance).count(), 0)
+        self.assertIsNone(self.db.get_distance(m0, m1, "test"))
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inputs = []
+        for k in range(3):
+            fname = os.path.join(self.tmpdir, "in%d.sqlite" % k)
+            db = Database(fname, compareMinima=_compare_coords, coords_store=(k == 2))
+            # the odd minima of the second database are different structures
+            minima = [db.addMinimum(float(i), [float(i), float(k == 1 and i % 2)])
+                      for i in range(10)]
+            for i in range(9):
+                db.addTransitionState(10. + i, [0., 0.], minima[i], minima[i + 1])
+            db.add_property("natoms", 2)
+            db.session.close()
+            self.inputs.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def do_check(self, nproc):
+        out = Database(compareMinima=_compare_coords)
+        existing = out.addMinimum(1., [1., 0.])
+        merge_databases(out, self.inputs, nproc=nproc, window=3, verbose=False)
+        self.assertEqual(out.number_of_minima(), 15)
+        self.assertEqual(out.minima()[1], existing)
+        # the transition states of the first and third database are the same
+        self.assertEqual(out.number_of_transition_states(), 18)
+        for ts in out.transition_states():
+            m1, m2 = ts.minimum1, ts.minimum2
+            self.assertEqual(abs(m1.energy - m2.energy), 1.)
+            self.assertEqual(ts.energy, 10. + min(m1.energy, m2.energy))
+        self.assertEqual(out.get_property("natoms").value(), 2)
+
+    def test_merge(self):
+        self.do_check(1)
+
+    def test_merge_parallel(self):
+        self.do_check(2)
+
+    def test_merge_coords_store(self):
+        # the third input uses the coordinate store, the output doesn't
+        fname = os.path.join(self.tmpdir, "out.sqlite")
+        merge_databases(fname, self.inputs[2:], verbose=False).session.close()
+        out = Database(fname)
+        self.assertIsNone(out.coords_stores)
+        self.assertIsNone(out.get_property("coords_store"))
+        self.assertEqual(out.number_of_minima(), 10)
+        for m in out.minima():
+            self.assertEqual(list(m.coords), [m.energy, 0.])
+
+    def test_missing_minimum(self):
+        # the minimum of a transition state was deleted without the transition state
+        db = Database(self.inputs[0])
+        db.session.execute("DELETE FROM tbl_minima WHERE _id = 1")
+        db.session.commit()
+        db.session.close()
+        out = merge_databases(Database(), self.inputs[:1], verbose=False)
+        self.assertEqual(out.number_of_minima(), 9)
+        self.assertEqual(out.number_of_transition_states(), 8)
+
+    def test_main_system(self):
+        from pele.storage.merge import main
+        # two structures of three atoms with the same energy
+        triangle = [0., 0., 0., 1., 0., 0., 0.5, 0.8660254, 0.]
+        line = [0., 0., 0., 1., 0., 0., 2., 0., 0.]
+        inputs = []
+        for k, coords in enumerate([triangle, line]):
+            fname = os.path.join(self.tmpdir, "lj%d.sqlite" % k)
+            db = Database(fname)
+            db.addMinimum(-3., coords)
+            db.session.close()
+            inputs.append(fname)
+        for args, nminima in [([], 1), (["--system", "lj", "--natoms", "3"], 2)]:
+            fname = os.path.join(self.tmpdir, "out%d.sqlite" % nminima)
+            argv = sys.argv
+            sys.argv = ["merge", fname] + inputs + args
+            try:
+                main()
+            finally:
+                sys.argv = argv
+            self.assertEqual(Database(fname).number_of_minima(), nminima)
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.ncompare = 0
+        def compare(m1, m2):
+            self.ncompare += 1
+            return np.allclose(m1.coords, m2.coords)
+        # the fingerprint is the first coordinate
+        self.db = Database(compareMinima=compare, fingerprint=lambda x: x[0],
+                           fingerprint_accuracy=0.1)
+
+    def test_add(self):
+        m1 = self.db.addMinimum(0., [0., 0.])
+        self.assertEqual(m1.fingerprint, 0.)
+        # different fingerprint, compareMinima is not called
+        m2 = self.db.addMinimum(0., [1., 0.])
+        self.assertEqual(self.ncompare, 0)
+        self.assertNotEqual(m1, m2)
+        # same fingerprint, compareMinima decides
+        m3 = self.db.addMinimum(0., [0.05, 1.])
+        self.assertEqual(self.ncompare, 1)
+        self.assertNotEqual(m1, m3)
+        m4 = self.db.addMinimum(0., [1., 0.])
+        self.assertEqual(m4, m2)
+        self.assertEqual(self.db.number_of_minima(), 3)
+
+    def test_add_minima_loads_candidates(self):
+        for i in range(10):
+            self.db.addMinimum(0., [float(i), 0.])
+        self.db.session.expunge_all()
+        from sqlalchemy import event
+        loaded = []
+        def on_load(target, context):
+            loaded.append(target._id)
+        event.listen(Minimum, "load", on_load)
+        try:
+            self.db.add_minima([(0., [3., 1.]), (0., [5., 0.])], commit=False)
+        finally:
+            event.remove(Minimum, "load", on_load)
+        self.assertEqual(self.ncompare, 2)
+        # only the candidates with a matching fingerprint and the results are loaded
+        self.assertEqual(sorted(set(loaded)), [4, 6, 11])
+
+    def test_find(self):
+        m1 = self.db.addMinimum(0., [0., 0.])
+        self.assertEqual(self.db.findMinimum(0., [0., 0.]), m1)
+        self.assertIsNone(self.db.findMinimum(0., [1., 0.]))
+
+    def test_no_fingerprint(self):
+        # minima without a fingerprint are always compared
+        db = Database(compareMinima=self.db.compareMinima)
+        m1 = db.addMinimum(0., [0., 0.])
+        self.assertIsNone(m1.fingerprint)
+        db.fingerprint = lambda x: x[0]
+        m2 = db.addMinimum(0., [0., 0.])
+        self.assertEqual(m1, m2)
+        self.assertEqual(self.ncompare, 1)
+        db.update_fingerprints()
+        self.assertEqual(m1.fingerprint, 0.)
+
+    def test_system(self):
+        from pele.systems import LJCluster
+        system = LJCluster(6)
+        db = system.create_database()
+        x = system.get_random_configuration()
+        m = db.addMinimum(0., x)
+        # rotated, translated and permuted
+        from pele.utils.rotations import q2mx, random_q
+        x2 = np.dot(x.reshape(-1, 3), q2mx(random_q()).T)[::-1] + 1.
+        self.assertAlmostEqual(db.fingerprint(x2.flatten()), m.fingerprint)
+        self.assertEqual(db.addMinimum(0., x2.flatten()), m)
+
+
 def benchmark_number_of_minima():
     import time, sys
     import numpy as np
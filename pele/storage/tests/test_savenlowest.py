@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+import pickle
+
+import numpy as np
+
+from pele.storage.savenlowest import SaveN
+
+
+class TestSaveN(unittest.TestCase):
+    def setUp(self):
+        self.added = []
+        self.removed = []
+        self.save = SaveN(nsave=3, onMinimumAdded=self.added.append,
+                          onMinimumRemoved=self.removed.append)
+        for E in [1., 3., 2., 1.0005, 0.5, 4.]:
+            self.save.insert(E, np.ones(4) * E)
+
+    def test_insert(self):
+        self.assertEqual([m.energy for m in self.save.data], [0.5, 1., 2.])
+        self.assertEqual([m.coords[0] for m in self.save.data], [0.5, 1., 2.])
+        self.assertEqual([m.energy for m in self.added], [1., 3., 2., 0.5, 4.])
+        self.assertEqual([m.energy for m in self.removed], [3., 4.])
+        # the removed minima keep their coordinates
+        self.assertEqual([m.coords[0] for m in self.removed], [3., 4.])
+
+    def test_coords_not_shared(self):
+        m = self.save.data[-1]
+        coords = m.coords
+        coords[0] = -1.
+        self.assertEqual(m.coords[0], 2.)
+        # the row of m is reused by the next minimum
+        self.save.insert(0.1, np.zeros(4))
+        self.assertNotIn(m, self.save.data)
+        self.assertEqual(list(coords), [-1., 2., 2., 2.])
+        self.assertEqual(list(m.coords), [2.] * 4)
+        self.assertEqual(list(self.save.data[0].coords), [0.] * 4)
+
+    def test_compare(self):
+        save = SaveN(nsave=10, compareMinima=lambda m1, m2: m1.coords[0] == m2.coords[0])
+        save.insert(1., np.zeros(2))
+        save.insert(1., np.ones(2))
+        save.insert(1.0005, np.ones(2))
+        self.assertEqual(len(save.data), 2)
+
+    def test_grow(self):
+        save = SaveN(nsave=100)
+        energies = np.random.permutation(200) * 0.1
+        for E in energies:
+            save.insert(E, np.ones(3) * E)
+        self.assertEqual(len(save.data), 100)
+        saved = [m.energy for m in save.data]
+        self.assertEqual(saved, sorted(energies)[:100])
+        for m in save.data:
+            self.assertEqual(m.coords[0], m.energy)
+
+    def test_pickle(self):
+        save = pickle.loads(pickle.dumps(self.save))
+        save.insert(0.1, np.zeros(4))
+        self.assertEqual([m.energy for m in save.data], [0.1, 0.5, 1.])
+        self.assertEqual([m.coords[0] for m in save.data], [0., 0.5, 1.])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -187,6 +187,22 @@ class BaseSystem(object):
             return None
         return lambda m1, m2: compare(m1.coords, m2.coords)
 
+    def get_fingerprint(self):
+        """return a function which computes a structural fingerprint
+
+            fingerprint = get_fingerprint()(coords)
+
+        The fingerprint must be a float which is invariant under all the
+        symmetries considered by `get_compare_exact()`.  The database uses it to
+        skip the expensive structural comparison of minima which are clearly
+        different.
+        
+        See Also
+        --------
+        pele.storage.Database
+        """
+        raise NotImplementedError
+
     def get_system_properties(self):
         """return a dictionary of system specific properties.
         
@@ -231,6 +247,13 @@ class BaseSystem(object):
             # compareMinima is optional
             pass
 
+        # the structural fingerprint is optional as well
+        if not "fingerprint" in kwargs:
+            try:
+                kwargs["fingerprint"] = self.get_fingerprint()
+            except NotImplementedError:
+                pass
+
         db = Database(**kwargs)
 
         db.add_properties(self.get_system_properties(), overwrite=overwrite_properties)
@@ -6,12 +6,24 @@ from pele.transition_states import orthogopt
 from pele.mindist import MinPermDistAtomicCluster, ExactMatchAtomicCluster, \
     PointGroupOrderCluster
 from pele.landscape import smooth_path
+from pele.landscape._distance_graph import radial_distance_bound
 from pele.transition_states import NEBDriver
 
 
 __all__ = ["AtomicCluster"]
 
 
+def radius_of_gyration(coords):
+    """return the radius of gyration of a set of atoms
+
+    it is invariant under rotation, translation, inversion and permutation
+    of the atoms
+    """
+    x = np.reshape(coords, [-1, 3])
+    x = x - x.mean(axis=0)
+    return np.sqrt((x * x).sum() / x.shape[0])
+
+
 class AtomicCluster(BaseSystem):
     """
     Define an atomic cluster.  
@@ -38,6 +50,10 @@ class AtomicCluster(BaseSystem):
         permlist = self.get_permlist()
         return ExactMatchAtomicCluster(permlist=permlist, **kwargs)
 
+    def get_fingerprint(self):
+        """use the radius of gyration as fingerprint of a structure"""
+        return radius_of_gyration
+
     def get_mindist(self, **kwargs):
         """return a function which puts two structures in best alignment.
         
@@ -47,6 +63,17 @@ class AtomicCluster(BaseSystem):
         permlist = self.get_permlist()
         return MinPermDistAtomicCluster(permlist=permlist, **kwargs)
 
+    def get_double_ended_connect(self, min1, min2, database, **kwargs):
+        """return a DoubleEndedConnect object
+
+        the radial distances of the atoms bound the distance of the mindist,
+        so they are used for lazy_mindist unless another bound is given
+        """
+        if "mindist_lower_bound" not in kwargs and \
+                "mindist_lower_bound" not in self.params.double_ended_connect:
+            kwargs["mindist_lower_bound"] = radial_distance_bound
+        return super(AtomicCluster, self).get_double_ended_connect(min1, min2, database, **kwargs)
+
     def get_orthogonalize_to_zero_eigenvectors(self):
         """the zero eigenvectors correspond to 3 global translational
         degrees of freedom and 3 global rotational degrees of freedom"""
@@ -1,8 +1,26 @@
 import unittest
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import numpy as np
 from numpy import abs
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from pele.basinhopping import BasinHopping
 from pele.systems import LJCluster
+from pele.optimize import mylbfgs
+from pele.potentials import LJ
+from pele.takestep import RandomDisplacement
+
+
+def _quench(coords):
+    return mylbfgs(coords, LJ())
+
 
 class TestBasinhopping(unittest.TestCase):
     def setUp(self):
@@ -26,7 +44,183 @@ class TestBasinhopping(unittest.TestCase):
         bh.run(3)
         self.assertEnergy(bh.result.energy)
         self.assertEnergy(bh.markovE)
-        
-        
+
+
+class TestSpeculativeBasinhopping(unittest.TestCase):
+    def setUp(self):
+        natoms = 6
+        self.system = LJCluster(natoms)
+        self.e1 = -12.7120622568
+        self.e2 = -12.302927529580728
+        self.nspeculative = 3
+
+    def assertEnergy(self, e):
+        self.assertTrue( abs(e-self.e1) < 1e-4 or abs(e-self.e2) < 1e-4)
+
+    def test_speculative(self):
+        bh = self.system.get_basinhopping(outstream=None, nspeculative=self.nspeculative)
+        bh.run(10)
+        bh.close()
+        self.assertEnergy(bh.result.energy)
+        self.assertEnergy(bh.markovE)
+        self.assertEqual(bh.stepnum, 10)
+        self.assertEqual(bh.nspeculative_quenched, bh.stepnum + bh.nspeculative_wasted)
+
+    def test_always_reject(self):
+        bh = self.system.get_basinhopping(outstream=None, nspeculative=self.nspeculative,
+                                          acceptTest=lambda *args: False)
+        markovE = bh.markovE
+        bh.run(2 * self.nspeculative)
+        bh.close()
+        self.assertEqual(bh.markovE, markovE)
+        self.assertEqual(bh.nspeculative_quenched, 2 * self.nspeculative)
+        self.assertEqual(bh.nspeculative_wasted, 0)
+
+    def test_always_accept(self):
+        bh = self.system.get_basinhopping(outstream=None, nspeculative=self.nspeculative,
+                                          acceptTest=lambda *args: True)
+        bh.run(4)
+        self.assertEqual(bh.naccepted, 4)
+        self.assertEqual(bh.nspeculative_quenched, 4 * self.nspeculative)
+        self.assertEqual(bh.nspeculative_wasted, 4 * (self.nspeculative - 1))
+        self.assertGreater(bh.nfev_wasted, 0)
+        bh.close()
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.system = LJCluster(6)
+
+    def test_basinhopping(self):
+        bh = self.system.get_basinhopping(outstream=None)
+        profiler = bh.enable_profiling()
+        nfev0 = bh.result.nfev
+        bh.run(5)
+        self.assertEqual(profiler.nsteps, 5)
+        for phase in ["takestep", "quench", "confcheck", "accept", "storage",
+                      "updatestep", "events", "print"]:
+            self.assertEqual(profiler.ncalls[phase], 5)
+        self.assertGreater(profiler.times["quench"], 0)
+        nfev, counts = profiler.nfev_histogram()
+        self.assertEqual(counts.sum(), 5)
+        self.assertEqual(sum(nfev * counts), bh.result.nfev - nfev0)
+        d = profiler.as_dict()
+        self.assertAlmostEqual(d["quench"]["time"], profiler.times["quench"])
+
+        bh.disable_profiling()
+        bh.run(2)
+        self.assertEqual(profiler.nsteps, 5)
+
+    def test_print_interval(self):
+        out = StringIO()
+        bh = self.system.get_basinhopping(outstream=out)
+        bh.enable_profiling(print_interval=2)
+        nlines = len(out.getvalue().splitlines())
+        bh.run(5)
+        # the summary lines replace the step output
+        lines = out.getvalue().splitlines()[nlines:]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("MCProfile"))
+
+    def test_printstep(self):
+        out = StringIO()
+        bh = self.system.get_basinhopping(outstream=out)
+        bh.run(1)
+        line = out.getvalue().splitlines()[-1]
+        expected = ("Qu   " + str(bh.stepnum) + " E= " +
+                    str(bh.trial_energy) + " quench_steps= " +
+                    str(bh.funcalls) + " RMS= " + str(bh.rms) +
+                    " Markov E= " + str(bh.markovE_old) +
+                    " accepted= " + str(bh.acceptstep))
+        self.assertEqual(line, expected)
+
+    def test_pickle(self):
+        pot = self.system.get_potential()
+        bh = BasinHopping(self.system.get_random_configuration(), pot, RandomDisplacement(),
+                          quench=_quench, outstream=None)
+        bh.enable_profiling(outstream=sys.stdout)
+        bh2 = pickle.loads(pickle.dumps(bh))
+        self.assertIsNone(bh2.profiler)
+        self.assertIsNotNone(bh.profiler)
+
+    def test_montecarlo(self):
+        from pele.mc import MonteCarlo
+        pot = self.system.get_potential()
+        coords = self.system.get_random_configuration()
+        mc = MonteCarlo(coords, pot, self.system.get_takestep(stepsize=0.1), outstream=None)
+        profiler = mc.enable_profiling()
+        mc.run(4)
+        self.assertEqual(profiler.nsteps, 4)
+        self.assertEqual(profiler.nfev_counts, {1: 4})
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.system = LJCluster(6)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "bh.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def trajectory(self, bh, nsteps):
+        energies = []
+        for i in range(nsteps):
+            bh.run(1)
+            energies.append((bh.trial_energy, bh.markovE))
+        return energies
+
+    def test_resume_exact(self):
+        np.random.seed(0)
+        bh = self.system.get_basinhopping(outstream=None)
+        bh.run(5)
+        bh.checkpoint(self.path)
+        expected = self.trajectory(bh, 5)
+
+        bh2 = BasinHopping.resume(self.path, self.system, outstream=None)
+        self.assertEqual(bh2.stepnum, 5)
+        self.assertTrue(bh2.acceptTest.random is np.random.rand)
+        self.assertEqual(self.trajectory(bh2, 5), expected)
+        self.assertTrue(np.all(bh.coords == bh2.coords))
+        self.assertEqual(bh.takeStep.stepclass.stepsize, bh2.takeStep.stepclass.stepsize)
+        self.assertEqual(bh.result.nfev, bh2.result.nfev)
+
+    def test_resume_attributes(self):
+        bh = self.system.get_basinhopping(outstream=None)
+        bh.run(2)
+        bh.checkpoint(self.path)
+        bh2 = BasinHopping.resume(self.path, self.system, outstream=None)
+        # every attribute set by the constructor exists after a resume
+        fresh = self.system.get_basinhopping(outstream=None)
+        self.assertEqual(set(fresh.__dict__.keys()) - set(bh2.__dict__.keys()), set())
+
+    def test_keep_random_state(self):
+        bh = self.system.get_basinhopping(outstream=None)
+        bh.checkpoint(self.path)
+        np.random.seed(1)
+        state = np.random.get_state()
+        BasinHopping.resume(self.path, self.system, outstream=None, restore_random_state=False)
+        self.assertTrue(np.all(np.random.get_state()[1] == state[1]))
+
+    def test_database(self):
+        db = self.system.create_database()
+        bh = self.system.get_basinhopping(outstream=None)
+        bh.checkpoint(self.path)
+        bh2 = BasinHopping.resume(self.path, self.system, database=db, outstream=None)
+        bh2.run(2)
+        self.assertGreater(db.number_of_minima(), 0)
+
+    def test_enable_checkpointing(self):
+        bh = self.system.get_basinhopping(outstream=None)
+        bh.enable_checkpointing(self.path, interval=3)
+        bh.run(2)
+        self.assertFalse(os.path.exists(self.path))
+        bh.run(1)
+        self.assertTrue(os.path.exists(self.path))
+        bh2 = BasinHopping.resume(self.path, self.system, outstream=None)
+        self.assertEqual(bh2.stepnum, 3)
+        self.assertEqual(os.listdir(self.tmpdir), ["bh.checkpoint"])
+
+
 if __name__ == "__main__":
     unittest.main()
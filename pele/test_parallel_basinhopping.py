@@ -0,0 +1,46 @@
+import unittest
+
+from pele.parallel_basinhopping import ParallelBasinHopping
+from pele.systems import LJCluster
+
+
+class TestParallelBasinhopping(unittest.TestCase):
+    def setUp(self):
+        natoms = 6
+        self.system = LJCluster(natoms)
+        self.db = self.system.create_database()
+        self.e1 = -12.7120622568
+        self.e2 = -12.302927529580728
+
+    def assertEnergy(self, e):
+        self.assertTrue(abs(e - self.e1) < 1e-4 or abs(e - self.e2) < 1e-4)
+
+    def test_run(self):
+        nwalkers = 2
+        nsteps = 5
+        pbh = ParallelBasinHopping(self.system, database=self.db, nwalkers=nwalkers,
+                                   seed=0, outstream=None)
+        res = pbh.run(nsteps)
+        self.assertEnergy(res.energy)
+        self.assertEqual(res.nquenches, nwalkers * (nsteps + 1))
+        self.assertGreater(res.quenches_per_second, 0)
+        self.assertGreater(self.db.number_of_minima(), 0)
+        self.assertAlmostEqual(self.db.minima()[0].energy, res.energy, 6)
+
+    def test_continue(self):
+        pbh = ParallelBasinHopping(self.system, database=self.db, nwalkers=2,
+                                   seed=0, outstream=None)
+        pbh.run(2)
+        self.assertEqual(len(pbh.coords), 2)
+        res = pbh.run(3)
+        self.assertEqual(res.nquenches, 2 * 4)
+        self.assertEnergy(res.energy)
+
+    def test_bad_coords(self):
+        with self.assertRaises(ValueError):
+            ParallelBasinHopping(self.system, database=self.db, nwalkers=2,
+                                 coords=[self.system.get_random_configuration()])
+
+
+if __name__ == "__main__":
+    unittest.main()
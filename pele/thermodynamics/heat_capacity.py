@@ -56,8 +56,10 @@ def minima_to_cv(minima, kT, k):
     
     Parameters
     ----------
-    minima : list of Minimum objects
-        mimima from which to compute the thermodynamic computations
+    minima : list of Minimum objects or LandscapeArrays
+        mimima from which to compute the thermodynamic computations.  The
+        arrays returned by `Database.to_arrays()` are used without creating
+        any Minimum objects.
     kT : array
         Temperatures at which to do the calculations.  Should be normalized by the 
         Bolzmann constant (you should pass k_B*T)
@@ -69,24 +71,39 @@ def minima_to_cv(minima, kT, k):
     See DJW Energy Landscapes book page 371
     Za = P * exp(-beta Ea) / (beta * h * nu_bar)**k / O_a
     """
+    from pele.storage.landscape_arrays import LandscapeArrays
     beta = np.array(1. / kT)
     k = float(k)
-    nminima_old = len(minima)
-    minima = [m for m in minima if not m.invalid]
-    if len(minima) != nminima_old:
-        print("ignoring %s invalid minima" % (nminima_old - len(minima)))
-    energies = np.array([m.energy for m in minima])
-
-    # compute the log of the terms in the partition function
-    try:
-        lZterms = np.array([-beta * m.energy - 0.5 * m.fvib - np.log(m.pgorder) for m in minima])
-    except TypeError or AttributeError:
-        print("Error reading thermodynamic data from minima.  Have you computed the normal mode" \
-              " frequencies and point group order for all the minima?  See pele.thermodynamics " \
-              " for more information")
-        raise
-    lZterms = lZterms.transpose()
-    assert lZterms.shape == (len(beta), len(minima))
+    if isinstance(minima, LandscapeArrays):
+        valid = ~minima.min_invalid
+        if not np.all(valid):
+            print("ignoring %s invalid minima" % (len(valid) - np.count_nonzero(valid)))
+        energies = minima.min_energy[valid]
+        fvib = minima.min_fvib[valid]
+        pgorder = minima.min_pgorder[valid]
+        if np.any(np.isnan(fvib)) or np.any(np.isnan(pgorder) | (pgorder <= 0)):
+            raise ValueError("Some minima have no normal mode frequencies or point group order."
+                             "  See pele.thermodynamics for more information")
+        # compute the log of the terms in the partition function
+        lZterms = (-beta[:, np.newaxis] * energies[np.newaxis, :]
+                   - 0.5 * fvib - np.log(pgorder))
+    else:
+        nminima_old = len(minima)
+        minima = [m for m in minima if not m.invalid]
+        if len(minima) != nminima_old:
+            print("ignoring %s invalid minima" % (nminima_old - len(minima)))
+        energies = np.array([m.energy for m in minima])
+
+        # compute the log of the terms in the partition function
+        try:
+            lZterms = np.array([-beta * m.energy - 0.5 * m.fvib - np.log(m.pgorder) for m in minima])
+        except TypeError or AttributeError:
+            print("Error reading thermodynamic data from minima.  Have you computed the normal mode" \
+                  " frequencies and point group order for all the minima?  See pele.thermodynamics " \
+                  " for more information")
+            raise
+        lZterms = lZterms.transpose()
+    assert lZterms.shape == (len(beta), len(energies))
 
     # subtract out the smallest value to avoid overflow issues when lZterms is exponentiated
     lZmax = np.max(lZterms, axis=1)  #  maximum lZ for each temperature
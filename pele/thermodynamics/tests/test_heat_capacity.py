@@ -32,6 +32,30 @@ class TestHeatCapacity(unittest.TestCase):
         self.assertAlmostEqual(cvdata.Cv[1], 39.20781194, places=5)
 
 
+class TestMinimaToCvArrays(unittest.TestCase):
+    def setUp(self):
+        from pele.storage import Database
+        self.db = Database()
+        for i in range(4):
+            m = self.db.addMinimum(float(i), [float(i)])
+            m.fvib = 1. + i
+            m.pgorder = 1 + i % 2
+        self.db.session.commit()
+
+    def test_same_as_minima(self):
+        kT = np.array([.1, 1.])
+        cv1 = minima_to_cv(self.db.minima(), kT, 3)
+        cv2 = minima_to_cv(self.db.to_arrays(), kT, 3)
+        for a, b in zip(cv1, cv2):
+            self.assertTrue(np.allclose(a, b))
+
+    def test_arrays_missing_pgorder(self):
+        self.db.minima()[1].pgorder = None
+        self.db.session.commit()
+        with self.assertRaises(ValueError):
+            minima_to_cv(self.db.to_arrays(), np.array([1.]), 3)
+
+
 _ldos = np.array([[-130.4352, 0.],
                   [-130.3616, 1.30645187],
                   [-130.288, 2.33024655],
@@ -1,6 +1,8 @@
 import unittest
 import os
 import sys
+import shutil
+import tempfile
 
 import numpy as np
 
@@ -8,6 +10,7 @@ from pele.thermodynamics._normalmodes import logproduct_freq2, normalmodes,\
     NormalModeError
 from pele.thermodynamics import get_thermodynamic_information
 from pele.systems import LJCluster
+from pele.storage.migrate import migrate_copy
 
 
 class TestNormalModes(unittest.TestCase):
@@ -24,9 +27,15 @@ class TestNormalModes(unittest.TestCase):
         dbfname = os.path.join(dirname, "lj15.{}.sqlite".format(sys.version_info.major))
         if not os.path.exists(dbfname):
             raise IOError("database file %s does not exist" % dbfname)
+        self.tmpdir = tempfile.mkdtemp()
+        dbfname = migrate_copy(dbfname, os.path.join(self.tmpdir, "lj15.sqlite"))
         self.system = LJCluster(15)
         self.db = self.system.create_database(dbfname, createdb=False)
 
+    def tearDown(self):
+        self.db.session.close()
+        shutil.rmtree(self.tmpdir)
+
     def check(self, fvib_expected, coords, nzero, nnegative, metric=None):
         pot = self.system.get_potential()
         hess = pot.getHessian(coords)
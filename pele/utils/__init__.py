@@ -46,6 +46,10 @@ Histogram
 ===========
 .. automodule:: pele.utils.xyz
 
+Run logs
+========
+.. automodule:: pele.utils.runlog
+
 
 Disconnectivity Graph
 ======================
@@ -0,0 +1,114 @@
+"""a process pool which evaluates one fixed function
+
+The function is handed to the worker processes when they are forked, so it
+does not have to be picklable.  This means closures, lambdas and objects which
+hold a potential (e.g. the default quench routine of BasinHopping) can be
+evaluated in parallel.  Only the arguments and the return values are pickled.
+"""
+import sys
+import multiprocessing as mp
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__all__ = ["ForkedFunctionPool"]
+
+_worker_function = None
+
+
+def _initialize_worker(func):
+    global _worker_function
+    _worker_function = func
+
+
+def _call_worker_function(args):
+    return _worker_function(*args)
+
+
+def _get_fork_context():
+    try:
+        return mp.get_context("fork")
+    except (AttributeError, ValueError):
+        # python 2 has no contexts, but always forks on unix
+        return mp
+
+
+def _alive_worker_pids(pool):
+    """return the process ids of the running workers of a multiprocessing Pool
+
+    A worker which dies is replaced by the pool and its job is lost, so a
+    change of the pids means that a result will never arrive.
+    """
+    return set(p.pid for p in pool._pool if p.exitcode is None)
+
+
+def _apply_async_message(pool, func, job, job_id, done):
+    """evaluate func(job) in pool and put the result into the queue done
+
+    If the job fails the message ("error", job_id, repr(exception)) is put
+    instead.
+    """
+    callbacks = dict(callback=done.put)
+    if sys.version_info.major >= 3:
+        # e.g. if the result can't be sent back
+        callbacks["error_callback"] = lambda err: done.put(("error", job_id, repr(err)))
+    pool.apply_async(func, (job,), **callbacks)
+
+
+def _get_message(done, pool, pids, poll_interval, name):
+    """wait for the next message in the queue done
+
+    Raises RuntimeError if a worker of pool died, because then its result
+    will never arrive.  pids are the process ids of the workers returned by
+    `_alive_worker_pids` after the pool was created, name describes them in
+    the error message.
+    """
+    while True:
+        try:
+            return done.get(timeout=poll_interval)
+        except queue.Empty:
+            if _alive_worker_pids(pool) != pids:
+                raise RuntimeError("a %s process died" % name)
+
+
+class ForkedFunctionPool(object):
+    """evaluate `func` in a pool of forked worker processes
+
+    Parameters
+    ----------
+    func : callable
+        the function to evaluate.  It is inherited by the workers when they
+        are forked, so any state it depends on must exist at the time the pool
+        is created.
+    nproc : int
+        the number of worker processes
+
+    Examples
+    --------
+
+    >>> pool = ForkedFunctionPool(lambda x: mylbfgs(x, pot), 4)
+    >>> results = pool.map([(coords1,), (coords2,)])
+    >>> pool.close()
+    """
+    def __init__(self, func, nproc):
+        self.nproc = nproc
+        ctx = _get_fork_context()
+        self._pool = ctx.Pool(nproc, initializer=_initialize_worker, initargs=(func,))
+
+    def map(self, arglist):
+        """return [func(*args) for args in arglist] evaluated in parallel"""
+        return self._pool.map(_call_worker_function, arglist)
+
+    def imap_unordered(self, arglist):
+        """iterate over func(*args) for args in arglist in order of completion"""
+        return self._pool.imap_unordered(_call_worker_function, arglist)
+
+    def apply_async(self, args, callback=None):
+        """evaluate func(*args) asynchronously and return an AsyncResult"""
+        return self._pool.apply_async(_call_worker_function, (args,), callback=callback)
+
+    def close(self):
+        """stop the worker processes"""
+        self._pool.terminate()
+        self._pool.join()
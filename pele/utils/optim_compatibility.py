@@ -156,9 +156,9 @@ class OptimDBConverter(object):
     def ReadMinDataFast(self):
         """read min.data file
         
-        this method uses bulk database inserts.  It is *MUCH* faster this way, but 
-        you have to be careful that this and the Minimum object stays in sync.  e.g.
-        minimum.invalid must be set to false manually here.
+        this method uses the bulk insert `Database.add_minima`.  It is *MUCH*
+        faster this way.  The minima are not checked for duplicates, so that the
+        indices in ts.data stay valid.
         """
         print("reading from", self.mindata)
         indx = 0
@@ -184,14 +184,14 @@ class OptimDBConverter(object):
             min_dict = dict(energy=e, coords=coords, invalid=False,
                             fvib=fvib, pgorder=pg
             )
+            if self.pointsmin_data is None:
+                min_dict["fingerprint"] = None
             minima_dicts.append(min_dict)
 
             indx += 1
-        #            if indx % 50 == 0:
-        #                self.db.session.commit()
 
-        self.db.engine.execute(Minimum.__table__.insert(), minima_dicts)
-        self.db.session.commit()
+        minima = self.db.add_minima(minima_dicts, check_duplicates=False)
+        self.index2id = [m.id() for m in minima]
 
         print("--->finished loading %s minima" % indx)
 
@@ -234,13 +234,13 @@ class OptimDBConverter(object):
     def ReadTSdataFast(self):
         """read ts.data file
         
-        this method uses bulk database inserts.  It is *MUCH* faster this way, but 
-        you have to be careful that this and the TransitionState object stays in sync.  e.g.
-        ts.invalid must be set to false manually here.
-
+        this method uses the bulk insert `Database.add_transition_states`.  It
+        is *MUCH* faster this way.  If the minima were not read by
+        ReadMinDataFast the minimum indices in ts.data are used as database ids.
         """
         print("reading from", self.tsdata)
 
+        index2id = getattr(self, "index2id", None)
         indx = 0
         ts_dicts = []
         for line in open(self.tsdata, 'r'):
@@ -256,10 +256,9 @@ class OptimDBConverter(object):
             e, fvib = list(map(float, sline[:2]))  # get energy and fvib
             pg = int(sline[2])  # point group order
             m1indx, m2indx = list(map(int, sline[3:5]))
-            #            m1indx -= 1
-            #            m2indx -= 1
-            #            min1 = self.index2min[m1indx - 1] # minus 1 for fortran indexing
-            #            min2 = self.index2min[m2indx - 1] # minus 1 for fortran indexing
+            if index2id is not None:
+                m1indx = index2id[m1indx - 1]  # minus 1 for fortran indexing
+                m2indx = index2id[m2indx - 1]
 
             # must add transition states like this.  If you use db.addtransitionState()
             # some transition states might be assumed to be duplicates
@@ -271,10 +270,7 @@ class OptimDBConverter(object):
             ts_dicts.append(tsdict)
 
             indx += 1
-        #            if indx % 50 == 0:
-        #                self.db.session.commit()
-        self.db.engine.execute(TransitionState.__table__.insert(), ts_dicts)
-        self.db.session.commit()
+        self.db.add_transition_states(ts_dicts, check_duplicates=False)
 
         print("--->finished loading %s transition states" % indx)
 
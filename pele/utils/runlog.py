@@ -0,0 +1,248 @@
+"""
+a compact binary log of the steps of a basinhopping or monte carlo run
+
+.. currentmodule:: pele.utils.runlog
+
+.. autosummary::
+    :toctree: generated/
+
+    RunLogWriter
+    iter_run_log
+    read_run_log
+
+The log file starts with a header, followed by any number of chunks.  Each
+chunk holds the records of up to `chunk_size` steps as a little endian
+structured array with the fields
+
+    step, trial_energy, markov_energy, nfev, rms, accepted
+
+optionally followed by the quenched (trial) coordinates of those steps.  The
+file is only ever appended to, so a run can be continued into the same file,
+and a chunk which was not completely written when a job was killed is ignored
+by the reader and overwritten when the run is continued.
+
+Examples
+--------
+
+>>> bh = system.get_basinhopping()
+>>> log = RunLogWriter("bh.log", bh, save_coords=True)
+>>> bh.addEventAfterStep(log)
+>>> bh.run(100000)
+>>> log.close()
+>>> for records, coords in iter_run_log("bh.log", coords=True):
+...     print records["trial_energy"].min()
+"""
+import os
+import struct
+
+import numpy as np
+
+__all__ = ["RunLogWriter", "iter_run_log", "read_run_log"]
+
+_magic = b"PELELOG1"
+_header = struct.Struct("<8sII")
+_chunk_header = struct.Struct("<4sI")
+_chunk_magic = b"CHNK"
+_version = 1
+
+record_dtype = np.dtype([("step", "<i8"),
+                         ("trial_energy", "<f8"),
+                         ("markov_energy", "<f8"),
+                         ("nfev", "<i8"),
+                         ("rms", "<f8"),
+                         ("accepted", "u1"),
+                         ])
+
+
+def _read_header(fin):
+    data = fin.read(_header.size)
+    if len(data) < _header.size:
+        raise IOError("%s is not a pele run log" % fin.name)
+    magic, version, ncoords = _header.unpack(data)
+    if magic != _magic:
+        raise IOError("%s is not a pele run log" % fin.name)
+    if version != _version:
+        raise IOError("unsupported run log version %d" % version)
+    return ncoords
+
+
+def _complete_size(fin, ncoords):
+    """return the size of the header and the complete chunks of a run log"""
+    fin.seek(0, os.SEEK_END)
+    size = fin.tell()
+    pos = _header.size
+    while pos + _chunk_header.size <= size:
+        fin.seek(pos)
+        magic, n = _chunk_header.unpack(fin.read(_chunk_header.size))
+        if magic != _chunk_magic:
+            break
+        end = pos + _chunk_header.size + n * (record_dtype.itemsize + 8 * ncoords)
+        if end > size:
+            break
+        pos = end
+    return pos
+
+
+class RunLogWriter(object):
+    """event_after_step callable which writes every step to a binary log
+
+    Parameters
+    ----------
+    fname : string
+        the log file.  If it exists, the new steps are appended after the
+        last complete chunk.
+    driver : MonteCarlo or BasinHopping object
+        the run to log.  The writer must also be added to the events of the
+        run with `driver.addEventAfterStep(writer)`
+    save_coords : bool, optional
+        if True, also save the quenched coordinates of every step
+    chunk_size : int, optional
+        the number of steps kept in memory before a chunk is written
+
+    See Also
+    --------
+    iter_run_log, read_run_log
+    """
+    _fout = None
+
+    def __init__(self, fname, driver, save_coords=False, chunk_size=1000):
+        self.fname = fname
+        self.driver = driver
+        self.chunk_size = chunk_size
+        self.ncoords = len(driver.coords) if save_coords else 0
+
+        if os.path.isfile(fname) and os.path.getsize(fname) > 0:
+            fout = open(fname, "r+b")
+            try:
+                ncoords = _read_header(fout)
+                if ncoords != self.ncoords:
+                    raise ValueError("can't append to %s, it stores %d coordinates per step, not %d"
+                                     % (fname, ncoords, self.ncoords))
+                # drop a chunk which was cut short when a run was killed
+                fout.truncate(_complete_size(fout, ncoords))
+                fout.seek(0, os.SEEK_END)
+            except Exception:
+                fout.close()
+                raise
+            self._fout = fout
+        else:
+            self._fout = open(fname, "wb")
+            self._fout.write(_header.pack(_magic, _version, self.ncoords))
+
+        self._records = np.zeros(chunk_size, dtype=record_dtype)
+        if self.ncoords > 0:
+            self._coords = np.zeros([chunk_size, self.ncoords])
+        self._n = 0
+
+    def __call__(self, energy, coords, acceptstep):
+        driver = self.driver
+        rec = self._records[self._n]
+        rec["step"] = driver.stepnum
+        rec["trial_energy"] = driver.trial_energy
+        rec["markov_energy"] = energy
+        rec["nfev"] = getattr(driver, "funcalls", 1)
+        rec["rms"] = getattr(driver, "rms", np.nan)
+        rec["accepted"] = acceptstep
+        if self.ncoords > 0:
+            self._coords[self._n, :] = driver.trial_coords
+        self._n += 1
+        if self._n == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """write the buffered steps to the file"""
+        if self._fout is None or self._n == 0:
+            return
+        n = self._n
+        self._fout.write(_chunk_header.pack(_chunk_magic, n))
+        self._fout.write(self._records[:n].tobytes())
+        if self.ncoords > 0:
+            self._fout.write(self._coords[:n].astype("<f8").tobytes())
+        self._fout.flush()
+        self._n = 0
+
+    def close(self):
+        """write the remaining steps and close the file"""
+        if self._fout is None:
+            return
+        self.flush()
+        self._fout.close()
+        self._fout = None
+
+    def __del__(self):
+        self.close()
+
+
+def iter_run_log(fname, coords=False):
+    """iterate over the chunks of a run log
+
+    Parameters
+    ----------
+    fname : string
+    coords : bool, optional
+        if True, also return the coordinates
+
+    Yields
+    ------
+    records : numpy structured array
+        the fields are step, trial_energy, markov_energy, nfev, rms and
+        accepted
+    coords : numpy array, shape (len(records), ncoords)
+        only if `coords` is True
+    """
+    with open(fname, "rb") as fin:
+        ncoords = _read_header(fin)
+        if coords and ncoords == 0:
+            raise ValueError("the coordinates were not saved in %s" % fname)
+        coords_size = ncoords * 8
+        while True:
+            data = fin.read(_chunk_header.size)
+            if len(data) < _chunk_header.size:
+                return
+            magic, n = _chunk_header.unpack(data)
+            if magic != _chunk_magic:
+                raise IOError("%s is corrupted" % fname)
+            data = fin.read(n * record_dtype.itemsize)
+            if len(data) < n * record_dtype.itemsize:
+                return
+            records = np.frombuffer(data, dtype=record_dtype)
+            if coords_size == 0:
+                xdata = None
+            elif coords:
+                xdata = fin.read(n * coords_size)
+                if len(xdata) < n * coords_size:
+                    return
+            else:
+                pos = fin.tell()
+                fin.seek(0, os.SEEK_END)
+                if fin.tell() < pos + n * coords_size:
+                    return
+                fin.seek(pos + n * coords_size)
+            if coords:
+                yield records, np.frombuffer(xdata, dtype="<f8").reshape(n, ncoords)
+            else:
+                yield records
+
+
+def read_run_log(fname, coords=False):
+    """read a complete run log into memory
+
+    Returns
+    -------
+    records : numpy structured array
+    coords : numpy array
+        only if `coords` is True
+
+    See Also
+    --------
+    iter_run_log
+    """
+    chunks = list(iter_run_log(fname, coords=coords))
+    if coords:
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=record_dtype), np.zeros([0, 0])
+        return (np.concatenate([r for r, x in chunks]),
+                np.concatenate([x for r, x in chunks]))
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=record_dtype)
+    return np.concatenate(chunks)
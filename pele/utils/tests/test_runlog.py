@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pele.systems import LJCluster
+from pele.utils.runlog import RunLogWriter, iter_run_log, read_run_log
+
+
+class TestRunLog(unittest.TestCase):
+    def setUp(self):
+        self.system = LJCluster(6)
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "bh.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_bh(self, nsteps, save_coords=False, chunk_size=3):
+        bh = self.system.get_basinhopping(outstream=None)
+        log = RunLogWriter(self.fname, bh, save_coords=save_coords, chunk_size=chunk_size)
+        self.trial_energies = []
+        self.markov_energies = []
+        self.trial_coords = []
+        def record(energy, coords, acceptstep):
+            self.trial_energies.append(bh.trial_energy)
+            self.markov_energies.append(energy)
+            self.trial_coords.append(bh.trial_coords.copy())
+        bh.addEventAfterStep(log)
+        bh.addEventAfterStep(record)
+        bh.run(nsteps)
+        log.close()
+        return bh
+
+    def test_read(self):
+        self.run_bh(7)
+        records = read_run_log(self.fname)
+        self.assertEqual(len(records), 7)
+        self.assertEqual(list(records["step"]), list(range(1, 8)))
+        self.assertTrue(np.allclose(records["trial_energy"], self.trial_energies))
+        self.assertTrue(np.allclose(records["markov_energy"], self.markov_energies))
+        self.assertTrue(np.all(records["nfev"] > 0))
+
+    def test_chunks(self):
+        self.run_bh(7, chunk_size=3)
+        sizes = [len(records) for records in iter_run_log(self.fname)]
+        self.assertEqual(sizes, [3, 3, 1])
+
+    def test_coords(self):
+        self.run_bh(4, save_coords=True)
+        records, coords = read_run_log(self.fname, coords=True)
+        self.assertEqual(coords.shape, (4, 18))
+        self.assertTrue(np.allclose(coords, self.trial_coords))
+        # the coordinates can be skipped
+        self.assertEqual(len(read_run_log(self.fname)), 4)
+
+    def test_append(self):
+        self.run_bh(2)
+        self.run_bh(3)
+        records = read_run_log(self.fname)
+        self.assertEqual(len(records), 5)
+        with self.assertRaises(ValueError):
+            self.run_bh(1, save_coords=True)
+
+    def test_truncated(self):
+        self.run_bh(4, save_coords=True, chunk_size=2)
+        size = os.path.getsize(self.fname)
+        with open(self.fname, "rb+") as f:
+            f.truncate(size - 10)
+        records, coords = read_run_log(self.fname, coords=True)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(len(read_run_log(self.fname)), 2)
+
+    def test_truncated_append(self):
+        self.run_bh(4, save_coords=True, chunk_size=2)
+        size = os.path.getsize(self.fname)
+        with open(self.fname, "rb+") as f:
+            f.truncate(size - 10)
+        self.run_bh(3, save_coords=True, chunk_size=2)
+        records, coords = read_run_log(self.fname, coords=True)
+        self.assertEqual(len(records), 5)
+        self.assertEqual(list(records["step"]), [1, 2, 1, 2, 3])
+        self.assertTrue(np.allclose(coords[2:], self.trial_coords))
+
+    def test_not_a_log(self):
+        with open(self.fname, "w") as f:
+            f.write("Qu   1 E= -12.0\n")
+        with self.assertRaises(IOError):
+            read_run_log(self.fname)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,8 @@
+"""merge several pele databases into one
+
+the merging is implemented in pele.storage.merge
+"""
+from pele.storage.merge import main
+
+if __name__ == '__main__':
+    main()
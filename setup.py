@@ -161,6 +161,8 @@ setup(name='pele',
                 "pele.angleaxis",
                 "pele.thermodynamics",
                 "pele.rates",
+                "pele.parallel_tempering",
+                "pele.concurrent",
                 # add the test directories
                 "pele.potentials.tests",
                 "pele.potentials.test_functions",
@@ -176,6 +178,8 @@ setup(name='pele',
                 "pele.angleaxis.tests",
                 "pele.thermodynamics.tests",
                 "pele.rates.tests",
+                "pele.parallel_tempering.tests",
+                "pele.concurrent.tests",
                 ],
       ext_modules=ext_modules,
       # data files needed for the tests
@@ -194,6 +194,7 @@ setup(name='pele',
                 "pele.angleaxis",
                 "pele.thermodynamics",
                 "pele.rates",
+                "pele.parallel_tempering",
                 # add the test directories
                 "pele.potentials.tests",
                 "pele.potentials.test_functions",
@@ -209,6 +210,7 @@ setup(name='pele',
                 "pele.angleaxis.tests",
                 "pele.thermodynamics.tests",
                 "pele.rates.tests",
+                "pele.parallel_tempering.tests",
                 ],
       ext_modules=ext_modules,
       # data files needed for the tests